@@ -0,0 +1,211 @@
+"""Precomputed answers for canonical questions.
+
+The sample questions shown on the empty chat screen, any questions listed in
+`CYSTERHOOD_CANONICAL_QUESTIONS` (one per line) and the most frequent opening
+questions in the chat history are answered ahead of time by the full chain.
+The answers and their sources are stored in `answer_bundles.json`, tagged
+with a hash of the corpus files they were computed from.
+
+    python answer_bundles.py            # precompute with the default chain
+
+The app serves a bundle immediately when a chat opens with one of these
+questions, and an `AnswerBundles` refresher recomputes them in the
+background (through the loader's queue) whenever the corpus hash changes.
+Answers for an older corpus are never served; questions that fail are
+retried on the next check.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from doc_store import serialize_doc
+
+SAMPLE_QUESTIONS = [
+    "What is PCOS and what are the most common symptoms?",
+    "How does PCOS affect fertility and periods?",
+    "What lifestyle changes can help manage PCOS symptoms?",
+]
+
+BUNDLES_PATH = os.getenv("CYSTERHOOD_BUNDLES_PATH", "./answer_bundles.json")
+CANONICAL_QUESTIONS_PATH = os.getenv("CYSTERHOOD_CANONICAL_QUESTIONS", "./canonical_questions.txt")
+TOP_N = int(os.getenv("CYSTERHOOD_BUNDLE_TOP_N", "20"))
+CHECK_SECONDS = float(os.getenv("CYSTERHOOD_BUNDLE_CHECK_SECONDS", "300"))
+CORPUS_FILES = ["pcos_papers_merged.csv", "all_patient_articles_text_only.json"]
+SOURCES_PER_BUNDLE = 10
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
+
+# (path, mtime_ns, size) -> digest, so unchanged files are not re-hashed on every check.
+_DIGESTS: Dict[Tuple[str, int, int], str] = {}
+
+
+def _file_version(path: str) -> str:
+    from corpus_cache import file_digest
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _DIGESTS:
+        for stale in [k for k in _DIGESTS if k[0] == path]:
+            del _DIGESTS[stale]
+        _DIGESTS[key] = file_digest(path)
+    return _DIGESTS[key]
+
+
+def corpus_version(paths: List[str] = CORPUS_FILES) -> str:
+    """Hash of the corpus source files; missing files hash as empty."""
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(_file_version(path).encode())
+    return digest.hexdigest()[:16]
+
+
+def canonical_questions(top_n: int = TOP_N) -> List[str]:
+    """Samples, then the configured list, then the top-N logged opening questions."""
+    questions = list(SAMPLE_QUESTIONS)
+    if os.path.exists(CANONICAL_QUESTIONS_PATH):
+        with open(CANONICAL_QUESTIONS_PATH) as f:
+            questions += [line.strip() for line in f if line.strip()]
+    if top_n > 0:
+        from chat_store import CHAT_DB_PATH, ChatStore
+
+        if os.path.exists(CHAT_DB_PATH):
+            questions += ChatStore().top_questions(top_n)
+
+    seen = set()
+    unique = []
+    for question in questions:
+        key = normalize_question(question)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique
+
+
+def compute_bundles(
+    ask: Callable[[str], Tuple[str, List]], questions: List[str], version: str
+) -> dict:
+    """Answer each question with `ask`; failures are reported and listed in `failed`."""
+    bundles: Dict[str, dict] = {}
+    failed: List[str] = []
+    for question in questions:
+        try:
+            answer, docs = ask(question)
+        except Exception as e:
+            print(f"⚠️ Could not precompute '{question}': {e}")
+            failed.append(question)
+            continue
+        bundles[normalize_question(question)] = {
+            "question": question,
+            "answer": answer,
+            "sources": [serialize_doc(d) for d in docs[:SOURCES_PER_BUNDLE]],
+        }
+    return {"version": version, "generated_at": time.time(), "bundles": bundles, "failed": failed}
+
+
+def save_bundles(data: dict, path: str = BUNDLES_PATH) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_bundles(path: str = BUNDLES_PATH) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable answer bundles {path}: {e}")
+        return None
+
+
+class AnswerBundles:
+    """Serves precomputed answers and keeps them current with the corpus.
+
+    `loader` is anything with the `BackgroundLoader.submit` surface; refreshes
+    go through its queue under their own session so they never crowd out
+    users, and start only after the chain has finished loading.
+    """
+
+    def __init__(self, loader, path: str = BUNDLES_PATH, check_seconds: float = CHECK_SECONDS):
+        self.loader = loader
+        self.path = path
+        self.check_seconds = check_seconds
+        self._data = load_bundles(path) or {"version": None, "bundles": {}}
+        self._stop = threading.Event()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._data.get("version")
+
+    def lookup(self, question: str) -> Optional[Tuple[str, List[Document]]]:
+        bundle = self._data["bundles"].get(normalize_question(question))
+        # Answers built from another corpus are never served.
+        if bundle is None or self.version != corpus_version():
+            return None
+        docs = [Document(page_content=s["page_content"], metadata=s["metadata"]) for s in bundle["sources"]]
+        return bundle["answer"], docs
+
+    def start(self) -> "AnswerBundles":
+        threading.Thread(target=self._run, name="answer-bundles", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _ask(self, question: str):
+        return self.loader.submit(question, history=[], session_id="precompute").result()
+
+    def refresh(self) -> bool:
+        """Recompute if the corpus changed since the bundles were built, or
+        retry the questions that failed for the current corpus."""
+        version = corpus_version()
+        if version != self.version:
+            print(f"🔄 Refreshing answer bundles for corpus {version}")
+            data = compute_bundles(self._ask, canonical_questions(), version)
+        elif self._data.get("failed"):
+            print(f"🔄 Retrying {len(self._data['failed'])} answer bundles for corpus {version}")
+            data = compute_bundles(self._ask, self._data["failed"], version)
+            data["bundles"] = {**self._data["bundles"], **data["bundles"]}
+        else:
+            return False
+        save_bundles(data, self.path)
+        self._data = data
+        print(f"✅ {len(data['bundles'])} answer bundles ready, {len(data['failed'])} to retry")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            ready = getattr(self.loader, "ready", True)
+            if ready:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"⚠️ Answer bundle refresh failed: {e}")
+            self._stop.wait(self.check_seconds if ready else 5.0)
+
+
+if __name__ == "__main__":
+    from startup import build_default_chain
+
+    chain_call = build_default_chain()
+    version = corpus_version()
+    questions = canonical_questions()
+    print(f"🧠 Precomputing {len(questions)} answers for corpus {version}")
+    data = compute_bundles(lambda q: chain_call(q, []), questions, version)
+    save_bundles(data)
+    print(f"✅ Saved {len(data['bundles'])} answer bundles to {BUNDLES_PATH}")
@@ -0,0 +1,138 @@
+"""Thin client for `api_server.py`.
+
+`RemoteLoader` has the same surface `app.py` uses on `BackgroundLoader`
+(`state`, `ready`, `submit(...)`), so the Streamlit UI can run without loading
+any model when `CYSTERHOOD_API_URL` is set.
+"""
+
+import json
+import time
+from dataclasses import asdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from filters import RetrievalFilter
+from llm_client import AnswerUnavailable
+from scheduler import SchedulerBusy
+
+REQUEST_TIMEOUT = 120
+READY_CACHE_SECONDS = 2.0
+
+
+class RemoteDoc:
+    """Just enough of a `Document` for rendering sources."""
+
+    def __init__(self, page_content: str, metadata: Dict):
+        self.page_content = page_content
+        self.metadata = metadata
+
+
+def _docs(sources: List[dict]) -> List[RemoteDoc]:
+    return [RemoteDoc(s.get("page_content", ""), s.get("metadata", {})) for s in sources]
+
+
+class RemoteChain:
+    """Callable with the `chain_call(question, history)` contract, over HTTP."""
+
+    def __init__(self, base_url: str, session: Optional[requests.Session] = None):
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+
+    def __call__(
+        self,
+        question: str,
+        history: List[str],
+        on_token: Optional[Callable[[str], None]] = None,
+        session_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+    ) -> Tuple[str, List[RemoteDoc]]:
+        body = {
+            "question": question,
+            "history": history,
+            "session_id": session_id,
+            "conversation_id": conversation_id,
+            "filters": asdict(filters) if filters is not None else None,
+        }
+        if on_token is None:
+            response = self.session.post(
+                f"{self.base_url}/v1/ask", json=body, timeout=REQUEST_TIMEOUT
+            )
+            self._raise_for_status(response)
+            data = response.json()
+        else:
+            data = self._stream(body, on_token)
+        history.append(f"Q: {question}\nA: {data['answer']}")
+        return data["answer"], _docs(data["sources"])
+
+    def _stream(self, body: dict, on_token: Callable[[str], None]) -> dict:
+        with self.session.post(
+            f"{self.base_url}/v1/ask/stream", json=body, stream=True, timeout=REQUEST_TIMEOUT
+        ) as response:
+            self._raise_for_status(response)
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "token":
+                        on_token(data["text"])
+                    elif event == "done":
+                        return data
+                    elif event == "unavailable":
+                        raise AnswerUnavailable(data["detail"], _docs(data["sources"]))
+                    elif event == "error":
+                        raise RuntimeError(data["detail"])
+        raise RuntimeError("Stream ended without an answer")
+
+    @staticmethod
+    def _raise_for_status(response: requests.Response) -> None:
+        if response.status_code == 429:
+            raise SchedulerBusy(response.json().get("detail", "busy"))
+        if response.status_code == 503:
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if "sources" in data:
+                raise AnswerUnavailable(data["detail"], _docs(data["sources"]))
+        response.raise_for_status()
+
+    def readiness(self) -> str:
+        try:
+            response = self.session.get(f"{self.base_url}/readyz", timeout=5)
+            return response.json().get("state", "loading")
+        except requests.RequestException:
+            return "loading"
+
+
+class RemoteLoader:
+    """Drop-in for `BackgroundLoader` when the chain runs in `api_server.py`."""
+
+    READY = "ready"
+
+    def __init__(self, base_url: str, workers: int = 8):
+        self.chain_call = RemoteChain(base_url)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self._state = "loading"
+        self._checked_at = 0.0
+
+    def start(self) -> "RemoteLoader":
+        return self
+
+    @property
+    def state(self) -> str:
+        if self._state != self.READY and time.time() - self._checked_at > READY_CACHE_SECONDS:
+            self._state = self.chain_call.readiness()
+            self._checked_at = time.time()
+        return self._state
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def submit(self, *args, session_id: str = "default", **kwargs) -> Future:
+        return self._executor.submit(self.chain_call, *args, session_id=session_id, **kwargs)
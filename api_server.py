@@ -0,0 +1,157 @@
+"""HTTP API around the RAG chain.
+
+Loads the models and indexes once per host and serves them to any number of
+clients, including Streamlit running as a thin client
+(`CYSTERHOOD_API_URL=http://localhost:8000 streamlit run app.py`).
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+
+Endpoints:
+    POST /v1/ask           {"question", "history"?, "session_id"?, "conversation_id"?, "filters"?} -> JSON answer + sources
+    POST /v1/ask/stream    same body, answered as server-sent events
+    GET  /healthz          process is up
+    GET  /readyz           200 once the chain is loaded, 503 before
+    GET  /metrics          scheduler, batching and startup metrics
+
+`filters` is `{"year_min", "year_max", "corpora", "chunk_types"}` (all optional).
+When no language model answers, `/v1/ask` returns 503 with the notice to show
+in `detail` and the sources found; the stream ends with an `unavailable` event.
+"""
+
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from doc_store import serialize_doc
+from filters import RetrievalFilter
+from llm_client import AnswerUnavailable
+from metrics import REGISTRY, process_memory
+from scheduler import SchedulerBusy
+from startup import STARTUP_TIMINGS, BackgroundLoader
+
+class AskRequest(BaseModel):
+    question: str
+    history: List[str] = []
+    session_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    filters: Optional[dict] = None
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+loader = BackgroundLoader()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    loader.start()
+    yield
+
+
+app = FastAPI(title="Cysterhood RAG API", lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    body = {"state": loader.state, "queued": loader.queued}
+    return JSONResponse(body, status_code=200 if loader.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "loader": {"state": loader.state, "load_seconds": loader.load_seconds},
+        "process": {"pid": os.getpid(), **process_memory()},
+        "startup_seconds": STARTUP_TIMINGS,
+        "scheduler": loader.scheduler.stats(),
+        "metrics": REGISTRY.snapshot(),
+    }
+
+
+def _submit(request: AskRequest, **kwargs):
+    try:
+        filters = RetrievalFilter.from_dict(request.filters)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        return loader.submit(
+            request.question,
+            history=list(request.history),
+            session_id=request.session_id or "api",
+            conversation_id=request.conversation_id,
+            filters=filters,
+            **kwargs,
+        )
+    except SchedulerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@app.post("/v1/ask")
+async def ask(request: AskRequest):
+    future = _submit(request)
+    try:
+        answer, docs = await asyncio.wrap_future(future)
+    except AnswerUnavailable as e:
+        return JSONResponse(
+            {"detail": e.notice, "sources": [serialize_doc(d) for d in e.docs]}, status_code=503
+        )
+    return {"answer": answer, "sources": [serialize_doc(d) for d in docs]}
+
+
+@app.post("/v1/ask/stream")
+async def ask_stream(request: AskRequest):
+    loop = asyncio.get_running_loop()
+    tokens: asyncio.Queue = asyncio.Queue()
+
+    def on_token(token: str) -> None:
+        loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+    future = _submit(request, on_token=on_token)
+    result = asyncio.wrap_future(future)
+
+    async def events():
+        yield sse("status", {"state": loader.state})
+        while True:
+            get_token = asyncio.ensure_future(tokens.get())
+            done, _ = await asyncio.wait({get_token, result}, return_when=asyncio.FIRST_COMPLETED)
+            if get_token in done:
+                yield sse("token", {"text": get_token.result()})
+                continue
+            get_token.cancel()
+            break
+        while not tokens.empty():
+            yield sse("token", {"text": tokens.get_nowait()})
+        try:
+            answer, docs = result.result()
+        except AnswerUnavailable as e:
+            yield sse("unavailable", {"detail": e.notice, "sources": [serialize_doc(d) for d in e.docs]})
+            return
+        except Exception as e:
+            yield sse("error", {"detail": str(e)})
+            return
+        yield sse("done", {"answer": answer, "sources": [serialize_doc(d) for d in docs]})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("CYSTERHOOD_API_HOST", "0.0.0.0"),
+        port=int(os.getenv("CYSTERHOOD_API_PORT", "8000")),
+    )
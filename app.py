@@ -1,39 +1,52 @@
 import streamlit as st
-from query_rag import build_retrievers, create_rag_chain
+from answer_bundles import SAMPLE_QUESTIONS, AnswerBundles
+from chat_store import ChatStore
+from llm_client import AnswerUnavailable
+from scheduler import SchedulerBusy
+from snippets import SNIPPET_CHARS
+from startup import BackgroundLoader
 from datetime import datetime
-import json
-import time
+import html
+import os
+import uuid
 
 # ---------------------------------------------------------
-# Backend: build retrievers & RAG chain (unchanged logic)
+# Streamlit page config (first, so the page paints immediately)
 # ---------------------------------------------------------
-retrievers = build_retrievers(include_patient_data=True)
-chain_call = create_rag_chain(
-    retrievers,
-    use_multiquery=True,
-    use_rerank=True,
+st.set_page_config(
+    page_title="Cysterhood",
+    page_icon="💜",
+    layout="wide",
 )
 
+# Messages rendered per chat before "Show earlier messages"; keeps reruns
+# constant-time however long the conversation gets.
+CHAT_WINDOW = int(os.getenv("CYSTERHOOD_CHAT_WINDOW", "40"))
+CHATS_PER_PAGE = 10
+
 # ---------------------------------------------------------
-# App-level constants
+# Backend: build retrievers & RAG chain in the background
 # ---------------------------------------------------------
-APP_TITLE = "Cysterhood"
-APP_TAGLINE = "#YOUterusMatters · Evidence-based, patient-friendly PCOS answers"
+@st.cache_resource(show_spinner=False)
+def get_loader() -> BackgroundLoader:
+    """One loader per server process; models load while the UI renders.
 
-SAMPLE_QUESTIONS = [
-    "What is PCOS and what are the most common symptoms?",
-    "How does PCOS affect fertility and periods?",
-    "What lifestyle changes can help manage PCOS symptoms?",
-]
+    With CYSTERHOOD_API_URL set, the UI is a thin client of api_server.py
+    and loads no models itself.
+    """
+    api_url = os.getenv("CYSTERHOOD_API_URL")
+    if api_url:
+        from api_client import RemoteLoader
+
+        return RemoteLoader(api_url)
+    return BackgroundLoader().start()
 
 # ---------------------------------------------------------
-# Streamlit page config
+# App-level constants
 # ---------------------------------------------------------
-st.set_page_config(
-    page_title="Cysterhood",
-    page_icon="💜",
-    layout="wide",
-)
+APP_TITLE = "Cysterhood"
+APP_TAGLINE = "#YOUterusMatters · Evidence-based, patient-friendly PCOS answers"
+
 
 # ---------------------------------------------------------
 # Global styles (lavender theme + alignment)
@@ -356,6 +369,23 @@ def inject_global_styles():
             background: #ffffff;
             border: 1px solid rgba(180, 139, 255, 0.45);
         }
+        .cys-copy-row {
+            text-align: right;
+            margin-top: 0.5rem;
+        }
+        .cys-copy-btn {
+            background-color: #f0e2ff;
+            color: #5b358d;
+            border: 1px solid #c7a7ff;
+            padding: 0.3rem 0.8rem;
+            border-radius: 8px;
+            font-size: 0.8rem;
+            cursor: pointer;
+            transition: background-color 0.2s ease;
+        }
+        .cys-copy-btn:hover {
+            background-color: #e4d3ff;
+        }
 
         @keyframes cys-fade-in {
             from {
@@ -821,6 +851,18 @@ def inject_global_styles():
         unsafe_allow_html=True,
     )
 
+@st.cache_resource(show_spinner=False)
+def get_answer_bundles() -> AnswerBundles:
+    return AnswerBundles(get_loader()).start()
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_store() -> ChatStore:
+    store = ChatStore()
+    store.enforce_retention()
+    return store
+
+
 # ---------------------------------------------------------
 # Helpers: state, header, views
 # ---------------------------------------------------------
@@ -831,53 +873,89 @@ def init_state():
         st.session_state["sample_question"] = None
     if "pending_answer" not in st.session_state:
         st.session_state["pending_answer"] = False
-    if "chat_history" not in st.session_state:
-        st.session_state["chat_history"] = []
+    if "owner_id" not in st.session_state:
+        # Chats are saved under an id kept in the page URL, so they survive
+        # reloads and restarts for whoever has the link.
+        owner_id = st.query_params.get("u")
+        if not owner_id:
+            owner_id = uuid.uuid4().hex
+            st.query_params["u"] = owner_id
+        st.session_state["owner_id"] = owner_id
+    if "chat_page" not in st.session_state:
+        st.session_state["chat_page"] = 0
     if "current_chat_id" not in st.session_state:
         st.session_state["current_chat_id"] = None
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    if "message_html" not in st.session_state:
+        reset_chat_view()
 
 
-def save_chat_to_history():
-    """Save current chat to history when starting a new chat"""
-    if st.session_state["messages"] and st.session_state["current_chat_id"]:
-        # Get first user message as title
-        first_message = next((msg["content"] for msg in st.session_state["messages"] if msg["role"] == "user"), "New Chat")
-        title = first_message[:50] + "..." if len(first_message) > 50 else first_message
-        
-        # Check if this chat already exists in history
-        existing_chat = next((chat for chat in st.session_state["chat_history"] if chat["id"] == st.session_state["current_chat_id"]), None)
-        
-        if existing_chat:
-            # Update existing chat
-            existing_chat["messages"] = st.session_state["messages"].copy()
-            existing_chat["title"] = title
-            existing_chat["timestamp"] = datetime.now()
-        else:
-            # Add new chat to history
-            st.session_state["chat_history"].insert(0, {
-                "id": st.session_state["current_chat_id"],
-                "title": title,
-                "messages": st.session_state["messages"].copy(),
-                "timestamp": datetime.now()
-            })
+def add_message(role: str, content: str, persist: bool = True) -> dict:
+    """Append a message to the current chat and persist it (unless `persist` is False)."""
+    msg = new_message(role, content)
+    st.session_state["messages"].append(msg)
+    if persist:
+        get_chat_store().append_message(
+            st.session_state["owner_id"], st.session_state["current_chat_id"], msg
+        )
+    else:
+        msg["unsaved"] = True
+    return msg
 
 
 def start_new_chat():
     """Start a new chat session"""
-    save_chat_to_history()
+    get_chat_store().enforce_retention(st.session_state["owner_id"])
     st.session_state["messages"] = []
-    st.session_state["current_chat_id"] = f"chat_{int(time.time() * 1000)}"
+    st.session_state["current_chat_id"] = f"chat_{uuid.uuid4().hex}"
     st.session_state["pending_answer"] = False
+    reset_chat_view()
 
 
 def load_chat(chat_id):
-    """Load a chat from history"""
-    save_chat_to_history()
-    chat = next((c for c in st.session_state["chat_history"] if c["id"] == chat_id), None)
-    if chat:
-        st.session_state["messages"] = chat["messages"].copy()
+    """Load a chat's messages from the chat store"""
+    messages = get_chat_store().load_messages(st.session_state["owner_id"], chat_id)
+    if messages:
+        st.session_state["messages"] = messages
         st.session_state["current_chat_id"] = chat_id
         st.session_state["pending_answer"] = False
+        reset_chat_view()
+
+
+def render_chat_list():
+    """One page of saved chat titles, with newer/older paging."""
+    store = get_chat_store()
+    owner_id = st.session_state["owner_id"]
+    total = store.count_chats(owner_id)
+    if not total:
+        st.markdown('<div class="no-chats-text">No previous chats</div>', unsafe_allow_html=True)
+        return
+
+    page = min(st.session_state["chat_page"], (total - 1) // CHATS_PER_PAGE)
+    for chat in store.list_chats(owner_id, CHATS_PER_PAGE, page * CHATS_PER_PAGE):
+        if st.button(
+            chat.title,
+            key=f"chat_{chat.chat_id}",
+            use_container_width=True,
+            disabled=chat.chat_id == st.session_state.get("current_chat_id")
+        ):
+            load_chat(chat.chat_id)
+            st.rerun()
+
+    if total > CHATS_PER_PAGE:
+        newer, older = st.columns(2)
+        if newer.button("‹ Newer", key="chats_newer", disabled=page == 0, use_container_width=True):
+            st.session_state["chat_page"] = page - 1
+            st.rerun()
+        if older.button(
+            "Older ›",
+            key="chats_older",
+            disabled=(page + 1) * CHATS_PER_PAGE >= total,
+            use_container_width=True,
+        ):
+            st.session_state["chat_page"] = page + 1
+            st.rerun()
 
 
 def render_sidebar():
@@ -907,18 +985,7 @@ def render_sidebar():
         # Chat History
         st.markdown('<div class="sidebar-section-title">Your Chats</div>', unsafe_allow_html=True)
         
-        if st.session_state["chat_history"]:
-            for idx, chat in enumerate(st.session_state["chat_history"][:10]):  # Show last 10 chats
-                if st.button(
-                    chat["title"],
-                    key=f"chat_{chat['id']}_{idx}",
-                    use_container_width=True,
-                    disabled=chat["id"] == st.session_state.get("current_chat_id")
-                ):
-                    load_chat(chat["id"])
-                    st.rerun()
-        else:
-            st.markdown('<div class="no-chats-text">No previous chats</div>', unsafe_allow_html=True)
+        render_chat_list()
         
         # Spacer to push About link to bottom
         st.markdown('<div class="sidebar-spacer"></div>', unsafe_allow_html=True)
@@ -994,38 +1061,15 @@ def build_message_html(role: str, content: str) -> str:
         </div>
         """
     else:
-        # Assistant, left aligned
-        # Add copy button below assistant message
-        import json
-        import html
-        # Escape content for JavaScript - use JSON encoding which handles all special chars
-        escaped_content_js = json.dumps(content)
-        # Escape content for HTML display
+        # Assistant, left aligned, with a copy button below the message.
         escaped_content_html = html.escape(content)
-        # Generate unique ID for this button
-        import hashlib
-        button_id = f"copy-btn-{hashlib.md5(content.encode()).hexdigest()[:8]}"
+        # Newlines as entities: a blank line would end the markdown HTML block.
+        escaped_content_attr = escaped_content_html.replace("\n", "&#10;")
         copy_button_html = f"""
-        <div style="text-align: right; margin-top: 0.5rem;">
-            <button 
-                id="{button_id}"
-                data-content={escaped_content_js}
-                onclick="(function(){{const btn=document.getElementById('{button_id}');const text=JSON.parse(btn.getAttribute('data-content'));navigator.clipboard.writeText(text).then(()=>{{btn.textContent='✓ Copied!';setTimeout(()=>{{btn.textContent='📋 Copy Answer';}},2000);}}).catch(()=>alert('Failed to copy'));}})()" 
-                style="
-                    background-color: #f0e2ff; 
-                    color: #5b358d; 
-                    border: 1px solid #c7a7ff; 
-                    padding: 0.3rem 0.8rem; 
-                    border-radius: 8px; 
-                    font-size: 0.8rem; 
-                    cursor: pointer;
-                    transition: background-color 0.2s ease;
-                "
-                onmouseover="this.style.backgroundColor='#e4d3ff'"
-                onmouseout="this.style.backgroundColor='#f0e2ff'"
-            >
-                📋 Copy Answer
-            </button>
+        <div class="cys-copy-row">
+            <button class="cys-copy-btn" data-content="{escaped_content_attr}"
+                onclick="const b=this;navigator.clipboard.writeText(b.dataset.content).then(()=>{{b.textContent='✓ Copied!';setTimeout(()=>{{b.textContent='📋 Copy Answer';}},2000);}}).catch(()=>alert('Failed to copy'))"
+            >📋 Copy Answer</button>
         </div>
         """
         return f"""
@@ -1039,26 +1083,52 @@ def build_message_html(role: str, content: str) -> str:
         """
 
 
-def build_thinking_html() -> str:
+def new_message(role: str, content: str) -> dict:
+    return {"id": uuid.uuid4().hex, "role": role, "content": content}
+
+
+def message_html(msg: dict) -> str:
+    """HTML for a message, built once per message id and cached for reruns."""
+    # Chats saved before messages had ids get one on first render.
+    msg_id = msg.setdefault("id", uuid.uuid4().hex)
+    cache = st.session_state["message_html"]
+    rendered = cache.get(msg_id)
+    if rendered is None:
+        rendered = cache[msg_id] = build_message_html(msg["role"], msg["content"])
+    return rendered
+
+
+def reset_chat_view():
+    """Drop cached HTML and the scroll-back window when switching chats."""
+    st.session_state["message_html"] = {}
+    st.session_state["chat_window"] = CHAT_WINDOW
+
+
+def build_thinking_html(text: str = "Thinking…") -> str:
     """Animated 'thinking…' bubble for the assistant."""
-    return """
+    return f"""
     <div class="cys-row cys-row-assistant">
         <div class="cys-avatar cys-avatar-assistant">🤖</div>
         <div class="cys-msg cys-msg-assistant cys-thinking">
             <span class="cys-dot"></span>
             <span class="cys-dot"></span>
             <span class="cys-dot"></span>
-            <span class="cys-thinking-text">Thinking…</span>
+            <span class="cys-thinking-text">{text}</span>
         </div>
     </div>
     """
 
 
 def render_chat_history():
-    """Render all previous messages in session_state."""
-    for msg in st.session_state["messages"]:
-        html = build_message_html(msg["role"], msg["content"])
-        st.markdown(html, unsafe_allow_html=True)
+    """Render the latest messages from cached HTML; older ones load on request."""
+    messages = st.session_state["messages"]
+    hidden = max(0, len(messages) - st.session_state["chat_window"])
+    if hidden:
+        if st.button(f"⬆️ Show {min(hidden, CHAT_WINDOW)} earlier messages", key="show_earlier"):
+            st.session_state["chat_window"] += CHAT_WINDOW
+            st.rerun()
+    for msg in messages[hidden:]:
+        st.markdown(message_html(msg), unsafe_allow_html=True)
 
 
 def format_chat_for_export():
@@ -1075,6 +1145,23 @@ def format_chat_for_export():
     return "\n".join(lines)
 
 
+def rag_history(messages):
+    """Earlier Q/A turns of this chat in the `chain_call` history format (sources stripped)."""
+    turns = []
+    question = None
+    for msg in messages:
+        if msg["role"] == "user":
+            question = msg["content"]
+        elif msg.get("unsaved"):
+            # A notice shown instead of an answer is not part of the conversation.
+            question = None
+        elif question is not None:
+            answer = msg["content"].partition("\n---\n**Sources**")[0].rstrip()
+            turns.append(f"Q: {question}\nA: {answer}")
+            question = None
+    return turns
+
+
 def build_answer_with_sources(answer, docs):
     """Compose markdown block combining answer with compact sources list."""
     lines = [answer]
@@ -1111,9 +1198,14 @@ def build_answer_with_sources(answer, docs):
             pmid = meta.get("pmid", None)
             source_type = meta.get("source", "Research")
             
-            snippet = (doc.page_content or "").strip().replace("\n", " ") if hasattr(doc, 'page_content') else ""
-            if len(snippet) > 260:
-                snippet = snippet[:260].rstrip() + "..."
+            # The chain picks a query-matching snippet; otherwise show the opening
+            # (sliced first, so full texts are never copied on render).
+            snippet = meta.get("snippet")
+            if snippet is None:
+                text = (doc.page_content or "") if hasattr(doc, 'page_content') else ""
+                snippet = " ".join(text[:SNIPPET_CHARS + 1].split())
+                if len(snippet) > SNIPPET_CHARS:
+                    snippet = snippet[:SNIPPET_CHARS].rstrip() + "..."
             
             # Build title with clickable link if URL or PMID is available
             # Check if url exists and is valid
@@ -1143,15 +1235,18 @@ def build_answer_with_sources(answer, docs):
 def main():
     inject_global_styles()
     init_state()
+    loader = get_loader()
     
     # Initialize chat ID if this is a new session
     if st.session_state["current_chat_id"] is None:
-        st.session_state["current_chat_id"] = f"chat_{int(time.time() * 1000)}"
+        st.session_state["current_chat_id"] = f"chat_{uuid.uuid4().hex}"
     
     # Render sidebar
     render_sidebar()
 
     render_header()
+    if loader.state == BackgroundLoader.LOADING:
+        st.caption("💜 Loading the knowledge base… you can ask right away; your question will be answered as soon as it's ready.")
     st.markdown("")  # spacer
 
     # 1) Render either empty state or existing history
@@ -1168,14 +1263,14 @@ def main():
     if pending_sample:
         new_question = pending_sample
         st.session_state["sample_question"] = None
-        st.session_state["messages"].append({"role": "user", "content": new_question})
+        add_message("user", new_question)
         st.session_state["pending_answer"] = True
         st.rerun()
 
     # User typed a new question
     if user_text:
         new_question = user_text
-        st.session_state["messages"].append({"role": "user", "content": new_question})
+        add_message("user", new_question)
         st.session_state["pending_answer"] = True
         st.rerun()
 
@@ -1187,26 +1282,54 @@ def main():
     ):
         last_user_question = st.session_state["messages"][-1]["content"]
 
-        # Show thinking indicator
+        # Show thinking indicator (the question waits in the loader's queue
+        # until the models have finished loading)
         thinking_placeholder = st.empty()
-        thinking_placeholder.markdown(build_thinking_html(), unsafe_allow_html=True)
+        thinking_placeholder.markdown(
+            build_thinking_html("Thinking…" if loader.ready else "Getting ready…"),
+            unsafe_allow_html=True,
+        )
 
-        # Call RAG chain (same functionality as before)
-        answer, docs = chain_call(last_user_question, history=[])
+        # Opening questions may have a precomputed answer; otherwise call the RAG chain
+        bundle = None
+        persist = True
+        if len(st.session_state["messages"]) == 1:
+            bundle = get_answer_bundles().lookup(last_user_question)
+        try:
+            if bundle is not None:
+                answer, docs = bundle
+            else:
+                answer, docs = loader.submit(
+                    last_user_question,
+                    history=rag_history(st.session_state["messages"][:-1]),
+                    session_id=st.session_state["session_id"],
+                    conversation_id=f"{st.session_state['session_id']}:{st.session_state['current_chat_id']}",
+                ).result()
+        except AnswerUnavailable as e:
+            # Shown with its sources, but never saved as an answer.
+            answer, docs = e.notice, e.docs
+            persist = False
+        except SchedulerBusy:
+            answer, docs = (
+                "I'm helping a lot of people right now 💜 "
+                "Please ask again in a moment.",
+                [],
+            )
+            persist = False
+        except Exception as e:
+            print(f"❌ RAG chain call failed: {e}")
+            answer, docs = (
+                "Sorry, I couldn't load the knowledge base right now. "
+                "Please try again in a moment.",
+                [],
+            )
+            persist = False
         full_reply = build_answer_with_sources(answer, docs)
 
-        # Replace thinking bubble with final answer
-        assistant_html = build_message_html("assistant", full_reply)
-        thinking_placeholder.markdown(assistant_html, unsafe_allow_html=True)
-
-        # Save assistant message
-        st.session_state["messages"].append(
-            {"role": "assistant", "content": full_reply}
-        )
+        # Replace thinking bubble with final answer (its HTML is cached for reruns)
+        assistant_msg = add_message("assistant", full_reply, persist=persist)
+        thinking_placeholder.markdown(message_html(assistant_msg), unsafe_allow_html=True)
         st.session_state["pending_answer"] = False
-        
-        # Update chat history
-        save_chat_to_history()
 
 
 if __name__ == "__main__":
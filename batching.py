@@ -0,0 +1,162 @@
+"""Cross-request micro-batching for the embedder and the CrossEncoder.
+
+Concurrent requests each embed one query and rerank a handful of pairs. A
+`MicroBatcher` collects that work for up to `max_delay_ms` (or until
+`max_batch` items are waiting), runs one batched forward pass, and hands each
+caller back its own slice. Batch sizes and queueing delay are recorded as
+histograms in the shared metrics registry.
+
+Off by default until it has been measured on the target host; set
+`CYSTERHOOD_MICROBATCH=1` to enable it.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import REGISTRY, SIZE_BUCKETS
+
+MAX_BATCH = int(os.getenv("CYSTERHOOD_BATCH_MAX", "64"))
+MAX_DELAY_MS = float(os.getenv("CYSTERHOOD_BATCH_DELAY_MS", "5"))
+
+
+class MicroBatcher:
+    """Coalesces item lists from many callers into single `batch_fn` calls."""
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch: int = MAX_BATCH,
+        max_delay_ms: float = MAX_DELAY_MS,
+        name: str = "batcher",
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._pending: Deque[Tuple[List[Any], Future, float]] = deque()
+        self._pending_items = 0
+        self._cond = threading.Condition()
+
+        self.batch_size = REGISTRY.histogram(f"{name}.batch_size", SIZE_BUCKETS)
+        self.queue_delay = REGISTRY.histogram(f"{name}.queue_delay_seconds")
+        self.batches = REGISTRY.counter(f"{name}.batches")
+
+        self.name = name
+        self._start_worker()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_worker(self) -> None:
+        threading.Thread(target=self._worker, name=self.name, daemon=True).start()
+
+    def _after_fork(self) -> None:
+        # The worker thread does not survive fork(); pre-forked API workers need their own.
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._pending_items = 0
+        self._start_worker()
+
+    def submit(self, items: Sequence[Any]) -> Future:
+        future: Future = Future()
+        items = list(items)
+        if not items:
+            future.set_result([])
+            return future
+        with self._cond:
+            self._pending.append((items, future, time.perf_counter()))
+            self._pending_items += len(items)
+            self._cond.notify()
+        return future
+
+    def __call__(self, items: Sequence[Any]) -> List[Any]:
+        return self.submit(items).result()
+
+    def _collect(self) -> List[Tuple[List[Any], Future, float]]:
+        """Wait for work, then keep gathering until full or the delay expires."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_delay
+            while self._pending_items < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Whole requests only; an oversized request still runs (alone).
+            groups = [self._pending.popleft()]
+            size = len(groups[0][0])
+            while self._pending and size + len(self._pending[0][0]) <= self.max_batch:
+                groups.append(self._pending.popleft())
+                size += len(groups[-1][0])
+            self._pending_items -= size
+            return groups
+
+    def _worker(self) -> None:
+        while True:
+            groups = self._collect()
+            started = time.perf_counter()
+            items = [item for group_items, _, _ in groups for item in group_items]
+            for _, _, enqueued_at in groups:
+                self.queue_delay.observe(started - enqueued_at)
+            self.batch_size.observe(len(items))
+            self.batches.inc()
+
+            try:
+                results = list(self.batch_fn(items))
+            except BaseException as e:
+                for _, future, _ in groups:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for group_items, future, _ in groups:
+                future.set_result(results[offset:offset + len(group_items)])
+                offset += len(group_items)
+
+
+class BatchedEmbeddings(Embeddings):
+    """Routes `embed_query` through a shared batcher; bulk calls go direct."""
+
+    def __init__(self, inner: Embeddings, **batcher_kwargs):
+        self.inner = inner
+        self.batcher = MicroBatcher(inner.embed_documents, name="embed_batcher", **batcher_kwargs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher([text])[0]
+
+
+class BatchedReranker:
+    """`predict(pairs)` like CrossEncoder, batched across concurrent callers."""
+
+    def __init__(self, inner, **batcher_kwargs):
+        self.inner = inner
+        self.batcher = MicroBatcher(inner.predict, name="rerank_batcher", **batcher_kwargs)
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], **kwargs) -> np.ndarray:
+        # Options (batch_size, activation_fct, ...) apply to one caller's pairs
+        # only, so such calls bypass the shared batch.
+        if kwargs:
+            return np.asarray(self.inner.predict(pairs, **kwargs), dtype=np.float32)
+        return np.asarray(self.batcher(pairs), dtype=np.float32)
+
+
+def microbatching_enabled() -> bool:
+    return os.getenv("CYSTERHOOD_MICROBATCH", "0") == "1"
+
+
+def maybe_batched_embeddings(embeddings: Embeddings) -> Embeddings:
+    return BatchedEmbeddings(embeddings) if microbatching_enabled() else embeddings
+
+
+def maybe_batched_reranker(reranker):
+    return BatchedReranker(reranker) if microbatching_enabled() else reranker
@@ -0,0 +1,283 @@
+import heapq
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from filters import FACET_FIELDS, Facets, RetrievalFilter
+
+ALLOWED_CACHE_SIZE = 64
+
+
+def default_tokenizer(text: str) -> List[str]:
+    return text.split()
+
+
+def idf(n: int, df: int) -> float:
+    return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+
+class CollectionStats(NamedTuple):
+    """Document count, total length and per-term df of a whole (sharded) collection."""
+
+    docs: int
+    total_len: int
+    df: Dict[str, int]
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.docs if self.docs else 0.0
+
+
+class BM25Index:
+    """Okapi BM25 over an id-addressed, mutable document set.
+
+    Unlike `BM25Retriever` (rank_bm25 under the hood), the statistics here
+    (postings, document frequencies, document lengths, avgdl) are kept
+    incrementally, so documents can be upserted and deleted in place while
+    the index keeps serving queries.
+
+    IDF uses the non-negative Lucene form `log(1 + (N - df + 0.5) / (df + 0.5))`
+    instead of rank_bm25's epsilon floor, which depends on the mean IDF over
+    the whole vocabulary and cannot be maintained incrementally.
+
+    With `store_documents=False` the index keeps only term statistics and doc
+    ids; texts are then looked up in the shared `DocStore` when needed.
+
+    `tokenizer` analyzes documents; `query_tokenizer` (default: the same)
+    analyzes queries, e.g. `Analyzer.query`, which memoizes across indexes.
+
+    For each of `facet_fields` the index keeps the ids of the documents with
+    each metadata value, so `search(..., allowed=index.allowed(filter))`
+    scores only the postings of documents a `RetrievalFilter` admits.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        tokenizer: Callable[[str], List[str]] = default_tokenizer,
+        store_documents: bool = True,
+        query_tokenizer: Optional[Callable[[str], List[str]]] = None,
+        facet_fields: Sequence[str] = FACET_FIELDS,
+    ):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.query_tokenizer = query_tokenizer or tokenizer
+        self.store_documents = store_documents
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self._doc_len: Dict[str, int] = {}
+        self._total_len = 0
+        self.docs: Dict[str, Document] = {}
+        self.facet_fields = tuple(facet_fields)
+        self._facets: Facets = {name: {} for name in self.facet_fields}
+        self._doc_facets: Dict[str, Tuple[Tuple[str, Any], ...]] = {}
+        # Allowed-id sets per filter; cleared whenever the index changes.
+        self._allowed_cache: "OrderedDict[RetrievalFilter, Optional[Set[str]]]" = OrderedDict()
+        # Bumped on every change, so result caches can tell when rankings may differ.
+        self.generation = 0
+        self._lock = threading.RLock()
+
+    # ---------- Statistics ----------
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_len
+
+    @property
+    def avgdl(self) -> float:
+        n = len(self._doc_len)
+        return self._total_len / n if n else 0.0
+
+    def df(self, term: str) -> int:
+        return len(self._postings.get(term, ()))
+
+    def idf(self, term: str) -> float:
+        return idf(len(self._doc_len), self.df(term))
+
+    def stats(self, terms: Iterable[str]) -> CollectionStats:
+        """This index's share of the collection statistics for `terms`."""
+        with self._lock:
+            return CollectionStats(len(self._doc_len), self._total_len, {t: self.df(t) for t in terms})
+
+    # ---------- Mutation ----------
+
+    def _add(
+        self,
+        doc_id: str,
+        text: str,
+        doc: Optional[Document] = None,
+        tokens: Optional[Sequence[str]] = None,
+        metadata: Optional[dict] = None,
+    ) -> None:
+        terms = Counter(self.tokenizer(text) if tokens is None else tokens)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        # Only the distinct terms are kept (tf lives in the postings), for removal.
+        self._doc_terms[doc_id] = tuple(terms)
+        length = sum(terms.values())
+        self._doc_len[doc_id] = length
+        self._total_len += length
+        if self.store_documents and doc is not None:
+            self.docs[doc_id] = doc
+        metadata = doc.metadata if metadata is None and doc is not None else metadata
+        if metadata:
+            values = tuple(
+                (name, metadata[name]) for name in self.facet_fields if metadata.get(name) is not None
+            )
+            for name, value in values:
+                self._facets[name].setdefault(value, set()).add(doc_id)
+            self._doc_facets[doc_id] = values
+        self._allowed_cache.clear()
+        self.generation += 1
+
+    def _remove(self, doc_id: str) -> bool:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+        self.docs.pop(doc_id, None)
+        for name, value in self._doc_facets.pop(doc_id, ()):
+            ids = self._facets[name][value]
+            ids.discard(doc_id)
+            if not ids:
+                del self._facets[name][value]
+        self._allowed_cache.clear()
+        self.generation += 1
+        return True
+
+    def upsert(self, doc_id: str, doc: Document) -> None:
+        with self._lock:
+            self._remove(doc_id)
+            self._add(doc_id, doc.page_content, doc)
+
+    def delete(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._remove(doc_id)
+
+    def apply(
+        self,
+        upserts: Optional[Dict[str, Document]] = None,
+        deletes: Iterable[str] = (),
+    ) -> None:
+        """Apply a batch of changes atomically with respect to `search`."""
+        with self._lock:
+            for doc_id in deletes:
+                self._remove(doc_id)
+            for doc_id, doc in (upserts or {}).items():
+                self._remove(doc_id)
+                self._add(doc_id, doc.page_content, doc)
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Iterable[Document],
+        ids: Optional[Iterable[str]] = None,
+        **kwargs,
+    ) -> "BM25Index":
+        index = cls(**kwargs)
+        documents = list(documents)
+        if ids is None:
+            ids = [
+                d.metadata.get("doc_id") or str(i) for i, d in enumerate(documents)
+            ]
+        for doc_id, doc in zip(ids, documents):
+            index._add(doc_id, doc.page_content, doc)
+        return index
+
+    @classmethod
+    def from_texts(cls, items: Iterable[Tuple[str, str]], **kwargs) -> "BM25Index":
+        """Build from `(doc_id, text)` pairs without keeping the texts."""
+        kwargs.setdefault("store_documents", False)
+        index = cls(**kwargs)
+        for doc_id, text in items:
+            index._add(doc_id, text)
+        return index
+
+    @classmethod
+    def from_token_streams(
+        cls, items: Iterable[Tuple[str, Sequence[str], Optional[dict]]], **kwargs
+    ) -> "BM25Index":
+        """Build from `(doc_id, tokens, metadata)` analyzed ahead of time."""
+        kwargs.setdefault("store_documents", False)
+        index = cls(**kwargs)
+        for doc_id, tokens, metadata in items:
+            index._add(doc_id, "", tokens=tokens, metadata=metadata)
+        return index
+
+    # ---------- Search ----------
+
+    def allowed(self, flt: Optional[RetrievalFilter]) -> Optional[Set[str]]:
+        """Ids of the documents `flt` admits; None when it does not constrain documents."""
+        if flt is None or not flt.constrains_documents:
+            return None
+        with self._lock:
+            if flt not in self._allowed_cache:
+                self._allowed_cache[flt] = flt.doc_ids(self._facets)
+                while len(self._allowed_cache) > ALLOWED_CACHE_SIZE:
+                    self._allowed_cache.popitem(last=False)
+            return self._allowed_cache[flt]
+
+    def search(
+        self, query: str, k: int = 5, allowed: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """Return the top-k `(doc_id, score)` pairs for `query`, among `allowed` ids if given."""
+        return self.search_terms(self.query_tokenizer(query), k, allowed)
+
+    def search_terms(
+        self,
+        terms: Iterable[str],
+        k: int = 5,
+        allowed: Optional[Set[str]] = None,
+        collection: Optional[CollectionStats] = None,
+    ) -> List[Tuple[str, float]]:
+        """`search` for analyzed `terms`. With `collection` (a shard's view of the
+        whole corpus), IDF and avgdl come from it, so shard scores are comparable."""
+        with self._lock:
+            if collection is None:
+                collection = self.stats(())
+            avgdl = collection.avgdl or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(terms):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                term_idf = idf(collection.docs, collection.df.get(term, self.df(term)))
+                doc_ids = posting if allowed is None else posting.keys() & allowed
+                for doc_id in doc_ids:
+                    tf = posting[doc_id]
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + term_idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """LangChain retriever over a `BM25Index`; drop-in for `BM25Retriever`."""
+
+    index: BM25Index
+    k: int = 5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        hits = self.index.search(query, k=self.k)
+        docs = [self.index.docs.get(doc_id) for doc_id, _ in hits]
+        return [d for d in docs if d is not None]
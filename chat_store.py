@@ -0,0 +1,175 @@
+"""Persistent chat history for the Streamlit app.
+
+Messages are appended one row at a time to a sqlite file as they are sent;
+a per-chat summary row (title, last update, message count) is what the
+sidebar pages through, and a chat's messages are only read when it is
+opened. Chats older than `CYSTERHOOD_CHAT_RETENTION_DAYS`, and an owner's
+chats beyond `CYSTERHOOD_CHAT_MAX_CHATS`, are deleted.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+CHAT_DB_PATH = os.getenv("CYSTERHOOD_CHAT_DB", "./chat_history.sqlite")
+RETENTION_DAYS = float(os.getenv("CYSTERHOOD_CHAT_RETENTION_DAYS", "30"))
+MAX_CHATS_PER_OWNER = int(os.getenv("CYSTERHOOD_CHAT_MAX_CHATS", "100"))
+TITLE_CHARS = 50
+
+
+class ChatSummary(NamedTuple):
+    chat_id: str
+    title: str
+    updated_at: float
+    message_count: int
+
+
+def chat_title(first_question: str) -> str:
+    if len(first_question) > TITLE_CHARS:
+        return first_question[:TITLE_CHARS] + "..."
+    return first_question
+
+
+class ChatStore:
+    def __init__(self, path: str = CHAT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chats (
+                    chat_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS chats_owner_updated ON chats (owner, updated_at DESC)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS messages (
+                    chat_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    message_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, seq)
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections are not shareable across threads; keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    # ---------- Writes ----------
+
+    def append_message(self, owner: str, chat_id: str, message: dict) -> None:
+        """Append one message; the chat's summary row is created on its first message."""
+        now = time.time()
+        with self._connect() as conn:
+            # Take the write lock before reading the count: two tabs (or
+            # processes) appending to one chat must not compute the same seq.
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT owner, message_count FROM chats WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                title = chat_title(message["content"]) if message["role"] == "user" else "New Chat"
+                conn.execute(
+                    "INSERT INTO chats (chat_id, owner, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, owner, title, now, now),
+                )
+                seq = 0
+            elif row[0] != owner:
+                raise PermissionError(f"Chat {chat_id} belongs to another owner")
+            else:
+                seq = row[1]
+            conn.execute(
+                "INSERT INTO messages (chat_id, seq, message_id, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, seq, message["id"], message["role"], message["content"], now),
+            )
+            conn.execute(
+                "UPDATE chats SET updated_at = ?, message_count = ? WHERE chat_id = ?",
+                (now, seq + 1, chat_id),
+            )
+
+    def delete_chats(self, chat_ids: List[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM messages WHERE chat_id = ?", [(c,) for c in chat_ids])
+            conn.executemany("DELETE FROM chats WHERE chat_id = ?", [(c,) for c in chat_ids])
+
+    def enforce_retention(
+        self,
+        owner: Optional[str] = None,
+        retention_days: float = RETENTION_DAYS,
+        max_chats: int = MAX_CHATS_PER_OWNER,
+    ) -> int:
+        """Delete expired chats (and, for `owner`, those beyond `max_chats`); returns how many."""
+        conn = self._connect()
+        cutoff = time.time() - retention_days * 86400
+        expired = [r[0] for r in conn.execute("SELECT chat_id FROM chats WHERE updated_at < ?", (cutoff,))]
+        if owner is not None:
+            expired += [
+                r[0]
+                for r in conn.execute(
+                    "SELECT chat_id FROM chats WHERE owner = ? AND updated_at >= ? "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                    (owner, cutoff, max_chats),
+                )
+            ]
+        if expired:
+            self.delete_chats(expired)
+        return len(expired)
+
+    # ---------- Reads ----------
+
+    def count_chats(self, owner: str) -> int:
+        conn = self._connect()
+        return conn.execute("SELECT COUNT(*) FROM chats WHERE owner = ?", (owner,)).fetchone()[0]
+
+    def list_chats(self, owner: str, limit: int = 10, offset: int = 0) -> List[ChatSummary]:
+        """One page of an owner's chat summaries, most recently updated first."""
+        conn = self._connect()
+        return [
+            ChatSummary(*row)
+            for row in conn.execute(
+                "SELECT chat_id, title, updated_at, message_count FROM chats "
+                "WHERE owner = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (owner, limit, offset),
+            )
+        ]
+
+    def top_questions(self, limit: int) -> List[str]:
+        """Most frequent opening questions across all chats (follow-ups depend on context)."""
+        conn = self._connect()
+        return [
+            row[0]
+            for row in conn.execute(
+                "SELECT MIN(content), COUNT(*) AS n FROM messages "
+                "WHERE seq = 0 AND role = 'user' "
+                "GROUP BY lower(trim(content)) ORDER BY n DESC LIMIT ?",
+                (limit,),
+            )
+        ]
+
+    def load_messages(self, owner: str, chat_id: str) -> List[dict]:
+        conn = self._connect()
+        return [
+            {"id": message_id, "role": role, "content": content}
+            for message_id, role, content in conn.execute(
+                "SELECT m.message_id, m.role, m.content FROM messages m "
+                "JOIN chats c ON c.chat_id = m.chat_id "
+                "WHERE m.chat_id = ? AND c.owner = ? ORDER BY m.seq",
+                (chat_id, owner),
+            )
+        ]
@@ -0,0 +1,132 @@
+"""Per-conversation retrieval state for follow-up questions.
+
+A follow-up such as "what about for teenagers?" is condensed against the
+previous turn's standalone query (no LLM call). Only a follow-up that adds no
+new content terms of its own ("tell me more about that", "why?") re-scores
+the previous turn's candidate documents; anything else is retrieved fresh.
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from text_analysis import stem
+
+MAX_CONVERSATIONS = int(os.getenv("CYSTERHOOD_MAX_CONVERSATIONS", "1000"))
+PROMPT_TURNS = 2
+PROMPT_ANSWER_CHARS = 400
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can could do does for from had has have how i if in is "
+    "it its me my of on or so than that the their them then there these they this those "
+    "to was what when where which who why will with would you your about also should".split()
+)
+_ANAPHORA = frozenset("it its this these those they them their".split())
+# Mostly introduce clauses ("foods that help"), so only count at the end ("why is that?").
+_TRAILING_ANAPHORA = frozenset(("that", "such"))
+# Words that ask for more of the same rather than about something new.
+_FILLER = frozenset(
+    "tell more explain elaborate detail details else other again mean means example examples "
+    "please thanks thank ok okay really sure expand further go say said".split()
+)
+_FOLLOW_UP_OPENERS = (
+    "what about", "how about", "and ", "what if", "but ", "also ", "same ", "then ",
+    "is it", "does it", "does that", "can it", "is that", "are they", "do they",
+)
+
+
+def content_terms(text: str) -> List[str]:
+    return [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+
+
+def similarity(a: str, b: str) -> float:
+    """Cosine similarity of the content-term counts of `a` and `b`."""
+    ca, cb = Counter(content_terms(a)), Counter(content_terms(b))
+    if not ca or not cb:
+        return 0.0
+    dot = sum(n * cb[t] for t, n in ca.items())
+    return dot / (math.sqrt(sum(n * n for n in ca.values())) * math.sqrt(sum(n * n for n in cb.values())))
+
+
+def is_follow_up(question: str) -> bool:
+    text = question.strip().lower()
+    if text.startswith(_FOLLOW_UP_OPENERS):
+        return True
+    words = _WORD.findall(text)
+    return bool(set(words) & _ANAPHORA) or bool(words and words[-1] in _TRAILING_ANAPHORA)
+
+
+def new_terms(question: str, previous_query: str) -> List[str]:
+    """Content terms of `question` that `previous_query` lacks, ignoring filler
+    such as "tell me more"; compared stemmed so plurals do not count as new."""
+    seen = {stem(t) for t in content_terms(previous_query)}
+    return [t for t in content_terms(question) if t not in _FILLER and stem(t) not in seen]
+
+
+def condense(question: str, previous_query: str) -> str:
+    """Standalone retrieval query for a follow-up: the previous query plus the new terms."""
+    return " ".join([previous_query.strip()] + new_terms(question, previous_query))
+
+
+@dataclass
+class Turn:
+    question: str
+    query: str
+    answer: str = ""
+    candidates: List = field(default_factory=list)
+
+
+@dataclass
+class ConversationState:
+    turns: List[Turn] = field(default_factory=list)
+
+    @property
+    def last(self) -> Optional[Turn]:
+        return self.turns[-1] if self.turns else None
+
+    @classmethod
+    def from_history(cls, history: List[str]) -> "ConversationState":
+        """Rebuild turns (without candidates) from `"Q: ...\\nA: ..."` history entries."""
+        turns = []
+        for entry in history:
+            question, _, answer = entry.partition("\nA: ")
+            question = question[len("Q: "):] if question.startswith("Q: ") else question
+            turns.append(Turn(question=question, query=question, answer=answer))
+        return cls(turns=turns)
+
+    def prompt_history(self) -> str:
+        if not self.turns:
+            return ""
+        lines = ["Earlier in this conversation:"]
+        for turn in self.turns[-PROMPT_TURNS:]:
+            answer = turn.answer
+            if len(answer) > PROMPT_ANSWER_CHARS:
+                answer = answer[:PROMPT_ANSWER_CHARS].rstrip() + "..."
+            lines.append(f"Q: {turn.question}\nA: {answer}")
+        return "\n".join(lines) + "\n\n"
+
+
+class ConversationStore:
+    """Conversation states by id, evicting the least recently used."""
+
+    def __init__(self, max_conversations: int = MAX_CONVERSATIONS):
+        self.max_conversations = max_conversations
+        self._states: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: str, history: Optional[List[str]] = None) -> ConversationState:
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is None:
+                state = ConversationState.from_history(history or [])
+                self._states[conversation_id] = state
+                while len(self._states) > self.max_conversations:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(conversation_id)
+            return state
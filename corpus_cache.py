@@ -0,0 +1,125 @@
+"""Columnar cache of cleaned corpus tables, keyed by source file hash.
+
+Parsing and cleaning the research CSV with pandas is paid once per corpus
+version: the resulting columns are written to a NumPy `.npz` file named after
+the SHA-1 of the source file, and every later start (or worker process) reads
+that instead. Like the flat vector index, string columns are stored as one
+concatenated text blob plus character offsets, so loading a column is a
+single decode and a list of slices - no pandas import, no per-row objects.
+
+    ./corpus_cache/research-v1-<sha1[:16]>.npz
+"""
+
+import glob
+import hashlib
+import os
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+CACHE_DIR = os.getenv("CYSTERHOOD_CORPUS_CACHE", "./corpus_cache")
+# Bump when the cleaning logic changes so old caches are not reused.
+CACHE_FORMAT = 1
+KEEP_VERSIONS = 2
+
+Columns = Dict[str, List]
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(name: str, digest: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{name}-v{CACHE_FORMAT}-{digest[:16]}.npz")
+
+
+# ---------- Encoding ----------
+
+
+def _encode_column(name: str, values: List, arrays: Dict[str, np.ndarray]) -> None:
+    valid = np.array([v is not None for v in values], dtype=bool)
+    present = [v for v in values if v is not None]
+    numeric = all(
+        isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, bool)
+        for v in present
+    )
+    if numeric:
+        integral = all(isinstance(v, (int, np.integer)) for v in present)
+        data = np.zeros(len(values), dtype=np.int64 if integral else np.float64)
+        data[valid] = present
+        arrays[f"{name}.{'int' if integral else 'float'}"] = data
+    else:
+        texts = [str(v) if v is not None else "" for v in values]
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+        arrays[f"{name}.chars"] = np.frombuffer("".join(texts).encode("utf-8"), dtype=np.uint8)
+        arrays[f"{name}.offsets"] = offsets
+    arrays[f"{name}.valid"] = valid
+
+
+def _decode_column(name: str, arrays) -> List:
+    valid = arrays[f"{name}.valid"].tolist()
+    for kind in ("int", "float"):
+        if f"{name}.{kind}" in arrays:
+            return [v if ok else None for v, ok in zip(arrays[f"{name}.{kind}"].tolist(), valid)]
+    chars = arrays[f"{name}.chars"].tobytes().decode("utf-8")
+    offsets = arrays[f"{name}.offsets"].tolist()
+    return [
+        chars[start:end] if ok else None
+        for start, end, ok in zip(offsets[:-1], offsets[1:], valid)
+    ]
+
+
+def save_columns(path: str, columns: Columns) -> None:
+    """Write `columns` (equal-length lists of str/int/None) atomically."""
+    arrays: Dict[str, np.ndarray] = {"__columns__": np.array(list(columns), dtype=str)}
+    for name, values in columns.items():
+        _encode_column(name, values, arrays)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_columns(path: str) -> Columns:
+    with np.load(path, allow_pickle=False) as arrays:
+        return {name: _decode_column(name, arrays) for name in arrays["__columns__"].tolist()}
+
+
+def _prune(name: str, keep_path: str, cache_dir: str) -> None:
+    versions = sorted(
+        glob.glob(os.path.join(cache_dir, f"{name}-v*.npz")), key=os.path.getmtime, reverse=True
+    )
+    for path in [p for p in versions if p != keep_path][KEEP_VERSIONS - 1:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cached_columns(
+    source_path: str,
+    name: str,
+    build: Callable[[str], Columns],
+    cache_dir: Optional[str] = None,
+) -> Columns:
+    """Columns for the current contents of `source_path`, building them on a miss."""
+    cache_dir = cache_dir or CACHE_DIR
+    path = cache_path(name, file_digest(source_path), cache_dir)
+    if os.path.exists(path):
+        try:
+            return load_columns(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Ignoring unreadable corpus cache {path}: {e}")
+
+    columns = build(source_path)
+    try:
+        save_columns(path, columns)
+        _prune(name, path, cache_dir)
+    except OSError as e:
+        print(f"⚠️ Could not write corpus cache {path}: {e}")
+    return columns
@@ -0,0 +1,362 @@
+"""Incremental corpus ingestion.
+
+Each corpus row (a paper in `pcos_papers_merged.csv`, an article in the
+patient JSON) is identified by a stable key and fingerprinted by a content
+hash. A manifest next to each Chroma store records the hash and document ids
+of every row that was last ingested into the shared stores (Chroma and the
+`DocStore`), so a sync only embeds added or changed rows and only deletes
+what disappeared; a file lock serializes syncs from different processes.
+A live `BM25Index` belongs to one process, so its watcher keeps the rows it
+has applied in memory and catches up from those, even when another process
+(or `python corpus_sync.py`) already updated the stores.
+
+Run `python corpus_sync.py` after editing the source files (it also
+republishes any flat indexes), or let a running app pick changes up with
+`build_retrievers(watch_corpus=True)`.
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from doc_store import DocStore, jsonable_metadata
+from query_rag import (
+    iter_research_rows,
+    patient_doc_from_entry,
+    patient_doc_id,
+    patient_entry_hash,
+    research_docs_from_row,
+)
+
+RESEARCH_CSV = "pcos_papers_merged.csv"
+RESEARCH_DB = "./chroma_pcos_db_semantic"
+PATIENT_JSON = "all_patient_articles_text_only.json"
+PATIENT_DB = "./chroma_patient_db"
+MANIFEST_NAME = "corpus_manifest.json"
+UPSERT_BATCH = 256
+
+# key -> (content hash, documents for that row)
+CorpusRows = Dict[str, Tuple[str, List[Document]]]
+
+
+@dataclass
+class SyncReport:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    upserted_docs: int = 0
+    deleted_docs: int = 0
+    bootstrap: bool = False
+
+    @property
+    def is_noop(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        return (
+            f"+{len(self.added)} ~{len(self.changed)} -{len(self.removed)} rows "
+            f"({self.upserted_docs} docs upserted, {self.deleted_docs} deleted)"
+        )
+
+
+# ---------- Row sources ----------
+
+
+def research_rows(csv_path: str = RESEARCH_CSV) -> CorpusRows:
+    return {
+        key: (content_hash, research_docs_from_row(row, key))
+        for key, content_hash, row in iter_research_rows(csv_path)
+    }
+
+
+def patient_rows(json_path: str = PATIENT_JSON) -> CorpusRows:
+    with open(json_path, "r") as f:
+        raw_data = json.load(f)
+    return {
+        patient_doc_id(entry): (patient_entry_hash(entry), [patient_doc_from_entry(entry)])
+        for entry in raw_data
+    }
+
+
+# ---------- Manifest ----------
+
+
+def manifest_path_for(persist_directory: str) -> str:
+    return os.path.join(persist_directory, MANIFEST_NAME)
+
+
+def load_manifest(path: str) -> Optional[Dict[str, dict]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)["rows"]
+
+
+def save_manifest(path: str, rows: Dict[str, dict]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": 1, "rows": rows}, f)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def manifest_lock(path: str):
+    """Exclusive lock (across processes) around a manifest's read-modify-write."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def manifest_rows(rows: CorpusRows) -> Dict[str, dict]:
+    return {
+        key: {"hash": h, "doc_ids": [d.metadata["doc_id"] for d in docs]}
+        for key, (h, docs) in rows.items()
+    }
+
+
+def diff_rows(
+    current: CorpusRows, manifest: Dict[str, dict]
+) -> Tuple[List[str], List[str], List[str]]:
+    added = [k for k in current if k not in manifest]
+    changed = [
+        k for k, (h, _) in current.items() if k in manifest and manifest[k]["hash"] != h
+    ]
+    removed = [k for k in manifest if k not in current]
+    return added, changed, removed
+
+
+def _delta(rows: CorpusRows, manifest: Dict[str, dict]) -> Tuple[Dict[str, Document], List[str]]:
+    """Documents to upsert and ids to delete to go from `manifest` to `rows`."""
+    added, changed, removed = diff_rows(rows, manifest)
+    upserts: Dict[str, Document] = {}
+    for key in added + changed:
+        for doc in rows[key][1]:
+            upserts[doc.metadata["doc_id"]] = doc
+    # A changed row can lose a chunk (e.g. its fulltext was dropped).
+    stale_ids = [doc_id for key in changed + removed for doc_id in manifest[key]["doc_ids"]]
+    return upserts, [doc_id for doc_id in stale_ids if doc_id not in upserts]
+
+
+# ---------- Sync ----------
+
+
+def _adopt_legacy_entries(store, docs: List[Document]) -> None:
+    """Drop entries written by the original bulk ingest (random ids) so the
+    first sync does not duplicate them under the new stable ids."""
+    titles = {d.metadata.get("title") for d in docs}
+    for title in titles:
+        if isinstance(title, str) and title:
+            store._collection.delete(where={"title": title})
+
+
+def sync_corpus(
+    rows: CorpusRows,
+    manifest_path: str,
+    store=None,
+    bm25_index: Optional[BM25Index] = None,
+    adopt_existing: bool = True,
+    doc_store: Optional[DocStore] = None,
+    corpus: str = "",
+    applied: Optional[Dict[str, dict]] = None,
+) -> SyncReport:
+    """Bring `store` and `doc_store` in line with `rows`, touching only the delta
+    from the manifest, and `bm25_index` from `applied` (the rows it reflects,
+    updated in place; defaults to the manifest)."""
+    with manifest_lock(manifest_path):
+        manifest = load_manifest(manifest_path)
+        report = SyncReport(bootstrap=manifest is None)
+        manifest = manifest or {}
+
+        if doc_store is not None and doc_store.count(corpus) == 0:
+            # The doc store may be newer than the manifest; fill it completely once.
+            doc_store.upsert(
+                corpus, {d.metadata["doc_id"]: d for _, docs in rows.values() for d in docs}
+            )
+
+        report.added, report.changed, report.removed = diff_rows(rows, manifest)
+        upserts, deletes = _delta(rows, manifest)
+
+        # Texts land first and leave last, so live handles always resolve.
+        if doc_store is not None and upserts:
+            doc_store.upsert(corpus, upserts)
+
+        if store is not None and not report.is_noop:
+            if report.bootstrap and adopt_existing:
+                _adopt_legacy_entries(store, list(upserts.values()))
+            if deletes:
+                store.delete(ids=deletes)
+            items = list(upserts.items())
+            for start in range(0, len(items), UPSERT_BATCH):
+                batch = items[start:start + UPSERT_BATCH]
+                store.add_texts(
+                    texts=[doc.page_content for _, doc in batch],
+                    metadatas=[jsonable_metadata(doc.metadata, drop_none=True) for _, doc in batch],
+                    ids=[doc_id for doc_id, _ in batch],
+                )
+
+        if bm25_index is not None:
+            index_upserts, index_deletes = _delta(rows, manifest if applied is None else applied)
+            if index_upserts or index_deletes:
+                bm25_index.apply(upserts=index_upserts, deletes=index_deletes)
+                print(f"🔄 BM25 index updated: {len(index_upserts)} upserted, {len(index_deletes)} deleted")
+            if applied is not None:
+                applied.clear()
+                applied.update(manifest_rows(rows))
+
+        if doc_store is not None and deletes:
+            doc_store.delete(deletes)
+
+        report.upserted_docs = len(upserts)
+        report.deleted_docs = len(deletes)
+        if not report.is_noop:
+            save_manifest(manifest_path, manifest_rows(rows))
+    return report
+
+
+def sync_research_corpus(
+    csv_path: str = RESEARCH_CSV,
+    store=None,
+    bm25_index: Optional[BM25Index] = None,
+    persist_directory: str = RESEARCH_DB,
+    doc_store: Optional[DocStore] = None,
+    applied: Optional[Dict[str, dict]] = None,
+) -> SyncReport:
+    print(f"🔄 Syncing research corpus from: {csv_path}")
+    report = sync_corpus(
+        research_rows(csv_path),
+        manifest_path_for(persist_directory),
+        store=store,
+        bm25_index=bm25_index,
+        doc_store=doc_store,
+        corpus="research",
+        applied=applied,
+    )
+    print(f"✅ Research corpus synced: {report.summary()}")
+    return report
+
+
+def sync_patient_corpus(
+    json_path: str = PATIENT_JSON,
+    store=None,
+    bm25_index: Optional[BM25Index] = None,
+    persist_directory: str = PATIENT_DB,
+    doc_store: Optional[DocStore] = None,
+) -> SyncReport:
+    print(f"🔄 Syncing patient corpus from: {json_path}")
+    report = sync_corpus(
+        patient_rows(json_path),
+        manifest_path_for(persist_directory),
+        store=store,
+        bm25_index=bm25_index,
+        doc_store=doc_store,
+        corpus="patient",
+    )
+    print(f"✅ Patient corpus synced: {report.summary()}")
+    return report
+
+
+def republish_flat_index(report: SyncReport, store, flat_directory: str) -> bool:
+    """Re-export the flat index at `flat_directory`, if there is one and the sync
+    changed anything; readers pick the new version up on their next query."""
+    from flat_index import FlatVectorIndex, build_flat_index, flat_index_exists
+
+    if report.is_noop or not flat_index_exists(flat_directory):
+        return False
+    build_flat_index(store, flat_directory, dtype=FlatVectorIndex(flat_directory).current.dtype)
+    return True
+
+
+# ---------- Live watcher ----------
+
+
+class CorpusWatcher(threading.Thread):
+    """Polls the research CSV and applies incremental syncs in the background.
+
+    With `flat_directory`, the flat export there is republished after each
+    sync, so the vector side stays in step with BM25.
+    """
+
+    def __init__(
+        self,
+        csv_path: str,
+        store,
+        bm25_index: BM25Index,
+        interval: float = 30.0,
+        persist_directory: str = RESEARCH_DB,
+        doc_store: Optional[DocStore] = None,
+        flat_directory: Optional[str] = None,
+    ):
+        super().__init__(name="corpus-watcher", daemon=True)
+        self.csv_path = csv_path
+        self.store = store
+        self.bm25_index = bm25_index
+        self.doc_store = doc_store
+        self.interval = interval
+        self.persist_directory = persist_directory
+        self.flat_directory = flat_directory
+        # Rows this process's BM25 index reflects: what was ingested when it was built.
+        self.applied = load_manifest(manifest_path_for(persist_directory)) or {}
+        self._signature = None
+        self._stop_event = threading.Event()
+
+    def _file_signature(self):
+        stat = os.stat(self.csv_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                signature = self._file_signature()
+                if signature != self._signature:
+                    report = sync_research_corpus(
+                        self.csv_path,
+                        store=self.store,
+                        bm25_index=self.bm25_index,
+                        persist_directory=self.persist_directory,
+                        doc_store=self.doc_store,
+                        applied=self.applied,
+                    )
+                    if self.flat_directory is not None:
+                        republish_flat_index(report, self.store, self.flat_directory)
+                    self._signature = signature
+            except Exception as e:
+                print(f"❌ Corpus sync failed: {e}")
+            self._stop_event.wait(self.interval)
+
+
+if __name__ == "__main__":
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from langchain_community.vectorstores import Chroma
+
+    embeddings = HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2"
+    )
+    started = time.time()
+    research_store = Chroma(persist_directory=RESEARCH_DB, embedding_function=embeddings)
+    patient_store = Chroma(persist_directory=PATIENT_DB, embedding_function=embeddings)
+    doc_store = DocStore()
+    research_report = sync_research_corpus(store=research_store, doc_store=doc_store)
+    patient_report = sync_patient_corpus(store=patient_store, doc_store=doc_store)
+
+    # Flat indexes are read-only snapshots; republish any that exist.
+    from flat_index import PATIENT_FLAT_DIR, RESEARCH_FLAT_DIR
+
+    republish_flat_index(research_report, research_store, RESEARCH_FLAT_DIR)
+    republish_flat_index(patient_report, patient_store, PATIENT_FLAT_DIR)
+    print(f"⏱️ Sync finished in {time.time() - started:.1f}s")
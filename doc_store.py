@@ -0,0 +1,238 @@
+"""Compact, shared document store.
+
+Document texts and metadata for both corpora live once, in a single sqlite
+file addressed by the stable doc ids `corpus_sync` assigns. Worker processes
+share it through the page cache instead of each holding its own pandas frame
+and `Document` lists; retrieval passes `DocHandle`s around and only
+materializes `Document`s (or bare texts, for reranking) for the final few.
+
+The store is written by `python corpus_sync.py`.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from snippets import SentenceIndex, analyze_sentences, pack_offsets, unpack_offsets
+from text_analysis import ANALYZER, Analyzer
+
+DOC_STORE_PATH = "./doc_store.sqlite"
+# Sources sent to clients only need a preview; full papers would dominate the payload.
+SOURCE_TEXT_CHARS = int(os.getenv("CYSTERHOOD_API_SOURCE_CHARS", "1000"))
+# sqlite's default limit on bound parameters is 999 on older builds.
+_ID_CHUNK = 900
+
+
+class DocHandle(NamedTuple):
+    """A retrieved document by reference: no text, just identity and score."""
+
+    doc_id: str
+    score: float
+    corpus: str = ""
+
+
+class DocStore:
+    def __init__(self, path: str = DOC_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS docs (
+                    doc_id TEXT PRIMARY KEY,
+                    corpus TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS docs_corpus ON docs (corpus)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # Columns added after the first release; older rows are filled on the next sync.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(docs)")}
+            for column, kind in (
+                ("sentences", "BLOB"),
+                ("terms", "TEXT"),
+                ("terms_version", "INTEGER"),
+                ("term_starts", "BLOB"),
+            ):
+                if column not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE docs ADD COLUMN {column} {kind}")
+                    except sqlite3.OperationalError as e:
+                        # Another process opening the same store added it first.
+                        if "duplicate column" not in str(e):
+                            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections are not shareable across threads; keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    # ---------- Writes ----------
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+
+    def upsert(self, corpus: str, docs: Dict[str, Document]) -> None:
+        rows = [
+            (doc_id, corpus, doc.page_content, json.dumps(jsonable_metadata(doc.metadata)))
+            + _analyzed(analyze_sentences(doc.page_content, ANALYZER), ANALYZER)
+            for doc_id, doc in docs.items()
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO docs "
+                "(doc_id, corpus, text, metadata, sentences, term_starts, terms, terms_version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if rows:
+                self._bump_version(conn)
+
+    def delete(self, doc_ids: Iterable[str]) -> None:
+        doc_ids = list(doc_ids)
+        with self._connect() as conn:
+            for chunk in _chunks(doc_ids):
+                conn.execute(
+                    f"DELETE FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk
+                )
+            if doc_ids:
+                self._bump_version(conn)
+
+    # ---------- Reads ----------
+
+    def version(self) -> int:
+        """Bumped by every write that adds, changes or removes documents."""
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def count(self, corpus: Optional[str] = None) -> int:
+        conn = self._connect()
+        if corpus is None:
+            return conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM docs WHERE corpus = ?", (corpus,)).fetchone()[0]
+
+    def _select(self, columns: str, doc_ids: Sequence[str]) -> Dict[str, tuple]:
+        conn = self._connect()
+        found: Dict[str, tuple] = {}
+        for chunk in _chunks(list(doc_ids)):
+            for row in conn.execute(
+                f"SELECT doc_id, {columns} FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                found[row[0]] = row[1:]
+        return found
+
+    def get_texts(self, doc_ids: Sequence[str]) -> Dict[str, str]:
+        return {doc_id: row[0] for doc_id, row in self._select("text", doc_ids).items()}
+
+    def get_metadata(self, doc_ids: Sequence[str]) -> Dict[str, dict]:
+        return {doc_id: json.loads(row[0]) for doc_id, row in self._select("metadata", doc_ids).items()}
+
+    def get_sentence_indexes(
+        self, doc_ids: Sequence[str], analyzer: Analyzer = ANALYZER
+    ) -> Dict[str, SentenceIndex]:
+        """Per-sentence terms computed at index time (missing for older rows)."""
+        return {
+            doc_id: SentenceIndex(unpack_offsets(row[0]), unpack_offsets(row[1]), row[2].split())
+            for doc_id, row in self._select("sentences, term_starts, terms, terms_version", doc_ids).items()
+            if row[1] is not None and row[3] == analyzer.version
+        }
+
+    def get_documents(self, doc_ids: Sequence[str]) -> List[Document]:
+        """Materialize documents in the given order; unknown ids are skipped."""
+        found = self._select("text, metadata", doc_ids)
+        return [
+            Document(page_content=found[doc_id][0], metadata=json.loads(found[doc_id][1]))
+            for doc_id in doc_ids
+            if doc_id in found
+        ]
+
+    def iter_terms(
+        self, corpus: str, analyzer: Analyzer = ANALYZER
+    ) -> Iterator[Tuple[str, List[str], dict]]:
+        """Yield `(doc_id, terms, metadata)` for `corpus` from the stored token streams.
+
+        Rows analyzed by another analyzer version (or none, or not by sentence)
+        are analyzed now and written back once the iteration finishes.
+        """
+        conn = self._connect()
+        stale: List[tuple] = []
+        for doc_id, text, terms, version, analyzed, metadata in conn.execute(
+            "SELECT doc_id, text, terms, terms_version, term_starts IS NOT NULL, metadata FROM docs "
+            "WHERE corpus = ? ORDER BY doc_id",
+            (corpus,),
+        ):
+            if version == analyzer.version and terms is not None and analyzed:
+                yield doc_id, terms.split(), json.loads(metadata)
+                continue
+            index = analyze_sentences(text, analyzer)
+            stale.append(_analyzed(index, analyzer) + (doc_id,))
+            yield doc_id, index.terms, json.loads(metadata)
+        if stale:
+            with conn:
+                conn.executemany(
+                    "UPDATE docs SET sentences = ?, term_starts = ?, terms = ?, terms_version = ? "
+                    "WHERE doc_id = ?",
+                    stale,
+                )
+
+    def iter_corpus(self, corpus: str) -> Iterator[Tuple[str, str]]:
+        """Yield `(doc_id, text)` for every document of `corpus`, in id order."""
+        conn = self._connect()
+        yield from conn.execute(
+            "SELECT doc_id, text FROM docs WHERE corpus = ? ORDER BY doc_id", (corpus,)
+        )
+
+
+def doc_store_exists(path: str = DOC_STORE_PATH) -> bool:
+    return os.path.exists(path)
+
+
+def _analyzed(index: SentenceIndex, analyzer: Analyzer) -> tuple:
+    """The `sentences, term_starts, terms, terms_version` column values."""
+    return (
+        pack_offsets(index.offsets),
+        pack_offsets(index.term_starts),
+        " ".join(index.terms),
+        analyzer.version,
+    )
+
+
+def _chunks(items: List[str]):
+    for start in range(0, len(items), _ID_CHUNK):
+        yield items[start:start + _ID_CHUNK]
+
+
+def jsonable_metadata(metadata: dict, drop_none: bool = False) -> dict:
+    """`metadata` with plain JSON scalars: numpy scalars unwrapped, NaN as None,
+    anything else as str. `drop_none` leaves out missing values (for Chroma)."""
+    clean = {}
+    for key, value in metadata.items():
+        if hasattr(value, "item"):  # numpy scalars from pandas
+            value = value.item()
+        if isinstance(value, float) and value != value:  # NaN
+            value = None
+        if value is None and drop_none:
+            continue
+        clean[key] = value if value is None or isinstance(value, (str, int, float, bool)) else str(value)
+    return clean
+
+
+def serialize_doc(doc) -> dict:
+    """A source as JSON, its text cut to a `SOURCE_TEXT_CHARS` preview."""
+    return {
+        "page_content": (getattr(doc, "page_content", "") or "")[:SOURCE_TEXT_CHARS],
+        "metadata": jsonable_metadata(getattr(doc, "metadata", {}) or {}),
+    }
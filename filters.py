@@ -0,0 +1,139 @@
+"""Metadata filters pushed down into retrieval.
+
+A `RetrievalFilter` restricts a question to a year range, some corpora
+and/or some chunk types. It is applied where the candidates are produced,
+not to the final documents:
+
+- corpora: retrievers of other corpora are not searched at all
+- Chroma: the filter becomes the collection query's `where` clause
+- flat index: only the matching rows (cached per snapshot) are scored
+- BM25: postings are intersected with the matching doc-id set, built from
+  per-value id sets the index maintains for `FACET_FIELDS`
+
+Documents without a field never match a constraint on it (patient articles
+have no year). The legacy Document-based retrievers can only post-filter.
+"""
+
+from dataclasses import dataclass, fields
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+FACET_FIELDS = ("year", "chunk_type")
+
+Facets = Dict[str, Dict[object, Set[str]]]
+
+
+def _as_tuple(name: str, values) -> Optional[Tuple[str, ...]]:
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, (list, tuple, set, frozenset)) or not all(
+        isinstance(v, str) for v in values
+    ):
+        raise ValueError(f"{name} must be a list of strings, got {values!r}")
+    return tuple(sorted(set(values)))
+
+
+def _check_year(name: str, value) -> None:
+    # bool is an int subclass, but never a year.
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+        raise ValueError(f"{name} must be an integer year, got {value!r}")
+
+
+@dataclass(frozen=True)
+class RetrievalFilter:
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    corpora: Optional[Tuple[str, ...]] = None
+    chunk_types: Optional[Tuple[str, ...]] = None
+
+    def __post_init__(self):
+        # Checked here, so bad API input is a ValueError (422) rather than a failure mid-search.
+        _check_year("year_min", self.year_min)
+        _check_year("year_max", self.year_max)
+        if self.year_min is not None and self.year_max is not None and self.year_min > self.year_max:
+            raise ValueError(f"year_min {self.year_min} is after year_max {self.year_max}")
+        # Normalized so equal filters hash equally (they key the id-set caches).
+        object.__setattr__(self, "corpora", _as_tuple("corpora", self.corpora))
+        object.__setattr__(self, "chunk_types", _as_tuple("chunk_types", self.chunk_types))
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> Optional["RetrievalFilter"]:
+        """Parse `{"year_min", "year_max", "corpora", "chunk_types"}`; None if empty."""
+        if not data:
+            return None
+        unknown = set(data) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown filter fields: {sorted(unknown)}")
+        flt = cls(**{key: value for key, value in data.items() if value is not None})
+        return None if flt.is_empty else flt
+
+    @property
+    def is_empty(self) -> bool:
+        return self == RetrievalFilter()
+
+    @property
+    def constrains_documents(self) -> bool:
+        return any(v is not None for v in (self.year_min, self.year_max, self.chunk_types))
+
+    def allows_corpus(self, corpus: str) -> bool:
+        return self.corpora is None or corpus in self.corpora
+
+    def _year_in_range(self, year) -> bool:
+        if not isinstance(year, (int, float)) or year != year:  # missing or NaN
+            return False
+        return (self.year_min is None or year >= self.year_min) and (
+            self.year_max is None or year <= self.year_max
+        )
+
+    def matches(self, metadata: dict, corpus: Optional[str] = None) -> bool:
+        if corpus is not None and not self.allows_corpus(corpus):
+            return False
+        if (self.year_min is not None or self.year_max is not None) and not self._year_in_range(
+            metadata.get("year")
+        ):
+            return False
+        if self.chunk_types is not None and metadata.get("chunk_type") not in self.chunk_types:
+            return False
+        return True
+
+    def chroma_where(self) -> Optional[dict]:
+        clauses = []
+        if self.year_min is not None:
+            clauses.append({"year": {"$gte": self.year_min}})
+        if self.year_max is not None:
+            clauses.append({"year": {"$lte": self.year_max}})
+        if self.chunk_types is not None:
+            clauses.append({"chunk_type": {"$in": list(self.chunk_types)}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def doc_ids(self, facets: Facets) -> Optional[Set[str]]:
+        """Ids allowed by the document constraints; None when there are none."""
+        allowed: Optional[Set[str]] = None
+        if self.year_min is not None or self.year_max is not None:
+            allowed = _union(
+                ids for year, ids in facets.get("year", {}).items() if self._year_in_range(year)
+            )
+        if self.chunk_types is not None:
+            chunk_ids = _union(facets.get("chunk_type", {}).get(t, set()) for t in self.chunk_types)
+            allowed = chunk_ids if allowed is None else allowed & chunk_ids
+        return allowed
+
+    def describe(self) -> str:
+        parts = []
+        if self.year_min is not None or self.year_max is not None:
+            parts.append(f"year {self.year_min or '…'}–{self.year_max or '…'}")
+        if self.corpora is not None:
+            parts.append("corpus " + "/".join(self.corpora))
+        if self.chunk_types is not None:
+            parts.append("chunk " + "/".join(self.chunk_types))
+        return ", ".join(parts)
+
+
+def _union(sets: Iterable[Set[str]]) -> Set[str]:
+    out: Set[str] = set()
+    for ids in sets:
+        out |= ids
+    return out
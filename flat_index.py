@@ -0,0 +1,426 @@
+"""Memory-mapped, quantized flat vector index.
+
+An alternative to the Chroma stores for corpora small enough to scan: the
+normalized MiniLM embeddings are stored as a float16 or int8 matrix and opened
+with `np.load(mmap_mode="r")`, so every worker process on a host shares the
+same pages through the OS page cache instead of holding its own float32 copy
+plus an HNSW graph. Search is an exact NumPy dot-product scan, optionally
+narrowed first by a Hamming-distance prefilter over packed sign bits.
+
+Each export is written to a fresh `v<timestamp>-<random>` folder and
+published by atomically replacing the `CURRENT` pointer, so readers never
+observe a half-written index and pick up new exports on their next query
+(they re-read the pointer only when its mtime changes). Exports to one
+directory hold an exclusive file lock, so workers starting together build
+the missing export once and concurrent re-exports never interleave.
+
+Export the existing Chroma stores with `python flat_index.py [float16|int8]`.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+RESEARCH_FLAT_DIR = "./flat_pcos_index"
+PATIENT_FLAT_DIR = "./flat_patient_index"
+POINTER_NAME = "CURRENT"
+LOCK_NAME = ".export.lock"
+EXPORT_PAGE = 1000
+SCAN_CHUNK = 65536
+KEEP_VERSIONS = 2
+FILTER_CACHE_SIZE = 64
+
+# Popcount of every byte value, for Hamming distance over packed sign bits.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# ---------- Vector math ----------
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Return the stored matrix and, for int8, the per-row dequantization scale."""
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        scale = np.maximum(scale, 1e-12).astype(np.float32)
+        q = np.rint(vectors / scale[:, None]).astype(np.int8)
+        return q, scale
+    raise ValueError(f"Unsupported flat index dtype: {dtype}")
+
+
+def mmr_select(
+    query_scores: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+) -> List[int]:
+    """Maximal marginal relevance over normalized candidate vectors.
+
+    The pairwise similarity matrix is computed once; each greedy step is then
+    a single vectorized update of every candidate's redundancy score.
+    """
+    n = len(query_scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    pairwise = candidates @ candidates.T
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
+    for _ in range(k):
+        if selected:
+            mmr = lambda_mult * query_scores - (1 - lambda_mult) * redundancy
+        else:
+            mmr = query_scores.astype(np.float32, copy=True)
+        mmr = np.where(available, mmr, -np.inf)
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
+
+
+# ---------- Index ----------
+
+
+class FlatSnapshot:
+    """One published export, opened read-only with memory-mapped arrays."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.dtype = meta["dtype"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.signs = np.load(os.path.join(path, "signs.npy"), mmap_mode="r")
+        self.scale = (
+            np.load(os.path.join(path, "scale.npy"), mmap_mode="r")
+            if self.dtype == "int8"
+            else None
+        )
+        self.text_blob = np.load(os.path.join(path, "texts.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(path, "text_offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "records.json"), "r") as f:
+            records = json.load(f)
+        self.ids: List[str] = records["ids"]
+        self.metadatas: List[dict] = records["metadatas"]
+        self._filter_rows: "OrderedDict[object, np.ndarray]" = OrderedDict()
+        self._filter_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def dense(self, rows) -> np.ndarray:
+        """Dequantize the given rows to float32."""
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scale is not None:
+            block *= np.asarray(self.scale[rows])[:, None]
+        return block
+
+    def scores(self, query: np.ndarray, rows=None) -> np.ndarray:
+        """Cosine similarity of a normalized query against all (or `rows`) vectors."""
+        if rows is not None:
+            return self.dense(rows) @ query
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), SCAN_CHUNK):
+            stop = min(start + SCAN_CHUNK, len(self))
+            out[start:stop] = self.dense(slice(start, stop)) @ query
+        return out
+
+    def hamming_prefilter(self, query: np.ndarray, n: int, rows=None) -> np.ndarray:
+        """Rows (of all, or of `rows`) whose sign-bit codes are closest to the query's."""
+        code = np.packbits(query > 0)
+        signs = self.signs if rows is None else self.signs[rows]
+        distances = _POPCOUNT[np.bitwise_xor(signs, code)].sum(axis=1, dtype=np.int32)
+        picked = np.arange(len(distances)) if n >= len(distances) else np.argpartition(distances, n)[:n]
+        return picked if rows is None else rows[picked]
+
+    def rows_matching(self, flt) -> np.ndarray:
+        """Sorted rows whose metadata `flt` admits, cached per filter."""
+        with self._filter_lock:
+            rows = self._filter_rows.get(flt)
+            if rows is None:
+                rows = np.array(
+                    [i for i, metadata in enumerate(self.metadatas) if flt.matches(metadata)],
+                    dtype=np.int64,
+                )
+                self._filter_rows[flt] = rows
+                while len(self._filter_rows) > FILTER_CACHE_SIZE:
+                    self._filter_rows.popitem(last=False)
+            return rows
+
+    def top_k(
+        self, query: np.ndarray, k: int, prefilter: int = 0, rows=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k rows and scores, optionally over a binary-prefiltered subset.
+
+        `rows` restricts the search to those rows (a metadata filter).
+        """
+        n = len(self) if rows is None else len(rows)
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if prefilter and prefilter < n:
+            rows = np.sort(self.hamming_prefilter(query, prefilter, rows))
+            scores = self.scores(query, rows)
+        elif rows is not None:
+            scores = self.scores(query, rows)
+        else:
+            rows = np.arange(len(self))
+            scores = self.scores(query)
+        k = min(k, len(rows))
+        part = np.argpartition(-scores, k - 1)[:k]
+        order = part[np.argsort(-scores[part])]
+        return rows[order], scores[order]
+
+    def candidate_rows(
+        self, queries: np.ndarray, k: int, prefilter: int = 0, rows=None
+    ) -> np.ndarray:
+        """Union of each query's top-k rows (of all, or of `rows`), scoring all
+        queries in one pass over the matrix."""
+        n = len(self) if rows is None else len(rows)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        if prefilter and prefilter < n:
+            return np.unique(np.concatenate([self.top_k(q, k, prefilter, rows)[0] for q in queries]))
+        k = min(k, n)
+        scores = np.empty((n, len(queries)), dtype=np.float32)
+        for start in range(0, n, SCAN_CHUNK):
+            stop = min(start + SCAN_CHUNK, n)
+            block = slice(start, stop) if rows is None else rows[start:stop]
+            scores[start:stop] = self.dense(block) @ queries.T
+        picked = np.argpartition(-scores, k - 1, axis=0)[:k]
+        return np.unique(picked if rows is None else rows[picked])
+
+    def text(self, row: int) -> str:
+        start, stop = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return bytes(self.text_blob[start:stop]).decode("utf-8")
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row), metadata=dict(self.metadatas[row]))
+
+
+class FlatVectorIndex:
+    """Follows the `CURRENT` export in `directory`.
+
+    Queries grab `snapshot()` once and use it throughout, so a concurrent
+    re-export swaps in atomically between queries.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.version: Optional[str] = None
+        self.current: Optional[FlatSnapshot] = None
+        self._pointer_stat: Optional[Tuple[int, int]] = None
+        self.refresh()
+
+    def _current_version(self) -> str:
+        with open(os.path.join(self.directory, POINTER_NAME), "r") as f:
+            return f.read().strip()
+
+    def refresh(self) -> bool:
+        """Reopen the index if a newer export has been published."""
+        # Publishing replaces the pointer file, so its inode and mtime change.
+        stat = os.stat(os.path.join(self.directory, POINTER_NAME))
+        pointer_stat = (stat.st_ino, stat.st_mtime_ns)
+        if pointer_stat == self._pointer_stat:
+            return False
+        self._pointer_stat = pointer_stat
+        version = self._current_version()
+        if version == self.version:
+            return False
+        self.current = FlatSnapshot(os.path.join(self.directory, version))
+        self.version = version
+        return True
+
+    def snapshot(self) -> FlatSnapshot:
+        self.refresh()
+        return self.current
+
+
+@contextmanager
+def export_lock(directory: str):
+    """Exclusive lock (across processes) around writing and publishing an export."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_flat_index(store, directory: str, dtype: str = "float16", if_missing: bool = False) -> str:
+    """Export a Chroma store into a new version of the flat index at `directory`.
+
+    With `if_missing`, an export another process published first is kept.
+    """
+    with export_lock(directory):
+        if if_missing and flat_index_exists(directory):
+            return FlatVectorIndex(directory).version
+        return _build_flat_index(store, directory, dtype)
+
+
+def _build_flat_index(store, directory: str, dtype: str) -> str:
+    print(f"📦 Exporting flat {dtype} index to: {directory}")
+    collection = store._collection
+    ids: List[str] = []
+    metadatas: List[dict] = []
+    texts: List[str] = []
+    vectors: List[np.ndarray] = []
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=EXPORT_PAGE,
+            offset=offset,
+        )
+        if not page["ids"]:
+            break
+        ids.extend(page["ids"])
+        metadatas.extend(m or {} for m in page["metadatas"])
+        texts.extend(page["documents"])
+        vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+
+    matrix = normalize(np.vstack(vectors)) if vectors else np.zeros((0, 384), np.float32)
+    stored, scale = quantize(matrix, dtype)
+    signs = np.packbits(matrix > 0, axis=1)
+    return _write_flat_export(directory, ids, metadatas, texts, stored, signs, scale, dtype)
+
+
+def write_flat_export(
+    directory: str,
+    ids: List[str],
+    metadatas: List[dict],
+    texts: List[str],
+    stored: np.ndarray,
+    signs: np.ndarray,
+    scale: Optional[np.ndarray],
+    dtype: str,
+) -> str:
+    """Write quantized vectors and their records as a new version and publish it."""
+    with export_lock(directory):
+        return _write_flat_export(directory, ids, metadatas, texts, stored, signs, scale, dtype)
+
+
+def _write_flat_export(
+    directory: str,
+    ids: List[str],
+    metadatas: List[dict],
+    texts: List[str],
+    stored: np.ndarray,
+    signs: np.ndarray,
+    scale: Optional[np.ndarray],
+    dtype: str,
+) -> str:
+    encoded = [t.encode("utf-8") for t in texts]
+    text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=text_offsets[1:])
+
+    # Sorts by time; the random part keeps same-millisecond exports apart.
+    version = f"v{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    np.save(os.path.join(path, "vectors.npy"), stored)
+    np.save(os.path.join(path, "signs.npy"), signs)
+    if scale is not None:
+        np.save(os.path.join(path, "scale.npy"), scale)
+    np.save(os.path.join(path, "texts.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(path, "text_offsets.npy"), text_offsets)
+    with open(os.path.join(path, "records.json"), "w") as f:
+        json.dump({"ids": ids, "metadatas": metadatas}, f)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"dtype": dtype, "count": len(ids), "dim": int(stored.shape[1])}, f)
+
+    pointer = os.path.join(directory, POINTER_NAME)
+    with open(f"{pointer}.tmp", "w") as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    # Old versions stay around briefly for readers that still have them mapped.
+    versions = sorted(v for v in os.listdir(directory) if v.startswith("v"))
+    for old in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+    print(f"✅ Exported {len(ids)} vectors ({stored.nbytes / 1e6:.1f} MB)")
+    return version
+
+
+def flat_index_exists(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, POINTER_NAME))
+
+
+# ---------- Retriever ----------
+
+
+class FlatVectorRetriever(BaseRetriever):
+    """Drop-in for `Chroma.as_retriever(...)` backed by a `FlatVectorIndex`."""
+
+    index: FlatVectorIndex
+    embeddings: Embeddings
+    search_type: str = "mmr"
+    search_kwargs: Dict = {"k": 5, "fetch_k": 20, "lambda_mult": 0.5}
+    prefilter: int = 0
+    """Rows kept by the binary Hamming prefilter before exact rescoring (0 = off)."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        index = self.index.snapshot()
+        query_vec = normalize(self.embeddings.embed_query(query))
+        k = self.search_kwargs.get("k", 5)
+
+        if self.search_type == "mmr":
+            fetch_k = self.search_kwargs.get("fetch_k", 20)
+            rows, scores = index.top_k(query_vec, fetch_k, self.prefilter)
+            picked = mmr_select(
+                scores,
+                index.dense(rows),
+                k,
+                self.search_kwargs.get("lambda_mult", 0.5),
+            )
+            rows = rows[picked]
+        else:
+            rows, _ = index.top_k(query_vec, k, self.prefilter)
+
+        return [index.document(int(row)) for row in rows]
+
+
+if __name__ == "__main__":
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from langchain_community.vectorstores import Chroma
+
+    dtype = sys.argv[1] if len(sys.argv) > 1 else "float16"
+    embeddings = HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2"
+    )
+    for persist_directory, flat_directory in [
+        ("./chroma_pcos_db_semantic", RESEARCH_FLAT_DIR),
+        ("./chroma_patient_db", PATIENT_FLAT_DIR),
+    ]:
+        store = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        build_flat_index(store, flat_directory, dtype=dtype)
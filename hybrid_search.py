@@ -0,0 +1,285 @@
+"""Id-based hybrid retrieval over the shared `DocStore`.
+
+The vector and BM25 sides each return `(doc_id, score)` pairs; `HybridRetriever`
+fuses them with the same weighted reciprocal-rank fusion `EnsembleRetriever`
+uses, but on ids, so no text is loaded until the caller materializes the
+final handles (texts for reranking, `Document`s for the prompt and sources).
+"""
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from doc_store import DocHandle, DocStore
+from filters import RetrievalFilter
+from flat_index import FlatVectorIndex, mmr_select, normalize
+
+# `search(query, flt=None)`: ranked `(doc_id, score)` pairs, filter pushed down.
+Search = Callable[..., List[Tuple[str, float]]]
+
+RRF_C = 60
+
+
+class ChromaVectorSearch:
+    """MMR over a Chroma collection that returns ids instead of Documents."""
+
+    def __init__(self, store, embeddings, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.5):
+        self.store = store
+        self.embeddings = embeddings
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+
+    def describe(self) -> dict:
+        return {"search": "chroma", "k": self.k, "fetch_k": self.fetch_k, "lambda_mult": self.lambda_mult}
+
+    @property
+    def version(self) -> None:
+        # Collections only change through `corpus_sync`, which bumps the doc store version.
+        return None
+
+    def _query(self, query_embeddings: List[List[float]], flt: Optional[RetrievalFilter]) -> dict:
+        where = flt.chroma_where() if flt is not None else None
+        return self.store._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=self.fetch_k,
+            include=["embeddings"],
+            **({"where": where} if where else {}),
+        )
+
+    def __call__(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        query_vec = normalize(self.embeddings.embed_query(query))
+        result = self._query([query_vec.tolist()], flt)
+        ids = result["ids"][0]
+        if not ids:
+            return []
+        candidates = normalize(np.asarray(result["embeddings"][0]))
+        scores = candidates @ query_vec
+        picked = mmr_select(scores, candidates, self.k, self.lambda_mult)
+        return [(ids[i], float(scores[i])) for i in picked]
+
+    def candidates(
+        self, query_vecs: np.ndarray, flt: Optional[RetrievalFilter] = None
+    ) -> Tuple[List[str], np.ndarray]:
+        """Each query's `fetch_k` nearest documents, fetched in one round trip."""
+        result = self._query(query_vecs.tolist(), flt)
+        ids: List[str] = []
+        vectors = []
+        seen = set()
+        for query_ids, query_vectors in zip(result["ids"], result["embeddings"]):
+            for doc_id, vector in zip(query_ids, query_vectors):
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    ids.append(doc_id)
+                    vectors.append(vector)
+        if not ids:
+            return [], np.empty((0, query_vecs.shape[1]), dtype=np.float32)
+        return ids, normalize(np.asarray(vectors))
+
+
+class FlatVectorSearch:
+    """MMR over the memory-mapped flat index, by id."""
+
+    def __init__(
+        self,
+        index: FlatVectorIndex,
+        embeddings,
+        k: int = 5,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        prefilter: int = 0,
+    ):
+        self.index = index
+        self.embeddings = embeddings
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.prefilter = prefilter
+
+    def describe(self) -> dict:
+        return {
+            "search": "flat",
+            "k": self.k,
+            "fetch_k": self.fetch_k,
+            "lambda_mult": self.lambda_mult,
+            "prefilter": self.prefilter,
+        }
+
+    @property
+    def version(self) -> Optional[str]:
+        self.index.refresh()
+        return self.index.version
+
+    @staticmethod
+    def _rows(snapshot, flt: Optional[RetrievalFilter]):
+        return snapshot.rows_matching(flt) if flt is not None and flt.constrains_documents else None
+
+    def __call__(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        snapshot = self.index.snapshot()
+        query_vec = normalize(self.embeddings.embed_query(query))
+        rows, scores = snapshot.top_k(query_vec, self.fetch_k, self.prefilter, self._rows(snapshot, flt))
+        if len(rows) == 0:
+            return []
+        picked = mmr_select(scores, snapshot.dense(rows), self.k, self.lambda_mult)
+        return [(snapshot.ids[int(rows[i])], float(scores[i])) for i in picked]
+
+    def candidates(
+        self, query_vecs: np.ndarray, flt: Optional[RetrievalFilter] = None
+    ) -> Tuple[List[str], np.ndarray]:
+        snapshot = self.index.snapshot()
+        rows = snapshot.candidate_rows(
+            query_vecs, self.fetch_k, self.prefilter, self._rows(snapshot, flt)
+        )
+        return [snapshot.ids[int(r)] for r in rows], snapshot.dense(rows)
+
+
+class BM25Search:
+    def __init__(self, index: BM25Index, k: int = 5):
+        self.index = index
+        self.k = k
+
+    def describe(self) -> dict:
+        return {"search": "bm25", "k": self.k, "k1": self.index.k1, "b": self.index.b}
+
+    @property
+    def version(self) -> int:
+        return self.index.generation
+
+    def __call__(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        return self.index.search(query, k=self.k, allowed=self.index.allowed(flt))
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[List[Tuple[str, float]]], weights: Sequence[float], c: int = RRF_C
+) -> List[Tuple[str, float]]:
+    """Weighted RRF, ties broken by first appearance (as `EnsembleRetriever`)."""
+    fused: Dict[str, float] = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, (doc_id, _) in enumerate(ranked, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (rank + c)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+class HybridRetriever:
+    """Vector + BM25 over one corpus, fused by weighted RRF, returning handles."""
+
+    def __init__(
+        self,
+        corpus: str,
+        searches: Sequence[Search],
+        weights: Sequence[float],
+        doc_store: DocStore,
+    ):
+        self.corpus = corpus
+        self.searches = list(searches)
+        self.weights = list(weights)
+        self.doc_store = doc_store
+
+    def describe(self) -> dict:
+        """Ranking configuration, for keying cached results."""
+        return {
+            "corpus": self.corpus,
+            "weights": self.weights,
+            "searches": [getattr(s, "describe", lambda: repr(s))() for s in self.searches],
+        }
+
+    @property
+    def version(self) -> tuple:
+        """Changes whenever one of the underlying indexes does."""
+        return tuple(getattr(s, "version", None) for s in self.searches)
+
+    def search_components(
+        self, query: str, flt: Optional[RetrievalFilter] = None
+    ) -> List[List[Tuple[str, float]]]:
+        """Each search's own ranked `(doc_id, score)` list, before fusion."""
+        if flt is not None and not flt.allows_corpus(self.corpus):
+            return [[] for _ in self.searches]
+        return [search(query, flt) for search in self.searches]
+
+    def fuse(self, ranked_lists: Sequence[List[Tuple[str, float]]]) -> List[DocHandle]:
+        return [
+            DocHandle(doc_id, score, self.corpus)
+            for doc_id, score in reciprocal_rank_fusion(ranked_lists, self.weights)
+        ]
+
+    def search(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[DocHandle]:
+        return self.fuse(self.search_components(query, flt))
+
+    def invoke(self, query: str) -> List[Document]:
+        """LangChain-style entry point: materialized documents."""
+        return materialize(self.doc_store, self.search(query))
+
+
+def pooled_search(
+    retrievers: Sequence[HybridRetriever],
+    queries: List[str],
+    k_per_query: int = 5,
+    lambda_mult: float = 0.5,
+    vector_weight: float = 0.7,
+    flt: Optional[RetrievalFilter] = None,
+) -> List[DocHandle]:
+    """Multi-query, multi-corpus retrieval with a single MMR stage.
+
+    All queries are embedded in one batch and each corpus is asked once for
+    every query's `fetch_k` neighbours. The pooled, deduplicated candidates
+    are scored against all query vectors in one matrix product (relevance is
+    the best match over queries) and diversified by one MMR pass, so the
+    selection is globally diverse instead of per query and corpus. Each
+    query's BM25 hits are then fused in with weighted RRF as before.
+    """
+    if flt is not None:
+        retrievers = [r for r in retrievers if flt.allows_corpus(r.corpus)]
+    if not retrievers:
+        return []
+    vector_searches = [r.searches[0] for r in retrievers]
+    query_vecs = normalize(np.asarray(vector_searches[0].embeddings.embed_documents(queries)))
+
+    ids: List[str] = []
+    blocks = []
+    corpus_of: Dict[str, str] = {}
+    for retriever, search in zip(retrievers, vector_searches):
+        cand_ids, cand_vecs = search.candidates(query_vecs, flt)
+        keep = [i for i, doc_id in enumerate(cand_ids) if doc_id not in corpus_of]
+        for i in keep:
+            corpus_of[cand_ids[i]] = retriever.corpus
+            ids.append(cand_ids[i])
+        blocks.append(cand_vecs[keep])
+
+    vector_ranked: List[Tuple[str, float]] = []
+    if ids:
+        pool = np.vstack(blocks)
+        relevance = (pool @ query_vecs.T).max(axis=1)
+        k = k_per_query * len(queries) * len(retrievers)
+        picked = mmr_select(relevance, pool, k, lambda_mult)
+        vector_ranked = [(ids[i], float(relevance[i])) for i in picked]
+
+    bm25_lists = []
+    for retriever in retrievers:
+        for bm25 in retriever.searches[1:]:
+            for query in queries:
+                ranked = bm25(query, flt)
+                for doc_id, _ in ranked:
+                    corpus_of.setdefault(doc_id, retriever.corpus)
+                bm25_lists.append(ranked)
+
+    bm25_weight = (1 - vector_weight) / max(1, len(queries))
+    fused = reciprocal_rank_fusion(
+        [vector_ranked] + bm25_lists, [vector_weight] + [bm25_weight] * len(bm25_lists)
+    )
+    return [DocHandle(doc_id, score, corpus_of[doc_id]) for doc_id, score in fused]
+
+
+def materialize(doc_store: DocStore, handles: Sequence[DocHandle]) -> List[Document]:
+    return doc_store.get_documents([h.doc_id for h in handles])
+
+
+def dedupe_handles(handles: Sequence[DocHandle]) -> List[DocHandle]:
+    seen = set()
+    unique: List[DocHandle] = []
+    for handle in handles:
+        if handle.doc_id not in seen:
+            seen.add(handle.doc_id)
+            unique.append(handle)
+    return unique
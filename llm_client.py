@@ -0,0 +1,513 @@
+"""Deadlines, retries, hedging and fallbacks around the chat model.
+
+`ResilientLLM` wraps a LangChain chat model and keeps its `invoke(prompt)` /
+`stream(prompt)` surface, so the chain uses it as a drop-in:
+
+- every call has a deadline (`CYSTERHOOD_LLM_DEADLINE_SECONDS`; for streams,
+  `CYSTERHOOD_LLM_FIRST_TOKEN_SECONDS` bounds the wait for the first token)
+- failed attempts are retried up to `CYSTERHOOD_LLM_RETRIES` times with
+  full-jitter exponential backoff, as long as the deadline allows; client
+  errors such as a bad request are not retried
+- hedging: when an attempt is still silent after the
+  `CYSTERHOOD_LLM_HEDGE_PERCENTILE` latency of recent calls, a duplicate is
+  sent and whichever answers first wins (0 disables)
+- when the deadline is missed, the `CYSTERHOOD_LLM_FALLBACK_MODEL` gets its
+  own `CYSTERHOOD_LLM_FALLBACK_SECONDS`; failing that, the last answer to the
+  same prompt is served from a small cache; failing that, `LLMUnavailable`
+
+Streams are only retried, hedged or replaced before their first token.
+
+    python llm_client.py    # compare plain and resilient calls on a local stub endpoint
+
+The stub speaks the Anthropic Messages API; `python llm_client.py --port 8900`
+keeps it running so the app can be pointed at it with
+`CYSTERHOOD_LLM_API_URL=http://127.0.0.1:8900`.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from metrics import REGISTRY, Histogram
+
+MODEL = os.getenv("CYSTERHOOD_LLM_MODEL", "claude-3-haiku-20240307")
+FALLBACK_MODEL = os.getenv("CYSTERHOOD_LLM_FALLBACK_MODEL", "")
+API_URL = os.getenv("CYSTERHOOD_LLM_API_URL", "")
+DEADLINE_SECONDS = float(os.getenv("CYSTERHOOD_LLM_DEADLINE_SECONDS", "30"))
+FIRST_TOKEN_SECONDS = float(os.getenv("CYSTERHOOD_LLM_FIRST_TOKEN_SECONDS", "10"))
+FALLBACK_SECONDS = float(os.getenv("CYSTERHOOD_LLM_FALLBACK_SECONDS", "15"))
+RETRIES = int(os.getenv("CYSTERHOOD_LLM_RETRIES", "2"))
+HEDGE_PERCENTILE = float(os.getenv("CYSTERHOOD_LLM_HEDGE_PERCENTILE", "90"))
+# Below this many observed calls the percentile is noise; don't hedge yet.
+HEDGE_MIN_SAMPLES = 20
+BACKOFF_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 4.0
+CACHE_SIZE = 256
+# Retrying these cannot succeed.
+NON_RETRYABLE_STATUS = {400, 401, 403, 404, 413, 422}
+
+CALLS = REGISTRY.counter("llm.calls")
+RETRIES_SENT = REGISTRY.counter("llm.retries")
+HEDGES = REGISTRY.counter("llm.hedges")
+HEDGE_WINS = REGISTRY.counter("llm.hedge_wins")
+TIMEOUTS = REGISTRY.counter("llm.timeouts")
+FALLBACKS = REGISTRY.counter("llm.fallbacks")
+CACHE_FALLBACKS = REGISTRY.counter("llm.cache_fallbacks")
+FAILURES = REGISTRY.counter("llm.failures")
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+class LLMUnavailable(RuntimeError):
+    """Neither the model, the fallback model nor the cache answered in time."""
+
+
+class AnswerUnavailable(LLMUnavailable):
+    """Raised by the chain in place of an answer. `notice` is what to show the
+    user (any partial answer plus an apology), `docs` the sources it found;
+    neither may be stored as an answer."""
+
+    def __init__(self, notice: str, docs: Optional[List] = None):
+        super().__init__(notice)
+        self.notice = notice
+        self.docs = docs or []
+
+
+def model_name(model) -> str:
+    return getattr(model, "model", type(model).__name__)
+
+
+def retryable(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) not in NON_RETRYABLE_STATUS
+
+
+def _in_thread(fn: Callable, *args) -> Future:
+    # Plain daemon threads rather than a pool: fork-safe, and a hung call
+    # never blocks the next one.
+    future: Future = Future()
+
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True, name="llm-call").start()
+    return future
+
+
+_END = object()
+
+
+class _StreamAttempt:
+    """One `model.stream` call on its own thread; `first` resolves on the first chunk."""
+
+    def __init__(self, model, prompt: str, latency: Optional[Histogram]):
+        self.chunks: queue.Queue = queue.Queue()
+        self.first: Future = Future()
+        self.first.abandon = self.abandon
+        self.abandoned = threading.Event()
+        self._started = time.monotonic()
+        self._latency = latency
+        threading.Thread(target=self._run, args=(model, prompt), daemon=True, name="llm-stream").start()
+
+    def abandon(self) -> None:
+        self.abandoned.set()
+
+    def _run(self, model, prompt: str) -> None:
+        try:
+            for chunk in model.stream(prompt):
+                if self.abandoned.is_set():
+                    return
+                if not self.first.done():
+                    if self._latency is not None:
+                        self._latency.observe(time.monotonic() - self._started)
+                    self.first.set_result(self)
+                self.chunks.put(chunk)
+        except BaseException as e:
+            if not self.first.done():
+                self.first.set_exception(e)
+            else:
+                self.chunks.put(e)
+            return
+        if not self.first.done():
+            self.first.set_result(self)
+        self.chunks.put(_END)
+
+
+class ResilientLLM:
+    def __init__(
+        self,
+        primary,
+        fallback=None,
+        deadline: float = DEADLINE_SECONDS,
+        first_token_deadline: float = FIRST_TOKEN_SECONDS,
+        fallback_deadline: float = FALLBACK_SECONDS,
+        retries: int = RETRIES,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        backoff: float = BACKOFF_SECONDS,
+        cache_size: int = CACHE_SIZE,
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.model = model_name(primary)
+        self.deadline = deadline
+        self.first_token_deadline = first_token_deadline
+        self.fallback_deadline = fallback_deadline
+        self.retries = retries
+        self.hedge_percentile = hedge_percentile
+        self.backoff = backoff
+        self.cache_size = cache_size
+        self.latency = REGISTRY.histogram("llm.latency_seconds")
+        self.first_token = REGISTRY.histogram("llm.first_token_seconds")
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # --- answer cache -----------------------------------------------------
+
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+    def _remember(self, prompt: str, answer: str) -> None:
+        if not answer or self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[self._key(prompt)] = answer
+            self._cache.move_to_end(self._key(prompt))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def cached(self, prompt: str) -> Optional[str]:
+        with self._cache_lock:
+            return self._cache.get(self._key(prompt))
+
+    # --- attempts ---------------------------------------------------------
+
+    def hedge_delay(self, latency: Optional[Histogram]) -> Optional[float]:
+        if latency is None or self.hedge_percentile <= 0 or latency.count < HEDGE_MIN_SAMPLES:
+            return None
+        return latency.percentile(self.hedge_percentile)
+
+    def _race(self, start: Callable[[], Future], deadline: float, hedge_after: Optional[float]):
+        """Result of `start()`, duplicated after `hedge_after` seconds; first success wins."""
+        futures = [start()]
+        if hedge_after is not None and time.monotonic() + hedge_after < deadline:
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                HEDGES.inc()
+                futures.append(start())
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = wait(
+                    pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+                )
+                if not done:
+                    TIMEOUTS.inc()
+                    raise LLMTimeout("deadline passed without a response")
+                for future in done:
+                    if future.exception() is None:
+                        if future is not futures[0]:
+                            HEDGE_WINS.inc()
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                getattr(future, "abandon", lambda: None)()
+
+    def _with_retries(self, start: Callable[[], Future], deadline: float, latency: Optional[Histogram]):
+        error: Optional[BaseException] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                RETRIES_SENT.inc()
+            try:
+                return self._race(start, deadline, self.hedge_delay(latency))
+            except LLMTimeout:
+                raise
+            except Exception as e:
+                error = e
+                print(f"⚠️ LLM attempt {attempt + 1} failed: {e}")
+                if not retryable(e):
+                    break
+            backoff = random.uniform(0, min(BACKOFF_CAP_SECONDS, self.backoff * 2**attempt))
+            if time.monotonic() + backoff >= deadline:
+                break
+            time.sleep(backoff)
+        raise error
+
+    def _invoke_timed(self, model, prompt: str, latency: Optional[Histogram]):
+        started = time.monotonic()
+        message = model.invoke(prompt)
+        if latency is not None:
+            latency.observe(time.monotonic() - started)
+        return message
+
+    def _invoke_model(self, model, prompt: str, seconds: float, latency: Optional[Histogram]):
+        return self._with_retries(
+            lambda: _in_thread(self._invoke_timed, model, prompt, latency),
+            time.monotonic() + seconds,
+            latency,
+        )
+
+    def _open_stream(self, model, prompt: str, seconds: float, latency: Optional[Histogram]) -> _StreamAttempt:
+        return self._with_retries(
+            lambda: _StreamAttempt(model, prompt, latency).first, time.monotonic() + seconds, latency
+        )
+
+    def _give_up(self, prompt: str, error: BaseException) -> str:
+        cached = self.cached(prompt)
+        if cached is not None:
+            CACHE_FALLBACKS.inc()
+            print("🗂️ Serving the cached answer for this prompt")
+            return cached
+        FAILURES.inc()
+        raise LLMUnavailable(f"No answer from {self.model}: {error!r}") from error
+
+    # --- LangChain surface ------------------------------------------------
+
+    def invoke(self, prompt: str) -> AIMessage:
+        CALLS.inc()
+        try:
+            message = self._invoke_model(self.primary, prompt, self.deadline, self.latency)
+        except Exception as e:
+            print(f"⏰ {self.model} missed its deadline or failed: {e!r}")
+            if self.fallback is None:
+                return AIMessage(content=self._give_up(prompt, e))
+            FALLBACKS.inc()
+            print(f"🪂 Falling back to {model_name(self.fallback)}")
+            try:
+                message = self._invoke_model(self.fallback, prompt, self.fallback_deadline, None)
+            except Exception as fallback_error:
+                return AIMessage(content=self._give_up(prompt, fallback_error))
+        self._remember(prompt, message.content)
+        return message
+
+    def stream(self, prompt: str) -> Iterator[AIMessageChunk]:
+        CALLS.inc()
+        deadline = time.monotonic() + self.deadline
+        try:
+            attempt = self._open_stream(
+                self.primary, prompt, min(self.first_token_deadline, self.deadline), self.first_token
+            )
+        except Exception as e:
+            print(f"⏰ {self.model} sent no first token in time or failed: {e!r}")
+            if self.fallback is None:
+                yield AIMessageChunk(content=self._give_up(prompt, e))
+                return
+            FALLBACKS.inc()
+            print(f"🪂 Falling back to {model_name(self.fallback)}")
+            try:
+                attempt = self._open_stream(self.fallback, prompt, self.fallback_deadline, None)
+            except Exception as fallback_error:
+                yield AIMessageChunk(content=self._give_up(prompt, fallback_error))
+                return
+            deadline = time.monotonic() + self.fallback_deadline
+
+        parts: List[str] = []
+        while True:
+            try:
+                item = attempt.chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                attempt.abandon()
+                TIMEOUTS.inc()
+                raise LLMUnavailable(f"Answer stream passed its {self.deadline:g}s deadline")
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise LLMUnavailable(f"Answer stream failed: {item!r}") from item
+            parts.append(item.content)
+            yield item
+        self._remember(prompt, "".join(parts))
+
+
+def anthropic_model(model: str, timeout: float = DEADLINE_SECONDS, api_url: str = API_URL):
+    """`ChatAnthropic` without SDK retries (ours replace them)."""
+    from langchain_anthropic import ChatAnthropic
+
+    kwargs = {"anthropic_api_url": api_url} if api_url else {}
+    return ChatAnthropic(model=model, max_retries=0, timeout=timeout, **kwargs)
+
+
+def build_llm() -> ResilientLLM:
+    fallback = anthropic_model(FALLBACK_MODEL, FALLBACK_SECONDS) if FALLBACK_MODEL else None
+    return ResilientLLM(anthropic_model(MODEL), fallback)
+
+
+# --- local stub endpoint ----------------------------------------------------
+
+STUB_ANSWER = "PCOS is a common hormonal condition. " * 8
+
+
+class StubAnthropicHandler(BaseHTTPRequestHandler):
+    """`POST /v1/messages` with a configurable latency tail, streamed or not."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _latency(self) -> float:
+        server = self.server
+        if random.random() < server.slow_fraction:
+            return server.slow_seconds
+        return random.uniform(0.5, 1.5) * server.seconds
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if random.random() < self.server.error_fraction:
+            self._json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "stub overloaded"}})
+            return
+        time.sleep(self._latency())
+        message = {
+            "id": f"msg_stub_{random.getrandbits(32):x}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub"),
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": 1, "output_tokens": 0},
+        }
+        if not body.get("stream"):
+            message.update(content=[{"type": "text", "text": STUB_ANSWER}], stop_reason="end_turn")
+            self._json(200, message)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        events = [("message_start", {"type": "message_start", "message": message})]
+        events.append(
+            ("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        )
+        for word in STUB_ANSWER.split(" "):
+            delta = {"type": "text_delta", "text": word + " "}
+            events.append(("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta}))
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        events.append(
+            ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": 1}})
+        )
+        events.append(("message_stop", {"type": "message_stop"}))
+        for event, data in events:
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _json(self, status: int, data: dict) -> None:
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, seconds: float, slow_fraction: float, slow_seconds: float, error_fraction: float):
+        super().__init__(("127.0.0.1", port), StubAnthropicHandler)
+        self.seconds = seconds
+        self.slow_fraction = slow_fraction
+        self.slow_seconds = slow_seconds
+        self.error_fraction = error_fraction
+
+    def handle_error(self, request, client_address) -> None:
+        # Abandoned hedges and timed-out calls hang up on purpose.
+        pass
+
+
+def serve_stub(
+    port: int = 0,
+    seconds: float = 0.2,
+    slow_fraction: float = 0.05,
+    slow_seconds: float = 5.0,
+    error_fraction: float = 0.0,
+) -> StubServer:
+    """Start the stub on a daemon thread; its URL is `http://127.0.0.1:<server.server_port>`."""
+    server = StubServer(port, seconds, slow_fraction, slow_seconds, error_fraction)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _percentiles(values: List[float]) -> str:
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+    return f"p50 {pick(50):.2f}s  p95 {pick(95):.2f}s  p99 {pick(99):.2f}s  max {values[-1]:.2f}s"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare plain and resilient LLM calls on a local stub.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=0.2, help="typical stub latency")
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--slow-seconds", type=float, default=5.0)
+    parser.add_argument("--error-fraction", type=float, default=0.02)
+    parser.add_argument("--deadline", type=float, default=3.0)
+    parser.add_argument("--stream", action="store_true", help="measure time to first token")
+    parser.add_argument("--port", type=int, default=0, help="only serve the stub on this port")
+    args = parser.parse_args(argv)
+
+    server = serve_stub(args.port, args.seconds, args.slow_fraction, args.slow_seconds, args.error_fraction)
+    url = f"http://127.0.0.1:{server.server_port}"
+    if args.port:
+        print(f"🧪 Stub Anthropic endpoint on {url} (CYSTERHOOD_LLM_API_URL={url})")
+        server.serve_forever()
+    os.environ.setdefault("ANTHROPIC_API_KEY", "stub")
+
+    def measure(call) -> List[float]:
+        latencies, failures = [], 0
+        for _ in range(args.calls):
+            started = time.monotonic()
+            try:
+                call("What is PCOS?")
+            except Exception:
+                failures += 1
+            latencies.append(time.monotonic() - started)
+        print(f"   {_percentiles(latencies)}  failures {failures}")
+        return latencies
+
+    def call(llm):
+        if not args.stream:
+            return llm.invoke
+        return lambda prompt: next(iter(llm.stream(prompt)))
+
+    from langchain_anthropic import ChatAnthropic
+
+    # The client as the chain used it before: SDK retries, no deadline.
+    plain = ChatAnthropic(model=MODEL, anthropic_api_url=url)
+    resilient = ResilientLLM(
+        anthropic_model(MODEL, args.deadline, url), deadline=args.deadline, first_token_deadline=args.deadline
+    )
+    print(
+        f"🧪 Stub at {url}: {args.seconds:g}s typical, {args.slow_fraction:.0%} take "
+        f"{args.slow_seconds:g}s, {args.error_fraction:.0%} fail"
+    )
+    print("🐢 Plain client:")
+    measure(call(plain))
+    print(f"🛡️ Resilient client (deadline {args.deadline:g}s, hedge at p{HEDGE_PERCENTILE:g}):")
+    measure(call(resilient))
+    print({name: value for name, value in REGISTRY.snapshot().items() if name.startswith("llm.")})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Load generator for finding how many concurrent chat sessions one host serves.
+
+Each simulated session follows what a user does in `app.py`: ask a question,
+ask a follow-up in the same chat, then open a new chat with a sample-question
+click (served from the answer bundles when one exists), with exponentially
+distributed think time between steps. Retrieval, reranking and scheduling
+are the real ones; Claude and Bing are replaced by stubs with a fixed
+latency, so the numbers describe this host rather than the remote APIs.
+
+    python load_test.py --sessions 1,4,8,16 --duration 60 --think 5
+
+Requests go through `BackgroundLoader.submit`, the entry point the app
+uses. Each level reports chain throughput, end-to-end latency percentiles
+per step, scheduler queueing delay, rejections and a CPU/RSS timeline;
+answer-bundle hits never reach the chain and are reported on their own. Throughput that
+stops growing while latency and queue delay climb marks saturation.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from answer_bundles import SAMPLE_QUESTIONS, AnswerBundles
+from scheduler import SchedulerBusy
+from startup import BackgroundLoader, build_default_chain
+from web_search import WebSearch
+
+QUESTIONS = [
+    "What causes insulin resistance in PCOS?",
+    "What are the best treatments for PCOS hirsutism?",
+    "How does metformin help with PCOS?",
+    "Is inositol effective for irregular cycles?",
+    "What is the link between PCOS and sleep apnea?",
+    "Can PCOS increase the risk of gestational diabetes?",
+    "How is PCOS diagnosed in adolescents?",
+    "What role does inflammation play in PCOS?",
+]
+FOLLOW_UPS = [
+    "What about for teenagers?",
+    "Are there any side effects?",
+    "How long does it take to work?",
+    "Does that also apply after menopause?",
+    "What does the research say about it?",
+]
+STUB_ANSWER_WORDS = 120
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+# ---------- Stubs ----------
+
+
+class StubLLM:
+    """Stands in for `ChatAnthropic`: sleeps like a remote call, uses no CPU."""
+
+    def __init__(self, seconds: float = 1.0, first_token_seconds: float = 0.3):
+        self.seconds = seconds
+        self.first_token_seconds = first_token_seconds
+
+    def _reply(self, prompt: str) -> str:
+        if prompt.startswith("Generate 3 different variations"):
+            match = re.search(r"Original question: (.*)", prompt)
+            question = match.group(1) if match else "PCOS"
+            return "\n".join(f"{prefix} {question}" for prefix in ("Explain:", "Evidence on:", "Overview of:"))
+        return " ".join(["PCOS"] * STUB_ANSWER_WORDS)
+
+    def invoke(self, prompt: str) -> AIMessage:
+        time.sleep(self.seconds)
+        return AIMessage(content=self._reply(prompt))
+
+    def stream(self, prompt: str):
+        time.sleep(self.first_token_seconds)
+        words = self._reply(prompt).split(" ")
+        delay = max(0.0, self.seconds - self.first_token_seconds) / len(words)
+        for word in words:
+            time.sleep(delay)
+            yield AIMessageChunk(content=word + " ")
+
+
+def stub_web_search(seconds: float):
+    def search(query: str, count: int = 5) -> List[dict]:
+        time.sleep(seconds)
+        return [
+            {"name": f"Web result {i + 1}", "url": f"https://example.org/{i}", "snippet": query}
+            for i in range(count)
+        ]
+
+    return search
+
+
+class StartTimes:
+    """Wraps the chain to record when each conversation's call leaves the queue."""
+
+    def __init__(self, chain_call):
+        self.chain_call = chain_call
+        self.started: Dict[str, float] = {}
+
+    def __call__(self, *args, **kwargs):
+        self.started[kwargs.get("conversation_id")] = time.perf_counter()
+        return self.chain_call(*args, **kwargs)
+
+
+# ---------- Resource sampling ----------
+
+
+def rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is KiB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Sampler:
+    """CPU (percent of one core), RSS and scheduler state every `interval` seconds."""
+
+    def __init__(self, scheduler, interval: float = 1.0):
+        self.scheduler = scheduler
+        self.interval = interval
+        self.samples: List[dict] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> List[dict]:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        started = last_wall = time.perf_counter()
+        last_cpu = time.process_time()
+        last_completed = self.scheduler.completed.value
+        while not self._stop.wait(self.interval):
+            wall, cpu = time.perf_counter(), time.process_time()
+            stats = self.scheduler.stats()
+            self.samples.append(
+                {
+                    "t": round(wall - started, 1),
+                    "cpu_percent": round(100 * (cpu - last_cpu) / (wall - last_wall), 1),
+                    "rss_mb": round(rss_bytes() / 2**20, 1),
+                    "queue_depth": stats["queue_depth"],
+                    "in_flight": stats["in_flight"],
+                    "completed_per_s": round((stats["completed"] - last_completed) / (wall - last_wall), 2),
+                }
+            )
+            last_wall, last_cpu, last_completed = wall, cpu, stats["completed"]
+
+
+# ---------- Sessions ----------
+
+
+class LoadResults:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.bundle_latency: List[float] = []
+        self.queue_delay: List[float] = []
+        self.outcomes: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, step: str, outcome: str, latency: Optional[float] = None, queued: Optional[float] = None):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            if outcome == "bundle":
+                self.bundle_latency.append(latency)
+            elif latency is not None:
+                self.latency[step].append(latency)
+            if queued is not None:
+                self.queue_delay.append(queued)
+
+
+class Session:
+    """One simulated user; mirrors the `app.main()` request path."""
+
+    def __init__(self, loader: BackgroundLoader, bundles: Optional[AnswerBundles], results: LoadResults,
+                 think_seconds: float, seed: int, start_times: StartTimes):
+        self.loader = loader
+        self.start_times = start_times
+        self.bundles = bundles
+        self.results = results
+        self.think_seconds = think_seconds
+        self.random = random.Random(seed)
+        self.session_id = f"load_{uuid.uuid4().hex[:8]}"
+
+    def think(self, deadline: float) -> None:
+        if self.think_seconds > 0:
+            time.sleep(min(self.random.expovariate(1 / self.think_seconds), max(0.0, deadline - time.time())))
+
+    def ask(self, step: str, question: str, chat_id: str, history: List[str], opening: bool) -> None:
+        submitted = time.perf_counter()
+        if opening and self.bundles is not None and self.bundles.lookup(question) is not None:
+            self.results.record(step, "bundle", time.perf_counter() - submitted)
+            return
+        conversation_id = f"{self.session_id}:{chat_id}"
+        try:
+            self.loader.submit(
+                question, history=history, session_id=self.session_id, conversation_id=conversation_id
+            ).result()
+        except SchedulerBusy:
+            self.results.record(step, "rejected")
+            return
+        except Exception as e:
+            print(f"❌ {step} failed: {e}")
+            self.results.record(step, "error")
+            return
+        started = self.start_times.started.pop(conversation_id, submitted)
+        self.results.record(step, "ok", time.perf_counter() - submitted, started - submitted)
+
+    def run(self, deadline: float) -> None:
+        # Stagger arrivals so sessions do not start in lockstep.
+        self.think(deadline)
+        while time.time() < deadline:
+            chat_id = uuid.uuid4().hex
+            history: List[str] = []
+            self.ask("question", self.random.choice(QUESTIONS), chat_id, history, opening=True)
+            self.think(deadline)
+            if time.time() >= deadline:
+                break
+            self.ask("follow_up", self.random.choice(FOLLOW_UPS), chat_id, history, opening=False)
+            self.think(deadline)
+            if time.time() >= deadline:
+                break
+            self.ask("sample", self.random.choice(SAMPLE_QUESTIONS), uuid.uuid4().hex, [], opening=True)
+            self.think(deadline)
+
+
+def run_level(loader, bundles, start_times: StartTimes, sessions: int, duration: float,
+              think_seconds: float, interval: float, seed: int) -> dict:
+    results = LoadResults()
+    sampler = Sampler(loader.scheduler, interval).start()
+    started = time.perf_counter()
+    deadline = time.time() + duration
+    threads = [
+        threading.Thread(
+            target=Session(loader, bundles, results, think_seconds, seed + i, start_times).run,
+            args=(deadline,),
+            name=f"load-session-{i}",
+            daemon=True,
+        )
+        for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    samples = sampler.stop()
+
+    # Bundle hits return without touching the chain; counting them would flatter it.
+    answered = sum(len(v) for v in results.latency.values())
+    return {
+        "sessions": sessions,
+        "seconds": round(elapsed, 1),
+        "outcomes": dict(results.outcomes),
+        "throughput_per_s": round(answered / elapsed, 3),
+        "bundle_hits": {
+            "count": len(results.bundle_latency),
+            "per_s": round(len(results.bundle_latency) / elapsed, 3),
+            "p50": percentile(results.bundle_latency, 50),
+        },
+        "latency": {
+            step: {"count": len(values), **{f"p{q}": percentile(values, q) for q in (50, 95, 99)}}
+            for step, values in results.latency.items()
+        },
+        "queue_delay": {f"p{q}": percentile(results.queue_delay, q) for q in (50, 95, 99)},
+        "cpu_percent_mean": round(sum(s["cpu_percent"] for s in samples) / len(samples), 1) if samples else None,
+        "rss_mb_max": max((s["rss_mb"] for s in samples), default=None),
+        "timeline": samples,
+    }
+
+
+def _fmt(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.2f}s"
+
+
+def format_report(level: dict, timeline: bool = True) -> str:
+    lines = [
+        f"👥 {level['sessions']} sessions, {level['seconds']}s: "
+        f"{level['throughput_per_s']} chain answers/s, outcomes {level['outcomes']}",
+    ]
+    bundles = level["bundle_hits"]
+    lines.append(f"   bundles    n={bundles['count']:<5} {bundles['per_s']}/s  p50 {_fmt(bundles['p50'])}")
+    for step, stats in sorted(level["latency"].items()):
+        lines.append(
+            f"   {step:<10} n={stats['count']:<5} p50 {_fmt(stats['p50'])}  "
+            f"p95 {_fmt(stats['p95'])}  p99 {_fmt(stats['p99'])}"
+        )
+    queue = level["queue_delay"]
+    lines.append(f"   queue      p50 {_fmt(queue['p50'])}  p95 {_fmt(queue['p95'])}  p99 {_fmt(queue['p99'])}")
+    lines.append(f"   cpu mean {level['cpu_percent_mean']}% of one core, rss max {level['rss_mb_max']} MB")
+    if timeline:
+        lines.append("      t   cpu%   rss MB  queue  running  done/s")
+        for s in level["timeline"]:
+            lines.append(
+                f"   {s['t']:>5} {s['cpu_percent']:>6} {s['rss_mb']:>8} {s['queue_depth']:>6} "
+                f"{s['in_flight']:>8} {s['completed_per_s']:>7}"
+            )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> List[dict]:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per level")
+    parser.add_argument("--think", type=float, default=5, help="mean think time between steps (s)")
+    parser.add_argument("--llm-seconds", type=float, default=1.0, help="stub Claude call latency")
+    parser.add_argument("--web-seconds", type=float, default=0.5, help="stub Bing search latency")
+    parser.add_argument("--interval", type=float, default=1.0, help="resource sampling interval (s)")
+    parser.add_argument("--no-bundles", action="store_true", help="send sample clicks to the chain too")
+    parser.add_argument(
+        "--retrieval-cache", action="store_true", help="serve repeated questions from the retrieval cache"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the full results to this file")
+    args = parser.parse_args(argv)
+
+    start_times: List[StartTimes] = []
+
+    def build():
+        chain_call = StartTimes(
+            build_default_chain(
+                llm=StubLLM(args.llm_seconds),
+                web=WebSearch(search=stub_web_search(args.web_seconds)),
+                use_retrieval_cache=args.retrieval_cache,
+            )
+        )
+        start_times.append(chain_call)
+        return chain_call
+
+    loader = BackgroundLoader(build=build).start()
+    loader.wait()
+    if not loader.ready:
+        raise SystemExit(f"❌ Chain failed to load: {loader.error}")
+    bundles = None if args.no_bundles else AnswerBundles(loader)
+    print(f"✅ Chain loaded in {loader.load_seconds:.1f}s, rss {rss_bytes() / 2**20:.0f} MB")
+
+    levels = []
+    for sessions in [int(s) for s in args.sessions.split(",") if s.strip()]:
+        print(f"\n🚦 Running {sessions} sessions for {args.duration:.0f}s...")
+        level = run_level(
+            loader, bundles, start_times[0], sessions, args.duration, args.think, args.interval, args.seed
+        )
+        print(format_report(level))
+        levels.append(level)
+
+    print("\n📈 Summary")
+    print("   sessions  chain answers/s  question p95  queue p95  cpu%   rss MB")
+    for level in levels:
+        question = level["latency"].get("question", {})
+        print(
+            f"   {level['sessions']:>8} {level['throughput_per_s']:>16} {_fmt(question.get('p95')):>13} "
+            f"{_fmt(level['queue_delay']['p95']):>10} {level['cpu_percent_mean']!s:>5} {level['rss_mb_max']!s:>8}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(levels, f, indent=2)
+    return levels
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Quantized ONNX Runtime backend for the embedder and the CrossEncoder.
+
+Both MiniLM models are exported once to ONNX, dynamically quantized to int8
+and then served through onnxruntime on CPU, with no torch import at request
+time. Select it with `CYSTERHOOD_INFERENCE_BACKEND=onnx`; thread counts come
+from `CYSTERHOOD_ORT_INTRA_THREADS` / `CYSTERHOOD_ORT_INTER_THREADS`.
+
+    python onnx_backend.py export    # write ./onnx_models/{embedder,reranker}
+    python onnx_backend.py parity    # compare against the PyTorch models
+
+`test_onnx_backend.py` runs the same comparison under pytest whenever the
+exported models are present.
+"""
+
+import inspect
+import os
+import sys
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+ONNX_DIR = "./onnx_models"
+EMBEDDER_MAX_LENGTH = 256
+RERANKER_MAX_LENGTH = 512
+BATCH_SIZE = 32
+
+# Parity tolerances against the PyTorch path.
+MIN_EMBEDDING_COSINE = 0.98
+MIN_RERANK_SPEARMAN = 0.95
+# CrossEncoder logits; int8 quantization moves them by a few tenths at most.
+MAX_RERANK_SCORE_DELTA = 0.5
+
+
+def session_options():
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = int(os.getenv("CYSTERHOOD_ORT_INTRA_THREADS", "0"))
+    options.inter_op_num_threads = int(os.getenv("CYSTERHOOD_ORT_INTER_THREADS", "0"))
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+class _OnnxModel:
+    def __init__(self, model_dir: str, max_length: int):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "The ONNX backend needs onnxruntime and tokenizers, please install "
+                "with `pip install onnxruntime tokenizers`."
+            )
+
+        model_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(model_path):
+            raise RuntimeError(
+                f"No ONNX model at {model_path}. Run `python onnx_backend.py export`."
+            )
+        self.session = ort.InferenceSession(
+            model_path, session_options(), providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def _feed(self, encodings) -> dict:
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        return {name: value for name, value in feed.items() if name in self.input_names}
+
+
+class OnnxEmbeddings(_OnnxModel, Embeddings):
+    """Mean-pooled, L2-normalized MiniLM sentence embeddings."""
+
+    def __init__(self, model_dir: str = os.path.join(ONNX_DIR, "embedder")):
+        super().__init__(model_dir, EMBEDDER_MAX_LENGTH)
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        out = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            feed = self._feed(self.tokenizer.encode_batch(list(texts[start:start + BATCH_SIZE])))
+            hidden = self.session.run(None, feed)[0]
+            mask = feed["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            out.append(pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12))
+        return np.vstack(out) if out else np.zeros((0, 384), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Same `predict(pairs)` contract as `sentence_transformers.CrossEncoder`."""
+
+    def __init__(self, model_dir: str = os.path.join(ONNX_DIR, "reranker")):
+        super().__init__(model_dir, RERANKER_MAX_LENGTH)
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], batch_size: int = BATCH_SIZE) -> np.ndarray:
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = [tuple(p) for p in pairs[start:start + batch_size]]
+            logits = self.session.run(None, self._feed(self.tokenizer.encode_batch(batch)))[0]
+            # CrossEncoder applies a sigmoid to single-label models.
+            scores.append(1.0 / (1.0 + np.exp(-logits[:, 0])))
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+# ---------- Export ----------
+
+
+def _export(model, tokenizer, out_dir: str, pair_input: bool) -> None:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(out_dir, exist_ok=True)
+    sample = tokenizer(
+        *(["query", "passage"] if pair_input else ["sample text"]), return_tensors="pt"
+    )
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["output"] = {0: "batch"}
+
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # Newer torch defaults to the dynamo exporter, which rejects dynamic_axes.
+        export_kwargs["dynamo"] = False
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["output"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            **export_kwargs,
+        )
+    quantize_dynamic(fp32_path, os.path.join(out_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    tokenizer.backend_tokenizer.save(os.path.join(out_dir, "tokenizer.json"))
+    print(f"✅ Exported {out_dir}")
+
+
+def export_models(out_dir: str = ONNX_DIR) -> None:
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(*inputs).last_hidden_state
+
+    class Logits(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(*inputs).logits
+
+    print(f"📦 Exporting {EMBEDDER_MODEL} to ONNX...")
+    _export(
+        LastHiddenState(AutoModel.from_pretrained(EMBEDDER_MODEL)),
+        AutoTokenizer.from_pretrained(EMBEDDER_MODEL),
+        os.path.join(out_dir, "embedder"),
+        pair_input=False,
+    )
+    print(f"📦 Exporting {RERANKER_MODEL} to ONNX...")
+    _export(
+        Logits(AutoModelForSequenceClassification.from_pretrained(RERANKER_MODEL)),
+        AutoTokenizer.from_pretrained(RERANKER_MODEL),
+        os.path.join(out_dir, "reranker"),
+        pair_input=True,
+    )
+
+
+# ---------- Parity ----------
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+PARITY_TEXTS = [
+    "Metformin improves insulin sensitivity in women with PCOS.",
+    "Hirsutism is excess hair growth driven by androgens.",
+    "Regular exercise and a balanced diet help manage PCOS symptoms.",
+    "Oral contraceptives are used to regulate menstrual cycles.",
+    "Inositol supplementation has been studied for ovulation induction.",
+    "Weather forecasts predict rain for the weekend.",
+]
+PARITY_QUERY = "How does metformin help with PCOS?"
+
+
+def parity_report(texts: Sequence[str] = PARITY_TEXTS, query: str = PARITY_QUERY) -> dict:
+    """Embedding cosines and rerank agreement of the ONNX backend against the PyTorch models."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from sentence_transformers import CrossEncoder
+
+    texts = list(texts)
+    torch_vecs = np.asarray(HuggingFaceEmbeddings(model_name=EMBEDDER_MODEL).embed_documents(texts))
+    onnx_vecs = OnnxEmbeddings().encode(texts)
+    cosines = (torch_vecs * onnx_vecs).sum(axis=1) / (
+        np.linalg.norm(torch_vecs, axis=1) * np.linalg.norm(onnx_vecs, axis=1)
+    )
+
+    pairs = [(query, t) for t in texts]
+    torch_scores = np.asarray(CrossEncoder(RERANKER_MODEL).predict(pairs))
+    onnx_scores = OnnxCrossEncoder().predict(pairs)
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "spearman": _spearman(torch_scores, onnx_scores),
+        "top_match": int(np.argmax(torch_scores)) == int(np.argmax(onnx_scores)),
+        "max_score_delta": float(np.abs(torch_scores - onnx_scores).max()),
+    }
+
+
+def parity_ok(report: dict) -> bool:
+    return (
+        report["min_cosine"] >= MIN_EMBEDDING_COSINE
+        and report["spearman"] >= MIN_RERANK_SPEARMAN
+        and report["top_match"]
+        and report["max_score_delta"] <= MAX_RERANK_SCORE_DELTA
+    )
+
+
+def check_parity(texts: Sequence[str] = PARITY_TEXTS, query: str = PARITY_QUERY) -> bool:
+    """Compare the ONNX backend against the PyTorch models on sample inputs."""
+    report = parity_report(texts, query)
+    print(f"🔬 Embedding cosine: min={report['min_cosine']:.4f} mean={report['mean_cosine']:.4f}")
+    print(
+        f"🔬 Rerank Spearman: {report['spearman']:.4f}, top-1 match: {report['top_match']}, "
+        f"max score delta: {report['max_score_delta']:.4f}"
+    )
+    ok = parity_ok(report)
+    print("✅ ONNX parity OK" if ok else "❌ ONNX parity outside tolerance")
+    return ok
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "export":
+        export_models()
+    elif command == "parity":
+        sys.exit(0 if check_parity() else 1)
+    else:
+        raise SystemExit(f"Unknown command: {command} (expected export or parity)")
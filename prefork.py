@@ -0,0 +1,146 @@
+"""Pre-forked API serving: load the models once, fork workers that share them.
+
+The parent builds the chain (embedder, CrossEncoder, vector handles, BM25
+indexes, doc store), runs one warm-up retrieval, freezes the garbage
+collector and then forks `CYSTERHOOD_WORKERS` uvicorn workers that accept on
+one shared socket. The workers read the parent's pages copy-on-write, so
+each one only adds the memory it writes to.
+
+    python prefork.py
+
+The parent restarts workers that exit and logs RSS, PSS and unique bytes for
+itself and every worker each `CYSTERHOOD_MEMORY_REPORT_SECONDS`; a worker's
+unique bytes are its incremental cost. Each worker's `/metrics` includes the
+same figures under `process`. Linux only (fork, /proc).
+"""
+
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Dict
+
+from metrics import process_memory
+from startup import build_default_chain
+
+WORKERS = int(os.getenv("CYSTERHOOD_WORKERS", "2"))
+HOST = os.getenv("CYSTERHOOD_API_HOST", "0.0.0.0")
+PORT = int(os.getenv("CYSTERHOOD_API_PORT", "8000"))
+MEMORY_REPORT_SECONDS = float(os.getenv("CYSTERHOOD_MEMORY_REPORT_SECONDS", "60"))
+
+
+def bind_socket(host: str = HOST, port: int = PORT) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _mb(value: int) -> str:
+    return f"{value / 2**20:.0f} MB"
+
+
+def memory_report(workers: Dict[int, int]) -> str:
+    parent = process_memory()
+    lines = [f"🧠 parent {os.getpid()}: rss {_mb(parent.get('rss', 0))}"]
+    for slot, pid in sorted(workers.items()):
+        mem = process_memory(pid)
+        if mem:
+            lines.append(
+                f"   worker {slot} ({pid}): rss {_mb(mem['rss'])}, pss {_mb(mem['pss'])}, "
+                f"unique {_mb(mem['uss'])}, shared {_mb(mem['shared'])}"
+            )
+    return "\n".join(lines)
+
+
+def _exit_with_parent(parent_pid: int) -> None:
+    # A worker orphaned by a crashed parent would keep serving stale state.
+    while os.getppid() == parent_pid:
+        time.sleep(1.0)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _run_worker(sock: socket.socket, app, parent_pid: int) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[sock])
+
+
+def spawn(sock: socket.socket, app) -> int:
+    parent_pid = os.getpid()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(sock, app, parent_pid)
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(workers: int = WORKERS) -> None:
+    import api_server
+
+    loader = api_server.loader
+    loader.build = lambda: build_default_chain(warm_up=True)
+    loader.start()
+    loader.wait()
+    if not loader.ready:
+        raise SystemExit(f"❌ Chain failed to load: {loader.error}")
+
+    # Move everything loaded so far out of the collector's reach: collections
+    # write to object headers, which would copy shared pages into each worker.
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket()
+    print(f"🍴 Forking {workers} workers on {HOST}:{PORT}")
+    children: Dict[int, int] = {slot: spawn(sock, api_server.app) for slot in range(workers)}
+
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.time() + min(MEMORY_REPORT_SECONDS, 10)
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            slot = next((s for s, p in children.items() if p == pid), None)
+            if slot is not None:
+                del children[slot]
+                if not stopping:
+                    print(f"⚠️ Worker {slot} ({pid}) exited with status {status}; restarting")
+                    children[slot] = spawn(sock, api_server.app)
+            continue
+        if time.time() >= next_report:
+            print(memory_report(children))
+            next_report = time.time() + MEMORY_REPORT_SECONDS
+        time.sleep(0.5)
+    print("👋 All workers stopped")
+
+
+if __name__ == "__main__":
+    serve()
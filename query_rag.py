@@ -1,19 +1,43 @@
 import os
+import sys
 import json
-from typing import List
+import hashlib
+import threading
+import time
+from dataclasses import asdict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel
-import pandas as pd
-import requests
 
 from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
-from langchain_anthropic import ChatAnthropic
-from sentence_transformers import CrossEncoder
+
+from batching import maybe_batched_embeddings, maybe_batched_reranker
+from bm25_index import BM25Index, BM25IndexRetriever
+from filters import RetrievalFilter
+from conversation import (
+    ConversationState,
+    ConversationStore,
+    Turn,
+    condense,
+    is_follow_up,
+    new_terms,
+    similarity,
+)
+from llm_client import AnswerUnavailable, LLMUnavailable, build_llm, model_name
+from metrics import REGISTRY
+from retrieval_cache import RetrievalCache, cache_key, default_retrieval_cache
+from router import QueryRouter, context_overlap, route_signals
+from snippets import select_snippet
+from text_analysis import ANALYZER
+from web_search import WebSearch
+from startup import InitGraph, format_timings, timed
+
+# pandas, Chroma, langchain, langchain_anthropic and sentence-transformers
+# (torch) are imported where they are first needed, under `timed(...)`, so
+# importing this module stays cheap and cold-start cost is attributable.
+if TYPE_CHECKING:
+    from langchain_anthropic import ChatAnthropic
 
 load_dotenv()
 
@@ -25,127 +49,490 @@ class QueryVariations(BaseModel):
 # ---------- Helpers to reload docs for BM25 ----------
 
 
-def load_and_clean_papers_for_bm25(csv_path: str) -> List[Document]:
-    print(f"📄 [BM25] Loading papers from: {csv_path}")
-    df = pd.read_csv(csv_path)
-    df = df[df["abstract"].notna() | df["fulltext"].notna()]
+def _is_missing(value) -> bool:
+    if value is None or (isinstance(value, float) and value != value):
+        return True
+    # pd.NA and friends can only come from pandas, so it is already imported.
+    pd = sys.modules.get("pandas")
+    return pd is not None and bool(pd.isna(value))
+
+
+def _key_part(value) -> str:
+    return "nan" if _is_missing(value) else str(value)
+
+
+def research_row_key(row) -> str:
+    """Stable identity of a paper row: PMID when present, else title + year."""
+    pmid = row.get("pmid")
+    if not _is_missing(pmid) and str(pmid).strip():
+        return f"pmid:{str(pmid).strip()}"
+    basis = f"{_key_part(row.get('title'))}\x1f{_key_part(row.get('year'))}"
+    return "paper:" + hashlib.sha1(basis.encode("utf-8")).hexdigest()[:16]
+
+
+def research_row_hash(row) -> str:
+    """Content hash of the fields that end up in a paper's documents."""
+    parts = [
+        "" if _is_missing(row.get(col)) else str(row.get(col))
+        for col in ("title", "year", "abstract", "fulltext")
+    ]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
 
+
+def research_docs_from_row(row, key: str) -> List[Document]:
     docs: List[Document] = []
-    for _, row in df.iterrows():
-        if pd.notna(row["abstract"]):
+    for chunk_type in ("abstract", "fulltext"):
+        if not _is_missing(row[chunk_type]):
             docs.append(
                 Document(
-                    page_content=row["abstract"],
+                    page_content=row[chunk_type],
                     metadata={
                         "title": row["title"],
                         "year": row["year"],
-                        "chunk_type": "abstract",
+                        "chunk_type": chunk_type,
                         "source": "Research",
+                        "doc_id": f"{key}:{chunk_type}",
                     },
                 )
             )
-        if pd.notna(row["fulltext"]):
-            docs.append(
-                Document(
-                    page_content=row["fulltext"],
-                    metadata={
-                        "title": row["title"],
-                        "year": row["year"],
-                        "chunk_type": "fulltext",
-                        "source": "Research",
-                    },
-                )
+    return docs
+
+
+RESEARCH_TEXT_COLUMNS = ["pmid", "title", "abstract", "fulltext"]
+
+
+def _year(value) -> Optional[int]:
+    if _is_missing(value):
+        return None
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def parse_research_columns(csv_path: str) -> Dict[str, List]:
+    """Read and clean the paper CSV into plain columns, with row keys and hashes.
+
+    Missing values are None. Only the columns documents are built from are
+    parsed, all as strings except `year`.
+    """
+    with timed("import pandas"):
+        import pandas as pd
+
+    wanted = set(RESEARCH_TEXT_COLUMNS) | {"year"}
+    df = pd.read_csv(
+        csv_path,
+        usecols=lambda c: c in wanted,
+        dtype={c: "string" for c in RESEARCH_TEXT_COLUMNS},
+    )
+    df = df[df["abstract"].notna() | df["fulltext"].notna()]
+
+    columns: Dict[str, List] = {
+        c: df[c].astype(object).where(df[c].notna(), None).tolist() if c in df else [None] * len(df)
+        for c in RESEARCH_TEXT_COLUMNS
+    }
+    years = pd.to_numeric(df["year"], errors="coerce") if "year" in df else [None] * len(df)
+    columns["year"] = [_year(y) for y in years]
+
+    keys: List[str] = []
+    hashes: List[str] = []
+    seen: Dict[str, int] = {}
+    for row in _column_rows(columns):
+        key = research_row_key(row)
+        # Disambiguate duplicate rows deterministically by position.
+        if key in seen:
+            seen[key] += 1
+            key = f"{key}#{seen[key]}"
+        else:
+            seen[key] = 0
+        keys.append(key)
+        hashes.append(research_row_hash(row))
+    columns["key"] = keys
+    columns["hash"] = hashes
+    return columns
+
+
+def _column_rows(columns: Dict[str, List]):
+    names = list(columns)
+    for values in zip(*columns.values()):
+        yield dict(zip(names, values))
+
+
+def research_columns(csv_path: str) -> Dict[str, List]:
+    """Cleaned paper columns, parsed once per CSV version and cached on disk."""
+    from corpus_cache import cached_columns
+
+    return cached_columns(csv_path, "research", parse_research_columns)
+
+
+def iter_research_rows(csv_path: str):
+    """Yield `(key, content_hash, row)` for every usable paper row."""
+    for row in _column_rows(research_columns(csv_path)):
+        yield row["key"], row["hash"], row
+
+
+def load_and_clean_papers_for_bm25(csv_path: str) -> List[Document]:
+    print(f"📄 [BM25] Loading papers from: {csv_path}")
+    with timed("parse research CSV"):
+        columns = research_columns(csv_path)
+        docs = [
+            Document(
+                page_content=text,
+                metadata={
+                    "title": title,
+                    "year": year,
+                    "chunk_type": chunk_type,
+                    "source": "Research",
+                    "doc_id": f"{key}:{chunk_type}",
+                },
+            )
+            for key, title, year, abstract, fulltext in zip(
+                columns["key"], columns["title"], columns["year"],
+                columns["abstract"], columns["fulltext"],
             )
+            for chunk_type, text in (("abstract", abstract), ("fulltext", fulltext))
+            if text is not None
+        ]
     print(f"📝 [BM25] Created {len(docs)} research docs")
     return docs
 
 
+def patient_doc_id(entry: dict) -> str:
+    if entry.get("id") is not None:
+        return f"patient:{entry['id']}"
+    return "patient:" + patient_entry_hash(entry)[:16]
+
+
+def patient_entry_hash(entry: dict) -> str:
+    basis = f"{entry.get('source')}\x1f{entry.get('title')}\x1f{entry.get('text')}"
+    return hashlib.sha1(basis.encode("utf-8")).hexdigest()
+
+
+def patient_doc_from_entry(entry: dict) -> Document:
+    metadata = {
+        "source": entry.get("source", "Patient"),
+        "title": entry.get("title", "Untitled"),
+        "id": entry.get("id", None),
+        "chunk_type": "patient",
+        "doc_id": patient_doc_id(entry),
+    }
+    return Document(page_content=entry["text"], metadata=metadata)
+
+
 def load_patient_articles_for_bm25(json_path: str) -> List[Document]:
     print(f"📄 [BM25] Loading patient articles from: {json_path}")
-    with open(json_path, "r") as f:
-        raw_data = json.load(f)
-
-    docs: List[Document] = []
-    for entry in raw_data:
-        content = entry["text"]
-        metadata = {
-            "source": entry.get("source", "Patient"),
-            "title": entry.get("title", "Untitled"),
-            "id": entry.get("id", None),
-            "chunk_type": "patient",
-        }
-        docs.append(Document(page_content=content, metadata=metadata))
+    with timed("parse patient JSON"):
+        with open(json_path, "r") as f:
+            raw_data = json.load(f)
+        docs = [patient_doc_from_entry(entry) for entry in raw_data]
     print(f"📝 [BM25] Loaded {len(docs)} patient docs")
     return docs
 
 
-# ---------- Hybrid retrievers (MMR + BM25 + ensemble) ----------
+# ---------- Model backends (PyTorch or quantized ONNX) ----------
 
 
-def build_retrievers(include_patient_data: bool = True):
-    print("📂 Loading vectorstores...")
+def inference_backend(backend: Optional[str] = None) -> str:
+    return backend or os.getenv("CYSTERHOOD_INFERENCE_BACKEND", "torch")
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
 
-    main_store = Chroma(
-        persist_directory="./chroma_pcos_db_semantic",
-        embedding_function=embeddings,
-    )
-    # MMR-based vector retriever
-    main_vector_retriever = main_store.as_retriever(
-        search_type="mmr",
-        search_kwargs={"k": 5, "fetch_k": 20, "lambda_mult": 0.5},
-    )
+def load_embeddings(backend: Optional[str] = None):
+    if inference_backend(backend) == "onnx":
+        with timed("import onnxruntime"):
+            from onnx_backend import OnnxEmbeddings
+        with timed("load embeddings (onnx)"):
+            return OnnxEmbeddings()
 
-    if include_patient_data:
-        patient_store = Chroma(
-            persist_directory="./chroma_patient_db",
+    with timed("import sentence_transformers"):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        import sentence_transformers  # noqa: F401  (pulls in torch)
+    with timed("load embeddings"):
+        return HuggingFaceEmbeddings(
+            model_name="sentence-transformers/all-MiniLM-L6-v2"
+        )
+
+
+def load_reranker(backend: Optional[str] = None):
+    if inference_backend(backend) == "onnx":
+        with timed("import onnxruntime"):
+            from onnx_backend import OnnxCrossEncoder
+        with timed("load reranker (onnx)"):
+            return OnnxCrossEncoder()
+
+    with timed("import sentence_transformers"):
+        from sentence_transformers import CrossEncoder
+    with timed("load reranker"):
+        return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+
+def open_chroma(persist_directory: str, embeddings):
+    with timed("import chromadb"):
+        from langchain_community.vectorstores import Chroma
+    with timed(f"open {persist_directory}"):
+        return Chroma(
+            persist_directory=persist_directory,
             embedding_function=embeddings,
         )
-        patient_vector_retriever = patient_store.as_retriever(
+
+
+def ensemble(retrievers: List, weights: List[float]):
+    with timed("import langchain"):
+        from langchain.retrievers import EnsembleRetriever
+
+    return EnsembleRetriever(retrievers=retrievers, weights=weights)
+
+
+# ---------- Hybrid retrievers (MMR + BM25 + ensemble) ----------
+
+
+def build_bm25_retriever(
+    docs: List[Document], k: int = 5, name: str = "BM25"
+) -> BM25IndexRetriever:
+    with timed(f"build {name}"):
+        index = BM25Index.from_documents(docs, tokenizer=ANALYZER, query_tokenizer=ANALYZER.query)
+    return BM25IndexRetriever(index=index, k=k)
+
+
+def start_corpus_watcher(
+    csv_path: str, store, bm25_index: BM25Index, doc_store=None, flat_directory: Optional[str] = None
+):
+    """Watch the research CSV; with `flat_directory` (flat backend) also republish its export."""
+    # Imported lazily: corpus_sync depends on this module's row helpers.
+    from corpus_sync import CorpusWatcher
+
+    watcher = CorpusWatcher(
+        csv_path, store, bm25_index, doc_store=doc_store, flat_directory=flat_directory
+    )
+    watcher.start()
+    return watcher
+
+
+def build_vector_retriever(store, embeddings, flat_directory: str, backend: str):
+    """MMR vector retriever over Chroma or the memory-mapped flat index."""
+    search_kwargs = {"k": 5, "fetch_k": 20, "lambda_mult": 0.5}
+    if backend == "flat":
+        from flat_index import FlatVectorRetriever
+
+        return FlatVectorRetriever(
+            index=open_flat_index(store, flat_directory),
+            embeddings=embeddings,
             search_type="mmr",
-            search_kwargs={"k": 5, "fetch_k": 20, "lambda_mult": 0.5},
+            search_kwargs=search_kwargs,
+            prefilter=int(os.getenv("CYSTERHOOD_FLAT_PREFILTER", "0")),
         )
+    return store.as_retriever(search_type="mmr", search_kwargs=search_kwargs)
 
-        print("🔗 Using dual corpora (research + patient)")
-        print("🧮 Building BM25 retrievers from original docs...")
 
-        research_docs = load_and_clean_papers_for_bm25(
-            "pcos_papers_merged.csv"
+def open_flat_index(store, flat_directory: str):
+    from flat_index import FlatVectorIndex, build_flat_index, flat_index_exists
+
+    if not flat_index_exists(flat_directory):
+        # Workers starting together wait for the first one's export.
+        build_flat_index(
+            store, flat_directory, dtype=os.getenv("CYSTERHOOD_FLAT_DTYPE", "float16"), if_missing=True
         )
-        main_bm25 = BM25Retriever.from_documents(research_docs)
-        main_bm25.k = 5
+    return FlatVectorIndex(flat_directory)
+
+
+def build_vector_search(store, embeddings, flat_directory: str, backend: str):
+    """Id-returning counterpart of `build_vector_retriever` for the doc store path."""
+    from hybrid_search import ChromaVectorSearch, FlatVectorSearch
 
-        patient_docs = load_patient_articles_for_bm25(
-            "all_patient_articles_text_only.json"
+    if backend == "flat":
+        return FlatVectorSearch(
+            open_flat_index(store, flat_directory),
+            embeddings,
+            prefilter=int(os.getenv("CYSTERHOOD_FLAT_PREFILTER", "0")),
         )
-        patient_bm25 = BM25Retriever.from_documents(patient_docs)
-        patient_bm25.k = 5
+    return ChromaVectorSearch(store, embeddings)
 
-        main_hybrid = EnsembleRetriever(
-            retrievers=[main_vector_retriever, main_bm25],
-            weights=[0.7, 0.3],
+
+# (corpus, Chroma dir, flat dir, source file)
+CORPORA = [
+    ("research", "./chroma_pcos_db_semantic", "./flat_pcos_index", "pcos_papers_merged.csv"),
+    ("patient", "./chroma_patient_db", "./flat_patient_index", "all_patient_articles_text_only.json"),
+]
+
+
+def doc_store_ready(corpora: List[tuple]) -> bool:
+    """True once `corpus_sync` has given every store stable ids and filled the doc store."""
+    from corpus_sync import manifest_path_for
+    from doc_store import doc_store_exists
+
+    return doc_store_exists() and all(
+        os.path.exists(manifest_path_for(persist_directory))
+        for _, persist_directory, _, _ in corpora
+    )
+
+
+def retriever_graph(
+    include_patient_data: bool = True,
+    watch_corpus: bool = False,
+    vector_backend: Optional[str] = None,
+    use_rerank: bool = False,
+) -> InitGraph:
+    """Startup as a dependency graph: only the stores wait on the embedder.
+
+    Once `python corpus_sync.py` has populated the shared doc store, each
+    corpus gets an id-based `HybridRetriever` whose BM25 side is built from
+    the doc store and holds no texts. Otherwise the original Document-based
+    `EnsembleRetriever`s are built from the source files.
+    """
+    vector_backend = vector_backend or os.getenv("CYSTERHOOD_VECTOR_BACKEND", "chroma")
+    corpora = CORPORA if include_patient_data else CORPORA[:1]
+    compact = doc_store_ready(corpora)
+
+    graph = InitGraph()
+    graph.add("embeddings", lambda: maybe_batched_embeddings(load_embeddings()))
+    if compact:
+        from doc_store import DocStore
+
+        print("🗃️ Using shared doc store")
+        graph.add("doc_store", DocStore)
+
+    for corpus, persist_directory, flat_directory, source_path in corpora:
+        _add_corpus_nodes(
+            graph, corpus, persist_directory, flat_directory, source_path,
+            vector_backend, compact, watch_corpus and corpus == "research",
         )
-        patient_hybrid = EnsembleRetriever(
-            retrievers=[patient_vector_retriever, patient_bm25],
-            weights=[0.7, 0.3],
+
+    if use_rerank:
+        graph.add("reranker", lambda: maybe_batched_reranker(load_reranker()))
+    return graph
+
+
+def _add_corpus_nodes(
+    graph: InitGraph,
+    corpus: str,
+    persist_directory: str,
+    flat_directory: str,
+    source_path: str,
+    vector_backend: str,
+    compact: bool,
+    watch: bool,
+) -> None:
+    # Node names are per corpus, so callables take their deps as keywords.
+    store_node, vector_node, bm25_node = f"{corpus}_store", f"{corpus}_vector", f"{corpus}_bm25"
+
+    if compact and corpus == "research":
+        from sharding import sharded_search_plan
+
+        plan = sharded_search_plan()
+        if plan is not None:
+            _add_sharded_research_nodes(graph, plan, watch)
+            return
+
+    graph.add(store_node, lambda embeddings: open_chroma(persist_directory, embeddings))
+    watched_flat_directory = flat_directory if vector_backend == "flat" else None
+
+    if compact:
+        from hybrid_search import BM25Search, HybridRetriever
+
+        graph.add(
+            vector_node,
+            lambda **r: build_vector_search(
+                r[store_node], r["embeddings"], flat_directory, vector_backend
+            ),
+            deps=["embeddings", store_node],
         )
 
-        return [main_hybrid, patient_hybrid]
+        def bm25(doc_store):
+            return BM25Index.from_token_streams(
+                doc_store.iter_terms(corpus), tokenizer=ANALYZER, query_tokenizer=ANALYZER.query
+            )
+
+        graph.add(bm25_node, bm25)
+
+        def hybrid(**r):
+            if watch:
+                start_corpus_watcher(
+                    source_path, r[store_node], r[bm25_node], r["doc_store"], watched_flat_directory
+                )
+            return HybridRetriever(
+                corpus, [r[vector_node], BM25Search(r[bm25_node], k=5)], [0.7, 0.3], r["doc_store"]
+            )
 
-    print("🧮 Building BM25 retriever from research docs...")
-    research_docs = load_and_clean_papers_for_bm25("pcos_papers_merged.csv")
-    main_bm25 = BM25Retriever.from_documents(research_docs)
-    main_bm25.k = 5
+        graph.add(f"{corpus}_hybrid", hybrid, deps=[vector_node, bm25_node, store_node, "doc_store"])
+        return
 
-    main_hybrid = EnsembleRetriever(
-        retrievers=[main_vector_retriever, main_bm25],
-        weights=[0.7, 0.3],
+    graph.add(
+        vector_node,
+        lambda **r: build_vector_retriever(
+            r[store_node], r["embeddings"], flat_directory, vector_backend
+        ),
+        deps=["embeddings", store_node],
+    )
+    load_docs = (
+        load_and_clean_papers_for_bm25 if corpus == "research" else load_patient_articles_for_bm25
+    )
+    graph.add(bm25_node, lambda: build_bm25_retriever(load_docs(source_path), name=f"{corpus} BM25"))
+
+    def legacy_hybrid(**r):
+        if watch:
+            start_corpus_watcher(
+                source_path, r[store_node], r[bm25_node].index, flat_directory=watched_flat_directory
+            )
+        return ensemble([r[vector_node], r[bm25_node]], [0.7, 0.3])
+
+    graph.add(f"{corpus}_hybrid", legacy_hybrid, deps=[vector_node, bm25_node, store_node])
+
+
+def _add_sharded_research_nodes(graph: InitGraph, plan, watch: bool) -> None:
+    """Research search scattered over shard server processes (see `sharding.py`)."""
+    from hybrid_search import HybridRetriever
+    from sharding import ShardedBM25Search, ShardedVectorSearch, connect_shards
+
+    if watch:
+        print("⚠️ The corpus watcher does not update shards; sync, export and re-shard instead")
+    # Shard servers load while the embedder does.
+    graph.add("research_shards", lambda: connect_shards(plan))
+    graph.add(
+        "research_vector",
+        lambda embeddings, research_shards: ShardedVectorSearch(
+            research_shards,
+            plan,
+            embeddings,
+            prefilter=int(os.getenv("CYSTERHOOD_FLAT_PREFILTER", "0")),
+        ),
+    )
+    graph.add("research_bm25", lambda research_shards: ShardedBM25Search(research_shards, plan, k=5))
+    graph.add(
+        "research_hybrid",
+        lambda research_vector, research_bm25, doc_store: HybridRetriever(
+            "research", [research_vector, research_bm25], [0.7, 0.3], doc_store
+        ),
     )
 
-    return [main_hybrid]
+
+def build_rag_components(
+    include_patient_data: bool = True,
+    watch_corpus: bool = False,
+    vector_backend: Optional[str] = None,
+    use_rerank: bool = False,
+):
+    """Build retrievers (and optionally the reranker) concurrently.
+
+    Returns `(retrievers, reranker)`; `reranker` is None unless `use_rerank`.
+    """
+    print("📂 Loading vectorstores...")
+    if include_patient_data:
+        print("🔗 Using dual corpora (research + patient)")
+    print("🧮 Building BM25 retrievers from original docs...")
+
+    graph = retriever_graph(include_patient_data, watch_corpus, vector_backend, use_rerank)
+    results = graph.run()
+    print(graph.report())
+
+    retrievers = [results["research_hybrid"]]
+    if include_patient_data:
+        retrievers.append(results["patient_hybrid"])
+    return retrievers, results.get("reranker")
+
+
+def build_retrievers(
+    include_patient_data: bool = True,
+    watch_corpus: bool = False,
+    vector_backend: Optional[str] = None,
+):
+    retrievers, _ = build_rag_components(include_patient_data, watch_corpus, vector_backend)
+    return retrievers
 
 
 def retrieve_combined(retrievers: List, query: str) -> List:
@@ -162,34 +549,37 @@ def retrieve_combined(retrievers: List, query: str) -> List:
     return unique[:10]
 
 
+def uses_doc_store(retrievers: List) -> bool:
+    return bool(retrievers) and all(hasattr(r, "doc_store") for r in retrievers)
+
+
+def doc_corpus(metadata: dict) -> str:
+    return "patient" if metadata.get("chunk_type") == "patient" else "research"
+
+
+def retrieve_handles(retrievers: List, query: str, flt: Optional[RetrievalFilter] = None) -> List:
+    """`retrieve_combined` for doc-store retrievers: `DocHandle`s, no text loaded."""
+    from hybrid_search import dedupe_handles
+
+    handles = []
+    for r in retrievers:
+        handles.extend(r.search(query, flt))
+    return dedupe_handles(handles)[:10]
+
+
 def fallback_web_search(query: str) -> List[str]:
     print("🌐 Triggering real-time web search fallback...")
-    api_key = os.getenv("BING_API_KEY")
-    if not api_key:
-        print("❌ BING_API_KEY not set.")
-        return []
-
-    url = "https://api.bing.microsoft.com/v7.0/search"
-    headers = {"Ocp-Apim-Subscription-Key": api_key}
-    params = {
-        "q": query,
-        "count": 5,
-        "textDecorations": True,
-        "textFormat": "HTML",
-    }
+    from web_search import bing_search
 
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code != 200:
-        print("❌ Web search failed:", response.text)
-        return []
+    return [
+        f"{result['name']} ({result['url']}): {result['snippet']}"
+        for result in bing_search(query)
+    ]
 
-    data = response.json()
-    snippets: List[str] = []
-    for result in data.get("webPages", {}).get("value", []):
-        snippets.append(
-            f"{result['name']} ({result['url']}): {result['snippet']}"
-        )
-    return snippets
+
+def doc_key(doc) -> str:
+    metadata = getattr(doc, "metadata", {}) or {}
+    return str(metadata.get("doc_id") or metadata.get("title", "N/A"))
 
 
 def format_docs(docs: List) -> str:
@@ -199,7 +589,7 @@ def format_docs(docs: List) -> str:
     )
 
 
-def generate_query_variations(llm: ChatAnthropic, question: str) -> List[str]:
+def generate_query_variations(llm: "ChatAnthropic", question: str) -> List[str]:
     prompt = (
         "Generate 3 different variations of this user question to help retrieve relevant documents.\n\n"
         f"Original question: {question}\n\n"
@@ -211,22 +601,58 @@ def generate_query_variations(llm: ChatAnthropic, question: str) -> List[str]:
     return variations[:3]
 
 
+# Shown (via `AnswerUnavailable`) when no model answers in time, with the sources found.
+LLM_UNAVAILABLE_ANSWER = (
+    "I couldn't reach the language model just now 💜 The sources below are the most "
+    "relevant excerpts I found for your question; please ask again in a moment."
+)
+ANSWER_CUT_OFF = "\n\n_(The answer was cut off because the language model stopped responding.)_"
+
+# Documents materialized per answer on the doc-store path: the prompt uses 5.
+MATERIALIZED_DOCS = 10
+
+# Low-recall detection. Rerank scores are CrossEncoder probabilities; without
+# a rerank pass the best vector (cosine) score of the question itself is used.
+LOW_RECALL_RERANK_SCORE = float(os.getenv("CYSTERHOOD_LOW_RECALL_RERANK_SCORE", "0.05"))
+LOW_RECALL_VECTOR_SCORE = float(os.getenv("CYSTERHOOD_LOW_RECALL_VECTOR_SCORE", "0.25"))
+# Early vector scores below this start a speculative web search.
+WEB_PREFETCH_SCORE = float(os.getenv("CYSTERHOOD_WEB_PREFETCH_SCORE", "0.35"))
+
+LOW_RECALL = REGISTRY.counter("retrieval.low_recall")
+FOLLOW_UPS_CONDENSED = REGISTRY.counter("conversation.follow_ups_condensed")
+CANDIDATES_REUSED = REGISTRY.counter("conversation.candidates_reused")
+
+
 def create_rag_chain(
     retrievers: List,
     use_multiquery: bool = False,
     use_rerank: bool = False,
+    reranker=None,
+    use_router: bool = False,
+    llm=None,
+    web: Optional[WebSearch] = None,
+    use_retrieval_cache: bool = True,
+    retrieval_cache: Optional[RetrievalCache] = None,
 ):
+    """Build `chain_call`; `use_router` lets a `QueryRouter` skip the
+    multiquery and rerank stages per question. `llm` and `web` replace the
+    Claude client and Bing search (the load test passes stubs).
+    `use_retrieval_cache` reuses ranked doc ids for repeated queries (doc
+    store path only)."""
     print("⚙️ Setting up RAG chain...")
-    llm = ChatAnthropic(model="claude-3-haiku-20240307")
+    if llm is None:
+        with timed("import langchain_anthropic"):
+            llm = build_llm()
 
-    reranker = (
-        CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2") if use_rerank else None
-    )
+    if not use_rerank:
+        reranker = None
+    elif reranker is None:
+        reranker = maybe_batched_reranker(load_reranker())
 
     prompt = PromptTemplate.from_template(
         """You are a PCOS education assistant. Use the following research and patient-friendly excerpts to answer the question in clear, empathetic language.
 
-Context:
+{conversation}Context:
 {context}
 
 Question: {question}
@@ -240,15 +666,103 @@ Instructions:
 Answer:"""
     )
 
-    def chain_call(question: str, history: List[str]):
-        print(f"\n🔍 Retrieving documents for: {question}")
+    compact = uses_doc_store(retrievers)
+    doc_store = retrievers[0].doc_store if compact else None
+
+    router = QueryRouter() if use_router else None
+    web = web or WebSearch()
+
+    if use_retrieval_cache and compact:
+        retrieval_cache = retrieval_cache or default_retrieval_cache()
+    else:
+        retrieval_cache = None
+    # Everything besides the query and corpus that decides the ranking.
+    pipeline_config = {
+        "retrievers": [r.describe() for r in retrievers] if compact else None,
+        "multiquery": use_multiquery,
+        "query_llm": model_name(llm) if use_multiquery else None,
+        "reranker": type(getattr(reranker, "inner", reranker)).__name__ if reranker else None,
+        "router": use_router,
+        "backend": inference_backend(),
+        "analyzer": ANALYZER.version,
+        "materialized": MATERIALIZED_DOCS,
+    }
 
-        if use_multiquery:
+    def retrieval_key(query: str, flt: Optional[RetrievalFilter]) -> str:
+        corpus_version = [doc_store.version()] + [r.version for r in retrievers]
+        config = {**pipeline_config, "filters": asdict(flt) if flt is not None else None}
+        return cache_key(query, config, corpus_version)
+
+    def first_pass(query: str, flt: Optional[RetrievalFilter] = None):
+        """Handles for `query` itself plus each corpus's (vector, BM25) lists, for routing."""
+        from hybrid_search import dedupe_handles
+
+        if not compact:
+            return None, []
+        components = [r.search_components(query, flt) for r in retrievers]
+        handles = dedupe_handles([h for r, c in zip(retrievers, components) for h in r.fuse(c)])
+        return handles[:10], [(c[0], c[1]) for c in components]
+
+    def retrieve_from_doc_store(
+        question: str, queries: List[str], rerank: bool, initial=None, flt=None
+    ) -> List:
+        """Rank by id and score only; texts are read for reranking, documents for the top few.
+
+        `initial` holds handles already retrieved for `question` itself.
+        Several queries go through one pooled MMR stage instead.
+        """
+        from hybrid_search import dedupe_handles, materialize, pooled_search
+
+        if len(queries) > 1:
+            # One fetch per corpus and one MMR pass over every query's candidates.
+            handles = pooled_search(retrievers, queries, flt=flt)[: 10 * len(queries)]
+        else:
+            handles = list(initial) if initial is not None else retrieve_handles(retrievers, question, flt)
+        handles = dedupe_handles(handles)
+        if len(handles) < 2:
+            return materialize(doc_store, handles), None
+        top_score = None
+        if reranker and rerank:
+            print("🎯 Reranking results with CrossEncoder...")
+            texts = doc_store.get_texts([h.doc_id for h in handles])
+            handles = [h for h in handles if h.doc_id in texts]
+            scores = reranker.predict([(question, texts[h.doc_id]) for h in handles])
+            ranked = sorted(zip(handles, scores), key=lambda x: x[1], reverse=True)
+            handles = [h for h, _ in ranked]
+            top_score = float(ranked[0][1]) if ranked else None
+        return materialize(doc_store, handles[:MATERIALIZED_DOCS]), top_score
+
+    def rerank_docs(query: str, docs: List):
+        """Docs sorted by CrossEncoder score, and the top score."""
+        print("🎯 Reranking results with CrossEncoder...")
+        pairs = [(query, d.page_content) for d in docs]
+        scores = reranker.predict(pairs)
+        ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+        return [doc for doc, _ in ranked], float(ranked[0][1]) if ranked else None
+
+    def retrieve(query: str, multiquery: bool, rerank: bool, initial=None, flt=None):
+        """Ranked documents, and the top rerank score (None when not reranked).
+
+        `flt` is pushed into the searches; the legacy retrievers post-filter.
+        """
+        if multiquery:
             print("🔁 Generating query variations (no structured_output)...")
-            queries = generate_query_variations(llm, question)
+            try:
+                queries = generate_query_variations(llm, query)
+            except LLMUnavailable as e:
+                print(f"⚠️ Query variations unavailable, searching the question alone: {e}")
+                queries = []
             print("Generated variations:")
             for q in queries:
                 print(f" - {q}")
+            if initial is not None or not queries:
+                queries = [query] + queries
+        else:
+            queries = [query]
+
+        if compact:
+            return retrieve_from_doc_store(query, queries, rerank, initial, flt)
+        if multiquery:
             docs = []
             for q in queries:
                 docs.extend(retrieve_combined(retrievers, q))
@@ -262,38 +776,205 @@ Answer:"""
                     unique_docs.append(d)
             docs = unique_docs
         else:
-            docs = retrieve_combined(retrievers, question)
-
-        if len(docs) < 2:
-            print("⚠️ Low recall — using web search fallback")
-            snippets = fallback_web_search(question)
-            docs = [
-                type(
-                    "Doc",
-                    (),
-                    {
-                        "page_content": s,
-                        "metadata": {"title": "Web", "source": "Bing"},
-                    },
-                )
-                for s in snippets
-            ]
+            docs = retrieve_combined(retrievers, query)
+        if flt is not None:
+            docs = [d for d in docs if flt.matches(d.metadata, doc_corpus(d.metadata))]
+        if reranker and rerank and len(docs) >= 2:
+            return rerank_docs(query, docs)
+        return docs, None
+
+    def add_web_results(query: str, docs: List, prefetched=None) -> List:
+        """Low recall: merge web results (prefetched if available) with the local docs."""
+        LOW_RECALL.inc()
+        print("⚠️ Low recall — using web search fallback")
+        try:
+            web_docs = (prefetched or web.prefetch(query)).result()
+        except Exception as e:
+            print(f"❌ Web search failed: {e}")
+            return docs
+        if not web_docs:
+            return docs
+        docs = web_docs + docs
+        if reranker:
+            docs, _ = rerank_docs(query, docs)
+        return docs
+
+    def shadow_compare(question: str, query: str, route, initial, served: List, flt=None) -> None:
+        """Run the full pipeline for a routed question and log how much context it shares."""
+        try:
+            full, _ = retrieve(query, use_multiquery, True, initial, flt)
+        except Exception as e:
+            print(f"⚠️ Router shadow run failed: {e}")
+            return
+        overlap = context_overlap([doc_key(d) for d in served], [doc_key(d) for d in full])
+        router.log(question, query, route, shadow_overlap=overlap)
+
+    conversations = ConversationStore()
+    # Sharded BM25 searches answer `idf` themselves, from global statistics.
+    bm25_indexes = [
+        getattr(s, "index", s) for r in retrievers for s in getattr(r, "searches", [])[1:]
+    ] + [
+        x.index
+        for r in retrievers
+        for x in getattr(r, "retrievers", [])
+        if isinstance(x, BM25IndexRetriever)
+    ]
+
+    def term_weight(term: str) -> float:
+        """IDF of an analyzed term, the highest among the BM25 indexes."""
+        return max((index.idf(term) for index in bm25_indexes), default=1.0)
+
+    def with_snippets(query: str, docs: List) -> List:
+        """Copies of `docs` carrying their best snippet for `query` in `metadata["snippet"]`."""
+        indexes = {}
+        if compact:
+            indexes = doc_store.get_sentence_indexes([d.metadata.get("doc_id") for d in docs])
+        terms = ANALYZER.query(query)
+        return [
+            Document(
+                page_content=d.page_content,
+                metadata={
+                    **d.metadata,
+                    "snippet": select_snippet(
+                        d.page_content, terms, indexes.get(d.metadata.get("doc_id")), term_weight
+                    ),
+                },
+            )
+            for d in docs
+        ]
 
-        if reranker and docs:
-            print("🎯 Reranking results with CrossEncoder...")
-            pairs = [(question, d.page_content) for d in docs]
-            scores = reranker.predict(pairs)
-            docs = [
-                doc
-                for doc, _ in sorted(
-                    zip(docs, scores), key=lambda x: x[1], reverse=True
-                )
-            ]
+    def rescore(query: str, docs: List) -> List:
+        if reranker:
+            print("🎯 Re-scoring previous candidates with CrossEncoder...")
+            scores = reranker.predict([(query, d.page_content) for d in docs])
+        else:
+            scores = [similarity(query, d.page_content) for d in docs]
+        return [doc for doc, _ in sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)]
+
+    def chain_call(
+        question: str,
+        history: List[str],
+        on_token: Optional[Callable[[str], None]] = None,
+        conversation_id: Optional[str] = None,
+        filters: Optional[RetrievalFilter] = None,
+    ):
+        """Answer `question`; with `on_token`, stream the answer as it is generated.
+
+        With a `conversation_id`, follow-ups are condensed against the previous
+        turn and may reuse its candidates; otherwise `history` supplies the turns.
+        `filters` restricts retrieval by year, corpus and chunk type.
+        """
+        if conversation_id:
+            state = conversations.get(conversation_id, history)
+        else:
+            state = ConversationState.from_history(history)
+        previous = state.last
+
+        query = question
+        follow_up = previous is not None and is_follow_up(question)
+        if follow_up:
+            query = condense(question, previous.query)
+            FOLLOW_UPS_CONDENSED.inc()
+            print(f"🧵 Follow-up condensed to: {query}")
+        print(f"\n🔍 Retrieving documents for: {query}")
+        if filters is not None:
+            print(f"🔎 Filters: {filters.describe()}")
+        allow_web = filters is None or filters.matches({}, corpus="web")
+
+        # Only a follow-up asking nothing new re-scores the last candidates.
+        reuse = (
+            filters is None
+            and follow_up
+            and bool(previous.candidates)
+            and not new_terms(question, previous.query)
+        )
+        route = None
+        initial = None
+        web_prefetch = None
+        top_score = None
+        started = time.perf_counter()
+        if reuse:
+            CANDIDATES_REUSED.inc()
+            print(f"♻️ Reusing {len(previous.candidates)} candidates from the previous turn")
+            docs = rescore(query, previous.candidates)
+        else:
+            key = retrieval_key(query, filters) if retrieval_cache is not None else None
+            cached = retrieval_cache.get(key) if key is not None else None
+            if cached is not None:
+                print(f"💾 Reusing the cached ranking ({len(cached.doc_ids)} documents)")
+                docs = doc_store.get_documents(cached.doc_ids)
+                rerank_top, top_vector_score = cached.top_rerank_score, cached.top_vector_score
+            else:
+                multiquery, rerank = use_multiquery, True
+                initial, components = first_pass(query, filters)
+                signals = route_signals(query, components)
+                top_vector_score = signals.top_vector_score
+                if allow_web and top_vector_score is not None and top_vector_score < WEB_PREFETCH_SCORE:
+                    # Weak early hits: fetch web results while the rest of retrieval runs.
+                    print(f"🌐 Weak vector scores ({top_vector_score:.2f}) — prefetching web results")
+                    web_prefetch = web.prefetch(query)
+                if router is not None:
+                    route = router.decide(signals)
+                    multiquery = use_multiquery and route.multiquery
+                    rerank = route.rerank
+                    print(f"🧭 Route: multiquery={multiquery}, rerank={rerank} ({route.reason})")
+                docs, rerank_top = retrieve(query, multiquery, rerank, initial, filters)
+                if key is not None:
+                    retrieval_cache.put(key, query, [doc_key(d) for d in docs], rerank_top, top_vector_score)
+            top_score = rerank_top if rerank_top is not None else top_vector_score
+            low_threshold = LOW_RECALL_RERANK_SCORE if rerank_top is not None else LOW_RECALL_VECTOR_SCORE
+            if allow_web and (len(docs) < 2 or (top_score is not None and top_score < low_threshold)):
+                docs = add_web_results(query, docs, web_prefetch)
+        candidates = [d for d in docs if not d.metadata.get("web")]
+        docs = with_snippets(query, docs[:MATERIALIZED_DOCS])
+        retrieval_seconds = time.perf_counter() - started
 
         context = format_docs(docs[:5])
-        response = llm.invoke(prompt.format(context=context, question=question))
-        history.append(f"Q: {question}\nA: {response.content}")
-        return response.content, docs
+        final_prompt = prompt.format(
+            conversation=state.prompt_history(), context=context, question=question
+        )
+        parts: List[str] = []
+        unavailable: Optional[AnswerUnavailable] = None
+        try:
+            if on_token is None:
+                parts.append(llm.invoke(final_prompt).content)
+            else:
+                for chunk in llm.stream(final_prompt):
+                    parts.append(chunk.content)
+                    on_token(chunk.content)
+        except LLMUnavailable as e:
+            print(f"❌ {e}")
+            note = ANSWER_CUT_OFF if parts else LLM_UNAVAILABLE_ANSWER
+            if on_token is not None:
+                on_token(note)
+            unavailable = AnswerUnavailable("".join(parts) + note, docs)
+            unavailable.__cause__ = e
+        answer = "".join(parts)
+        if route is not None:
+            router.log(
+                question,
+                query,
+                route,
+                retrieval_seconds=round(retrieval_seconds, 4),
+                total_seconds=round(time.perf_counter() - started, 4),
+                context=[doc_key(d) for d in docs[:5]],
+            )
+            if router.should_shadow(route):
+                threading.Thread(
+                    target=shadow_compare,
+                    args=(question, query, route, initial, docs, filters),
+                    daemon=True,
+                ).start()
+        if unavailable is not None:
+            # Not an answer: kept out of the history, the conversation and the callers' stores.
+            raise unavailable
+        history.append(f"Q: {question}\nA: {answer}")
+        # Filtered candidates must not be reused by an unfiltered follow-up.
+        state.turns.append(Turn(question, query, answer, candidates if filters is None else []))
+        # Only the latest turn's candidates can be reused.
+        if previous is not None:
+            previous.candidates = []
+        return answer, docs
 
     print("✅ RAG chain ready (hybrid + MMR + rerank capable)")
     return chain_call
@@ -318,12 +999,14 @@ def query_pcos_rag(chain_call, questions: List[str]):
 if __name__ == "__main__":
     if not os.environ.get("ANTHROPIC_API_KEY"):
         raise RuntimeError("ANTHROPIC_API_KEY not set.")
-    retrievers = build_retrievers(include_patient_data=True)
+    retrievers, reranker = build_rag_components(include_patient_data=True, use_rerank=True)
     chain_call = create_rag_chain(
         retrievers,
         use_multiquery=True,
         use_rerank=True,
+        reranker=reranker,
     )
+    print(f"⏱️ Startup timings:\n{format_timings()}")
     query_pcos_rag(
         chain_call,
         [
@@ -0,0 +1,148 @@
+"""Cache of retrieval results, kept apart from answer generation.
+
+The chain stores the post-rerank ranked doc-id list for each retrieval,
+keyed by the normalized query, the pipeline configuration (retrievers and
+their weights, multiquery, rerank, router, filters, inference backend,
+analyzer version) and the corpus version (the doc store's write counter plus
+each index's own version). A repeated question then skips embedding, search,
+fusion and reranking, and prompt or generation experiments re-run only the
+LLM. Anything that could change the ranking changes the key, so entries
+are never invalidated, only aged out.
+
+Entries live in a sqlite file (`CYSTERHOOD_RETRIEVAL_CACHE`, default
+`./retrieval_cache.sqlite`), shared by worker processes and kept across
+restarts and evaluation runs. `CYSTERHOOD_RETRIEVAL_CACHE=off` disables it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List, NamedTuple, Optional
+
+from metrics import REGISTRY
+
+RETRIEVAL_CACHE_PATH = os.getenv("CYSTERHOOD_RETRIEVAL_CACHE", "./retrieval_cache.sqlite")
+MAX_ENTRIES = int(os.getenv("CYSTERHOOD_RETRIEVAL_CACHE_ENTRIES", "20000"))
+TTL_SECONDS = float(os.getenv("CYSTERHOOD_RETRIEVAL_CACHE_TTL", str(30 * 86400)))
+# Bump when ranking code changes in a way the configuration does not capture.
+CACHE_FORMAT = 1
+PRUNE_EVERY = 200
+
+HITS = REGISTRY.counter("retrieval_cache.hits")
+MISSES = REGISTRY.counter("retrieval_cache.misses")
+
+
+class CachedRetrieval(NamedTuple):
+    doc_ids: List[str]
+    # Kept for low-recall detection, which runs again on a hit.
+    top_rerank_score: Optional[float]
+    top_vector_score: Optional[float]
+
+
+def normalize_query(query: str) -> str:
+    """Case, width, whitespace and trailing punctuation do not change the key."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ")
+
+
+def cache_key(query: str, config: dict, corpus_version) -> str:
+    payload = json.dumps(
+        [CACHE_FORMAT, normalize_query(query), config, corpus_version], sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class RetrievalCache:
+    def __init__(
+        self,
+        path: str = RETRIEVAL_CACHE_PATH,
+        max_entries: int = MAX_ENTRIES,
+        ttl: float = TTL_SECONDS,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._puts = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    doc_ids TEXT NOT NULL,
+                    top_rerank_score REAL,
+                    top_vector_score REAL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections are not shareable across threads; keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[CachedRetrieval]:
+        row = self._connect().execute(
+            "SELECT doc_ids, top_rerank_score, top_vector_score, created_at FROM results WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or time.time() - row[3] > self.ttl:
+            MISSES.inc()
+            return None
+        HITS.inc()
+        return CachedRetrieval(json.loads(row[0]), row[1], row[2])
+
+    def put(
+        self,
+        key: str,
+        query: str,
+        doc_ids: List[str],
+        top_rerank_score: Optional[float],
+        top_vector_score: Optional[float],
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, query, doc_ids, top_rerank_score, "
+                "top_vector_score, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    normalize_query(query),
+                    json.dumps(doc_ids),
+                    top_rerank_score,
+                    top_vector_score,
+                    time.time(),
+                ),
+            )
+        self._puts += 1
+        if self._puts % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop expired entries and the oldest beyond `max_entries`."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.execute(
+                "DELETE FROM results WHERE key IN "
+                "(SELECT key FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results")
+
+
+def default_retrieval_cache() -> Optional[RetrievalCache]:
+    if RETRIEVAL_CACHE_PATH.lower() in ("", "off", "0", "false"):
+        return None
+    return RetrievalCache()
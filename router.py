@@ -0,0 +1,166 @@
+"""Per-question routing of the expensive chain stages.
+
+Multi-query expansion costs an extra LLM call and reranking a CrossEncoder
+pass. `QueryRouter` looks at cheap signals from a first retrieval of the
+question itself and skips them when they are unlikely to change the answer:
+
+- query length (content terms): short, definitional questions are easy
+- top vector score: how close the best dense hit is (cosine)
+- agreement: overlap between the vector and BM25 top hits
+
+Signals that are unavailable (the Document-based retrievers do not expose
+per-search scores) never make a question look easy. With
+`CYSTERHOOD_ROUTER_LOG` set to a path, every decision is appended there
+with its signals and timings (the question text only with
+`CYSTERHOOD_ROUTER_LOG_TEXT=1`); the file is rotated once it reaches
+`CYSTERHOOD_ROUTER_LOG_MAX_BYTES`. With `CYSTERHOOD_ROUTER_SHADOW` > 0,
+that fraction of skipped questions also runs the full pipeline in the
+background and records how much of the served top-5 context it kept, to
+measure quality impact against latency saved.
+"""
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from conversation import content_terms
+from metrics import REGISTRY
+
+# Off unless a path is given; questions are user data, so their text is opt-in too.
+ROUTER_LOG = os.getenv("CYSTERHOOD_ROUTER_LOG", "")
+ROUTER_LOG_TEXT = os.getenv("CYSTERHOOD_ROUTER_LOG_TEXT", "0") == "1"
+ROUTER_LOG_MAX_BYTES = int(os.getenv("CYSTERHOOD_ROUTER_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+MAX_EASY_TERMS = int(os.getenv("CYSTERHOOD_ROUTER_MAX_TERMS", "6"))
+MIN_VECTOR_SCORE = float(os.getenv("CYSTERHOOD_ROUTER_MIN_SCORE", "0.5"))
+MIN_AGREEMENT = float(os.getenv("CYSTERHOOD_ROUTER_MIN_AGREEMENT", "0.34"))
+SHADOW_RATE = float(os.getenv("CYSTERHOOD_ROUTER_SHADOW", "0"))
+AGREEMENT_DEPTH = 3
+
+Ranked = List[Tuple[str, float]]
+
+
+@dataclass
+class RouteSignals:
+    query_terms: int
+    top_vector_score: Optional[float] = None
+    agreement: Optional[float] = None
+
+
+@dataclass
+class RouteDecision:
+    multiquery: bool
+    rerank: bool
+    reason: str
+    signals: RouteSignals
+
+
+def route_signals(query: str, components: Sequence[Tuple[Ranked, Ranked]] = ()) -> RouteSignals:
+    """Signals from `(vector, bm25)` ranked lists, one pair per corpus.
+
+    The best corpus counts: a question answered well by either corpus is easy.
+    """
+    signals = RouteSignals(query_terms=len(content_terms(query)))
+    for vector, bm25 in components:
+        if vector:
+            top = vector[0][1]
+            if signals.top_vector_score is None or top > signals.top_vector_score:
+                signals.top_vector_score = top
+        if vector and bm25:
+            vector_top = {doc_id for doc_id, _ in vector[:AGREEMENT_DEPTH]}
+            bm25_top = {doc_id for doc_id, _ in bm25[:AGREEMENT_DEPTH]}
+            agreement = len(vector_top & bm25_top) / AGREEMENT_DEPTH
+            if signals.agreement is None or agreement > signals.agreement:
+                signals.agreement = agreement
+    return signals
+
+
+def context_overlap(served: Sequence[str], full: Sequence[str], depth: int = 5) -> float:
+    served, full = set(served[:depth]), set(full[:depth])
+    return len(served & full) / max(1, len(full))
+
+
+class QueryRouter:
+    def __init__(
+        self,
+        max_easy_terms: int = MAX_EASY_TERMS,
+        min_vector_score: float = MIN_VECTOR_SCORE,
+        min_agreement: float = MIN_AGREEMENT,
+        shadow_rate: float = SHADOW_RATE,
+        log_path: Optional[str] = ROUTER_LOG,
+        log_text: bool = ROUTER_LOG_TEXT,
+        log_max_bytes: int = ROUTER_LOG_MAX_BYTES,
+    ):
+        self.max_easy_terms = max_easy_terms
+        self.min_vector_score = min_vector_score
+        self.min_agreement = min_agreement
+        self.shadow_rate = shadow_rate
+        self.log_path = log_path
+        self.log_text = log_text
+        self.log_max_bytes = log_max_bytes
+        self._lock = threading.Lock()
+        self._shadow_credit = 0.0
+        self._skipped = REGISTRY.counter("router.stages_skipped")
+        self._full = REGISTRY.counter("router.full_pipeline")
+        self._overlap = REGISTRY.histogram("router.shadow_overlap", (0.2, 0.4, 0.6, 0.8, 1.0))
+
+    def decide(self, signals: RouteSignals) -> RouteDecision:
+        short = signals.query_terms <= self.max_easy_terms
+        confident = signals.top_vector_score is not None and signals.top_vector_score >= self.min_vector_score
+        agree = signals.agreement is not None and signals.agreement >= self.min_agreement
+        weak = (signals.top_vector_score is not None and not confident) or (
+            signals.agreement is not None and not agree
+        )
+
+        multiquery = not short or weak
+        rerank = not (confident and agree)
+        if not multiquery and not rerank:
+            reason = "short query, confident and agreeing top hits"
+        elif not multiquery:
+            reason = "short query"
+        elif not short:
+            reason = "long query"
+        else:
+            reason = "low-confidence retrieval"
+        decision = RouteDecision(multiquery, rerank, reason, signals)
+        (self._full if multiquery and rerank else self._skipped).inc()
+        return decision
+
+    def should_shadow(self, decision: RouteDecision) -> bool:
+        if decision.multiquery and decision.rerank:
+            return False
+        # Deterministic sampling keeps the rate exact without an RNG.
+        with self._lock:
+            self._shadow_credit += self.shadow_rate
+            if self._shadow_credit >= 1.0:
+                self._shadow_credit -= 1.0
+                return True
+        return False
+
+    def log(self, question: str, query: str, decision: RouteDecision, **fields) -> None:
+        if "shadow_overlap" in fields:
+            self._overlap.observe(fields["shadow_overlap"])
+        if not self.log_path:
+            return
+        record = {
+            "ts": time.time(),
+            "multiquery": decision.multiquery,
+            "rerank": decision.rerank,
+            "reason": decision.reason,
+            "signals": asdict(decision.signals),
+            **fields,
+        }
+        if self.log_text:
+            record.update(question=question, query=query)
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            try:
+                if os.path.getsize(self.log_path) + len(line) > self.log_max_bytes:
+                    # Keep one previous file, so the log never exceeds twice the cap.
+                    os.replace(self.log_path, self.log_path + ".1")
+            except OSError:
+                pass
+            with open(self.log_path, "a") as f:
+                f.write(line)
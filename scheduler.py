@@ -0,0 +1,162 @@
+"""Admission control in front of the RAG chain.
+
+Every Streamlit session (or API client) submits work tagged with a session id.
+At most `max_concurrency` chain calls run at once; waiting work sits in
+per-session queues that are served round-robin, so one chatty session cannot
+starve the others. When the global queue is full, `submit` raises
+`SchedulerBusy` immediately instead of letting requests pile onto the CPU.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from metrics import REGISTRY
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("CYSTERHOOD_MAX_CONCURRENCY", "2"))
+DEFAULT_MAX_QUEUE = int(os.getenv("CYSTERHOOD_MAX_QUEUE", "32"))
+DEFAULT_MAX_PER_SESSION = int(os.getenv("CYSTERHOOD_MAX_PER_SESSION", "2"))
+
+
+class SchedulerBusy(RuntimeError):
+    """Raised when a request cannot be admitted; callers should say "busy"."""
+
+
+_Job = Tuple[Callable, tuple, dict, Future, float]
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_per_session: int = DEFAULT_MAX_PER_SESSION,
+        paused: bool = False,
+        name: str = "scheduler",
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._paused = paused
+        self._cond = threading.Condition()
+
+        self.queue_depth = REGISTRY.gauge(f"{name}.queue_depth")
+        self.in_flight = REGISTRY.gauge(f"{name}.in_flight")
+        self.wait_seconds = REGISTRY.histogram(f"{name}.wait_seconds")
+        self.run_seconds = REGISTRY.histogram(f"{name}.run_seconds")
+        self.rejected = REGISTRY.counter(f"{name}.rejected")
+        self.completed = REGISTRY.counter(f"{name}.completed")
+
+        self.name = name
+        self._start_workers()
+        # Threads do not survive fork(); pre-forked API workers start their own.
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_workers(self) -> None:
+        for i in range(self.max_concurrency):
+            threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True).start()
+
+    def _after_fork(self) -> None:
+        # Work queued in the parent belongs to the parent; the child starts empty.
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._running = 0
+        self._start_workers()
+
+    # ---------- Admission ----------
+
+    def submit(self, session_id: str, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self._cond:
+            session_queue = self._queues.get(session_id)
+            if self._queued >= self.max_queue:
+                self.rejected.inc()
+                raise SchedulerBusy("The service is busy; please try again shortly.")
+            if session_queue is not None and len(session_queue) >= self.max_per_session:
+                self.rejected.inc()
+                raise SchedulerBusy("Please wait for your previous question to finish.")
+            if session_queue is None:
+                session_queue = self._queues[session_id] = deque()
+            session_queue.append((fn, args, kwargs, future, time.perf_counter()))
+            self._queued += 1
+            self.queue_depth.set(self._queued)
+            self._cond.notify()
+        return future
+
+    def pause(self) -> None:
+        with self._cond:
+            self._paused = True
+
+    def resume(self) -> None:
+        with self._cond:
+            self._paused = False
+            self._cond.notify_all()
+
+    def fail_pending(self, error: BaseException) -> None:
+        """Fail every queued (not yet running) job with `error`."""
+        with self._cond:
+            queues, self._queues = self._queues, OrderedDict()
+            self._queued = 0
+            self.queue_depth.set(0)
+        for session_queue in queues.values():
+            for _, _, _, future, _ in session_queue:
+                future.set_exception(error)
+
+    # ---------- Dispatch ----------
+
+    def _next_job(self) -> _Job:
+        """Pop the head of the least recently served session's queue."""
+        session_id, session_queue = next(iter(self._queues.items()))
+        job = session_queue.popleft()
+        del self._queues[session_id]
+        if session_queue:
+            # Rotate the session to the back: round-robin fair share.
+            self._queues[session_id] = session_queue
+        self._queued -= 1
+        self.queue_depth.set(self._queued)
+        return job
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while self._paused or not self._queues:
+                    self._cond.wait()
+                fn, args, kwargs, future, enqueued_at = self._next_job()
+                self._running += 1
+                self.in_flight.set(self._running)
+
+            self.wait_seconds.observe(time.perf_counter() - enqueued_at)
+            started = time.perf_counter()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            self.run_seconds.observe(time.perf_counter() - started)
+            self.completed.inc()
+
+            with self._cond:
+                self._running -= 1
+                self.in_flight.set(self._running)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._cond:
+            depth, running = self._queued, self._running
+            sessions = len(self._queues)
+        return {
+            "queue_depth": depth,
+            "in_flight": running,
+            "waiting_sessions": sessions,
+            "wait_p50": self.wait_seconds.percentile(50),
+            "wait_p95": self.wait_seconds.percentile(95),
+            "rejected": self.rejected.value,
+            "completed": self.completed.value,
+        }
@@ -0,0 +1,673 @@
+"""Scatter-gather search over a sharded research corpus.
+
+The research flat index and its BM25 postings are split into shards, by a
+hash of the doc id or by publication-year range, and each shard is served
+by its own process (`serve_shard`). The app keeps one `HybridRetriever`
+for the corpus; its two searches ask every shard at once and merge:
+
+- vectors: each shard returns its top `fetch_k` with their vectors, the
+  merged top `fetch_k` go through the same MMR as `FlatVectorSearch`
+- BM25: a first round sums the shards' document counts, lengths and
+  document frequencies, so every shard scores with the global IDF and
+  avgdl; the second round merges the shards' top k
+
+so the fused ranking is the one the single index produces (up to ties; the
+Hamming prefilter, when on, keeps `CYSTERHOOD_FLAT_PREFILTER` rows per
+shard). Year filters skip shards whose range they exclude.
+
+    python sharding.py export --shards 4              # hash shards of the flat export
+    python sharding.py export --by year --years 2010,2016,2020
+    CYSTERHOOD_SHARDED_SEARCH=1 streamlit run app.py
+
+The app starts the shard servers itself, with a random key per run, on
+ports the OS assigns (so several app processes each get their own set),
+unless `CYSTERHOOD_SHARD_ADDRESSES` (`host:port,...` in shard order) points
+at servers run elsewhere with `python sharding.py serve`, which needs an
+explicit `CYSTERHOOD_SHARD_AUTHKEY` on both sides; use that to share one
+set of shards between workers. Requests are pickled, so
+anyone holding the key can run code in a shard: keep the shard ports on a
+private network, never exposed publicly. Shards rebuild their BM25 postings when the doc
+store version changes; re-run the export after `python flat_index.py`.
+A search fails with `ShardsUnavailable` when a shard it needs does not
+answer, rather than ranking a subset of the corpus.
+"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25_index import BM25Index, CollectionStats, idf
+from doc_store import DOC_STORE_PATH, DocStore
+from filters import RetrievalFilter
+from flat_index import RESEARCH_FLAT_DIR, FlatVectorIndex, mmr_select, normalize, write_flat_export
+from metrics import REGISTRY
+from text_analysis import ANALYZER
+
+SHARD_DIR = os.getenv("CYSTERHOOD_SHARD_DIR", "./flat_pcos_shards")
+SHARD_HOST = os.getenv("CYSTERHOOD_SHARD_HOST", "127.0.0.1")
+SHARD_PORT = int(os.getenv("CYSTERHOOD_SHARD_PORT", "8700"))
+SHARD_ADDRESSES = os.getenv("CYSTERHOOD_SHARD_ADDRESSES", "")
+# Only for servers run with `python sharding.py serve`; no default on purpose.
+SHARD_AUTHKEY = os.getenv("CYSTERHOOD_SHARD_AUTHKEY", "").encode("utf-8")
+PLAN_NAME = "plan.json"
+CONNECT_SECONDS = 300.0
+REFRESH_SECONDS = 5.0
+VERSION_SECONDS = 1.0
+DF_CACHE_SIZE = 4096
+
+SHARD_ERRORS = REGISTRY.counter("shards.errors")
+SCATTER_SECONDS = REGISTRY.histogram("shards.scatter_seconds")
+
+Address = Tuple[str, int]
+
+
+class ShardsUnavailable(RuntimeError):
+    """Some shards did not answer; merging the rest would rank a subset of the corpus."""
+
+
+@dataclass(frozen=True)
+class ShardPlan:
+    """How research documents map to shards.
+
+    `by="hash"` spreads doc ids over `count` shards; `by="year"` uses the
+    sorted `years` as boundaries (shard i holds `years[i-1] <= year < years[i]`,
+    undated papers go to shard 0) and has `len(years) + 1` shards.
+    """
+
+    count: int = 1
+    by: str = "hash"
+    years: Tuple[int, ...] = ()
+
+    def __post_init__(self):
+        if self.by == "year":
+            object.__setattr__(self, "years", tuple(sorted(int(y) for y in self.years)))
+            object.__setattr__(self, "count", len(self.years) + 1)
+        elif self.by != "hash":
+            raise ValueError(f"Unknown shard scheme: {self.by}")
+        if self.count < 1:
+            raise ValueError("A shard plan needs at least one shard")
+
+    def shard_of(self, doc_id: str, metadata: dict) -> int:
+        if self.by == "hash":
+            return zlib.crc32(doc_id.encode("utf-8")) % self.count
+        year = metadata.get("year")
+        if not isinstance(year, (int, float)) or year != year:
+            return 0
+        return bisect_right(self.years, year)
+
+    def may_match(self, shard: int, flt: Optional[RetrievalFilter]) -> bool:
+        """False when `flt`'s year range excludes every year `shard` holds."""
+        if self.by != "year" or flt is None:
+            return True
+        low = self.years[shard - 1] if shard > 0 else None
+        high = self.years[shard] if shard < len(self.years) else None
+        if flt.year_max is not None and low is not None and flt.year_max < low:
+            return False
+        if flt.year_min is not None and high is not None and flt.year_min >= high:
+            return False
+        return True
+
+
+def shard_directory(shard_dir: str, shard: int) -> str:
+    return os.path.join(shard_dir, f"shard-{shard}")
+
+
+def save_plan(plan: ShardPlan, shard_dir: str = SHARD_DIR) -> None:
+    os.makedirs(shard_dir, exist_ok=True)
+    path = os.path.join(shard_dir, PLAN_NAME)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(asdict(plan), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_plan(shard_dir: str = SHARD_DIR) -> Optional[ShardPlan]:
+    path = os.path.join(shard_dir, PLAN_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        data = json.load(f)
+    return ShardPlan(data["count"], data["by"], tuple(data["years"]))
+
+
+def sharded_search_plan() -> Optional[ShardPlan]:
+    """The exported plan when `CYSTERHOOD_SHARDED_SEARCH=1`, else None."""
+    if os.getenv("CYSTERHOOD_SHARDED_SEARCH", "0") != "1":
+        return None
+    plan = load_plan()
+    if plan is None:
+        print(f"⚠️ CYSTERHOOD_SHARDED_SEARCH is set but {SHARD_DIR} has no shards; run `python sharding.py export`")
+    return plan
+
+
+def export_shards(
+    plan: ShardPlan, shard_dir: str = SHARD_DIR, source_dir: str = RESEARCH_FLAT_DIR
+) -> List[int]:
+    """Split the current research flat export into one flat export per shard.
+
+    Rows are copied as stored (no re-quantization), so shard scores match
+    the source index exactly.
+    """
+    snapshot = FlatVectorIndex(source_dir).snapshot()
+    assignment = np.array(
+        [plan.shard_of(doc_id, metadata) for doc_id, metadata in zip(snapshot.ids, snapshot.metadatas)],
+        dtype=np.int64,
+    )
+    sizes = []
+    for shard in range(plan.count):
+        rows = np.flatnonzero(assignment == shard)
+        print(f"🧩 Shard {shard}: {len(rows)} documents")
+        write_flat_export(
+            shard_directory(shard_dir, shard),
+            [snapshot.ids[r] for r in rows],
+            [snapshot.metadatas[r] for r in rows],
+            [snapshot.text(r) for r in rows],
+            np.asarray(snapshot.vectors[rows]),
+            np.asarray(snapshot.signs[rows]),
+            np.asarray(snapshot.scale[rows]) if snapshot.scale is not None else None,
+            snapshot.dtype,
+        )
+        sizes.append(len(rows))
+    save_plan(plan, shard_dir)
+    return sizes
+
+
+# ---------- Shard server ----------
+
+
+def _filter_rows(snapshot, flt: Optional[RetrievalFilter]):
+    return snapshot.rows_matching(flt) if flt is not None and flt.constrains_documents else None
+
+
+class Shard:
+    """One shard's flat vectors and BM25 postings, inside a shard server process."""
+
+    METHODS = ("info", "version", "vector_top", "vector_candidates", "bm25_stats", "bm25_search")
+
+    def __init__(
+        self, plan: ShardPlan, shard: int, shard_dir: str = SHARD_DIR, doc_store_path: str = DOC_STORE_PATH
+    ):
+        self.plan = plan
+        self.shard = shard
+        self.vectors = FlatVectorIndex(shard_directory(shard_dir, shard))
+        self.doc_store = DocStore(doc_store_path)
+        self.doc_version, self.bm25 = self._build_bm25()
+        self._next_check = time.monotonic() + REFRESH_SECONDS
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    def _build_bm25(self) -> Tuple[int, BM25Index]:
+        version = self.doc_store.version()
+        index = BM25Index.from_token_streams(
+            (
+                (doc_id, terms, metadata)
+                for doc_id, terms, metadata in self.doc_store.iter_terms("research")
+                if self.plan.shard_of(doc_id, metadata) == self.shard
+            ),
+            tokenizer=ANALYZER,
+            query_tokenizer=ANALYZER.query,
+        )
+        return version, index
+
+    def _rebuild(self) -> None:
+        try:
+            self.doc_version, self.bm25 = self._build_bm25()
+            print(f"🔄 Shard {self.shard} rebuilt BM25 at doc store version {self.doc_version}")
+        finally:
+            self._rebuilding = False
+
+    def _refresh(self) -> None:
+        # Rebuilt off the request path; queries keep the old postings meanwhile.
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_check or self._rebuilding:
+                return
+            self._next_check = now + REFRESH_SECONDS
+            if self.doc_store.version() == self.doc_version:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def version(self) -> Tuple[Optional[str], int]:
+        self.vectors.refresh()
+        self._refresh()
+        return self.vectors.version, self.doc_version
+
+    def info(self) -> dict:
+        return {
+            "shard": self.shard,
+            "vectors": len(self.vectors.snapshot()),
+            "docs": len(self.bm25),
+            "version": self.version(),
+        }
+
+    def vector_top(
+        self, query_vec: np.ndarray, fetch_k: int, prefilter: int, flt: Optional[RetrievalFilter]
+    ) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        snapshot = self.vectors.snapshot()
+        rows, scores = snapshot.top_k(query_vec, fetch_k, prefilter, _filter_rows(snapshot, flt))
+        return [snapshot.ids[int(r)] for r in rows], scores, snapshot.dense(rows)
+
+    def vector_candidates(
+        self, query_vecs: np.ndarray, fetch_k: int, prefilter: int, flt: Optional[RetrievalFilter]
+    ) -> Tuple[List[str], np.ndarray]:
+        snapshot = self.vectors.snapshot()
+        rows = snapshot.candidate_rows(query_vecs, fetch_k, prefilter, _filter_rows(snapshot, flt))
+        return [snapshot.ids[int(r)] for r in rows], snapshot.dense(rows)
+
+    def bm25_stats(self, terms: Sequence[str]) -> CollectionStats:
+        self._refresh()
+        return self.bm25.stats(terms)
+
+    def bm25_search(
+        self, terms: Sequence[str], k: int, flt: Optional[RetrievalFilter], collection: CollectionStats
+    ) -> List[Tuple[str, float]]:
+        index = self.bm25
+        return index.search_terms(terms, k, index.allowed(flt), collection)
+
+
+def _serve_connection(shard: Shard, conn) -> None:
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if method not in Shard.METHODS:
+                    raise ValueError(f"Unknown shard method: {method}")
+                reply = (True, getattr(shard, method)(*args))
+            except Exception as e:
+                reply = (False, repr(e))
+            conn.send(reply)
+
+
+def serve_shard(
+    plan: ShardPlan,
+    shard: int,
+    address: Address,
+    authkey: bytes,
+    shard_dir: str = SHARD_DIR,
+    doc_store_path: str = DOC_STORE_PATH,
+    ready=None,
+) -> None:
+    """Load one shard and answer coordinator requests on `address`, one thread per connection.
+
+    Port 0 binds a free port; the bound address is sent on the `ready` connection.
+    """
+    started = time.perf_counter()
+    state = Shard(plan, shard, shard_dir, doc_store_path)
+    listener = Listener(address, authkey=authkey)
+    address = listener.address
+    if ready is not None:
+        ready.send(address)
+        ready.close()
+    print(
+        f"🧩 Shard {shard} serving {len(state.bm25)} docs on {address[0]}:{address[1]} "
+        f"({time.perf_counter() - started:.1f}s)"
+    )
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+            print(f"⚠️ Shard {shard} rejected a connection: {e!r}")
+            continue
+        threading.Thread(target=_serve_connection, args=(state, conn), daemon=True).start()
+
+
+def start_shard_servers(
+    plan: ShardPlan,
+    authkey: bytes,
+    shard_dir: str = SHARD_DIR,
+    host: str = SHARD_HOST,
+    port: int = 0,
+    doc_store_path: str = DOC_STORE_PATH,
+    daemon: bool = True,
+    timeout: float = CONNECT_SECONDS,
+) -> Tuple[List[Address], List[multiprocessing.Process]]:
+    """Start one server per shard, on `port + shard` (or free ports with `port=0`),
+    and wait until each is listening; their bound addresses."""
+    # Spawned, not forked: shard servers must not inherit the app's models and threads.
+    context = multiprocessing.get_context("spawn")
+    processes, readies = [], []
+    for shard in range(plan.count):
+        ready, child_ready = context.Pipe(duplex=False)
+        address = (host, port + shard if port else 0)
+        process = context.Process(
+            target=serve_shard,
+            args=(plan, shard, address, authkey, shard_dir, os.path.abspath(doc_store_path), child_ready),
+            name=f"shard-{shard}",
+            daemon=daemon,
+        )
+        process.start()
+        child_ready.close()
+        processes.append(process)
+        readies.append(ready)
+    try:
+        deadline = time.monotonic() + timeout
+        addresses = []
+        for shard, (process, ready) in enumerate(zip(processes, readies)):
+            while not ready.poll(0.2):
+                if not process.is_alive():
+                    raise RuntimeError(f"Shard server {shard} exited with code {process.exitcode}")
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Shard server {shard} not listening after {timeout:.0f}s")
+            try:
+                addresses.append(tuple(ready.recv()))
+            except EOFError:
+                process.join(1.0)
+                raise RuntimeError(f"Shard server {shard} exited with code {process.exitcode}") from None
+            ready.close()
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    return addresses, processes
+
+
+# ---------- Coordinator ----------
+
+
+def parse_addresses(spec: str) -> List[Address]:
+    addresses = []
+    for part in spec.split(","):
+        host, _, port = part.strip().rpartition(":")
+        addresses.append((host or SHARD_HOST, int(port)))
+    return addresses
+
+
+class ShardPool:
+    """Connections to every shard server, one set per thread (and per forked process)."""
+
+    def __init__(self, addresses: Sequence[Address], authkey: bytes):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self._local = threading.local()
+        self._versions: Tuple[float, tuple] = (0.0, ())
+        self._versions_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def _connections(self) -> list:
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.conns = [None] * len(self.addresses)
+        return self._local.conns
+
+    def _connect(self, shard: int, wait: float = 0.0):
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                return Client(self.addresses[shard], authkey=self.authkey)
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _drop(self, shard: int, error: BaseException) -> None:
+        SHARD_ERRORS.inc()
+        print(f"⚠️ Shard {shard} at {self.addresses[shard]} unavailable: {error!r}")
+        conns = self._connections()
+        if conns[shard] is not None:
+            try:
+                conns[shard].close()
+            except OSError:
+                pass
+            conns[shard] = None
+
+    def wait_ready(self, timeout: float = CONNECT_SECONDS) -> Dict[int, dict]:
+        """Block until every shard accepts connections; their `info()`."""
+        conns = self._connections()
+        for shard in range(len(self)):
+            if conns[shard] is None:
+                conns[shard] = self._connect(shard, timeout)
+        return self.scatter("info")
+
+    def scatter(self, method: str, *args, shards: Optional[Iterable[int]] = None) -> Dict[int, object]:
+        """Send `method(*args)` to every shard (or `shards`) before reading any
+        reply, so they work in parallel. Raises `ShardsUnavailable` if any fails."""
+        shards = range(len(self)) if shards is None else list(shards)
+        conns = self._connections()
+        started = time.perf_counter()
+        sent, failed = [], []
+        for shard in shards:
+            try:
+                if conns[shard] is None:
+                    conns[shard] = self._connect(shard)
+                conns[shard].send((method, args))
+                sent.append(shard)
+            except (OSError, EOFError) as e:
+                self._drop(shard, e)
+                failed.append(shard)
+        replies: Dict[int, object] = {}
+        for shard in sent:
+            try:
+                ok, value = conns[shard].recv()
+            except (OSError, EOFError) as e:
+                self._drop(shard, e)
+                failed.append(shard)
+                continue
+            if ok:
+                replies[shard] = value
+            else:
+                SHARD_ERRORS.inc()
+                print(f"⚠️ Shard {shard} failed {method}: {value}")
+                failed.append(shard)
+        SCATTER_SECONDS.observe(time.perf_counter() - started)
+        if failed:
+            raise ShardsUnavailable(f"Shards {sorted(failed)} of {len(self)} failed {method}")
+        return replies
+
+    def versions(self) -> tuple:
+        """Every shard's (flat export, BM25 doc store) version, re-read at most once a second."""
+        with self._versions_lock:
+            checked, versions = self._versions
+            if time.monotonic() - checked < VERSION_SECONDS:
+                return versions
+        versions = tuple(sorted(self.scatter("version").items()))
+        with self._versions_lock:
+            self._versions = (time.monotonic(), versions)
+        return versions
+
+
+def connect_shards(plan: ShardPlan, shard_dir: str = SHARD_DIR) -> ShardPool:
+    """A pool over `CYSTERHOOD_SHARD_ADDRESSES`, or over shard servers started here."""
+    if SHARD_ADDRESSES:
+        addresses = parse_addresses(SHARD_ADDRESSES)
+        if len(addresses) != plan.count:
+            raise ValueError(f"{len(addresses)} shard addresses for a {plan.count}-shard plan")
+        if not SHARD_AUTHKEY:
+            raise ValueError("CYSTERHOOD_SHARD_ADDRESSES needs the servers' CYSTERHOOD_SHARD_AUTHKEY")
+        authkey = SHARD_AUTHKEY
+    else:
+        print(f"🧩 Starting {plan.count} research shard servers ({plan.by})")
+        authkey = os.urandom(32)
+        addresses, _ = start_shard_servers(plan, authkey, shard_dir)
+    pool = ShardPool(addresses, authkey)
+    infos = pool.wait_ready()
+    docs = sum(info["docs"] for info in infos.values())
+    print(f"✅ {len(infos)}/{plan.count} research shards ready ({docs} docs)")
+    return pool
+
+
+def _merge_top(replies: Iterable, k: int) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    ids: List[str] = []
+    scores, vectors = [], []
+    for shard_ids, shard_scores, shard_vectors in replies:
+        ids.extend(shard_ids)
+        scores.append(shard_scores)
+        vectors.append(shard_vectors)
+    if not ids:
+        return [], np.empty(0, dtype=np.float32), np.empty((0, 0), dtype=np.float32)
+    scores = np.concatenate(scores)
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [ids[i] for i in order], scores[order], np.vstack(vectors)[order]
+
+
+class ShardedVectorSearch:
+    """`FlatVectorSearch` scattered over shard servers; the query is embedded here."""
+
+    def __init__(
+        self,
+        pool: ShardPool,
+        plan: ShardPlan,
+        embeddings,
+        k: int = 5,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        prefilter: int = 0,
+    ):
+        self.pool = pool
+        self.plan = plan
+        self.embeddings = embeddings
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.prefilter = prefilter
+
+    def describe(self) -> dict:
+        return {
+            "search": "sharded-flat",
+            "plan": asdict(self.plan),
+            "k": self.k,
+            "fetch_k": self.fetch_k,
+            "lambda_mult": self.lambda_mult,
+            "prefilter": self.prefilter,
+        }
+
+    @property
+    def version(self) -> tuple:
+        # Covers the shards' BM25 postings too.
+        return self.pool.versions()
+
+    def _shards(self, flt: Optional[RetrievalFilter]) -> List[int]:
+        return [shard for shard in range(len(self.pool)) if self.plan.may_match(shard, flt)]
+
+    def __call__(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        query_vec = normalize(self.embeddings.embed_query(query))
+        replies = self.pool.scatter(
+            "vector_top", query_vec, self.fetch_k, self.prefilter, flt, shards=self._shards(flt)
+        )
+        ids, scores, vectors = _merge_top(replies.values(), self.fetch_k)
+        if not ids:
+            return []
+        picked = mmr_select(scores, vectors, self.k, self.lambda_mult)
+        return [(ids[i], float(scores[i])) for i in picked]
+
+    def candidates(
+        self, query_vecs: np.ndarray, flt: Optional[RetrievalFilter] = None
+    ) -> Tuple[List[str], np.ndarray]:
+        """Union of each query's global top `fetch_k`, from the shards' own top `fetch_k`s."""
+        replies = self.pool.scatter(
+            "vector_candidates", query_vecs, self.fetch_k, self.prefilter, flt, shards=self._shards(flt)
+        )
+        ids = [doc_id for shard_ids, _ in replies.values() for doc_id in shard_ids]
+        if not ids:
+            return [], np.empty((0, query_vecs.shape[1]), dtype=np.float32)
+        vectors = np.vstack([shard_vectors for _, shard_vectors in replies.values()])
+        scores = vectors @ query_vecs.T
+        k = min(self.fetch_k, len(ids))
+        picked = np.unique(np.argpartition(-scores, k - 1, axis=0)[:k])
+        return [ids[i] for i in picked], vectors[picked]
+
+
+class ShardedBM25Search:
+    """`BM25Search` scattered over shard servers, scored with global statistics."""
+
+    def __init__(self, pool: ShardPool, plan: ShardPlan, k: int = 5, query_tokenizer=ANALYZER.query):
+        self.pool = pool
+        self.plan = plan
+        self.k = k
+        self.query_tokenizer = query_tokenizer
+        self._docs = 0
+        self._df: "OrderedDict[str, int]" = OrderedDict()
+        self._df_lock = threading.Lock()
+
+    def describe(self) -> dict:
+        return {"search": "sharded-bm25", "plan": asdict(self.plan), "k": self.k}
+
+    @property
+    def version(self) -> None:
+        # Reported by the vector search, which asks the same shards.
+        return None
+
+    def collection_stats(self, terms: Sequence[str]) -> CollectionStats:
+        replies = list(self.pool.scatter("bm25_stats", list(terms)).values())
+        stats = CollectionStats(
+            sum(r.docs for r in replies),
+            sum(r.total_len for r in replies),
+            {term: sum(r.df.get(term, 0) for r in replies) for term in terms},
+        )
+        with self._df_lock:
+            self._docs = stats.docs
+            for term, df in stats.df.items():
+                self._df[term] = df
+                self._df.move_to_end(term)
+            while len(self._df) > DF_CACHE_SIZE:
+                self._df.popitem(last=False)
+        return stats
+
+    def idf(self, term: str) -> float:
+        """IDF from the last statistics fetched for `term` (e.g. by the search that
+        just ran); used to weight snippet terms without another round trip."""
+        with self._df_lock:
+            cached = self._df.get(term)
+        if cached is None:
+            cached = self.collection_stats([term]).df[term]
+        return idf(self._docs, cached)
+
+    def __call__(self, query: str, flt: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        terms = sorted(set(self.query_tokenizer(query)))
+        if not terms:
+            return []
+        collection = self.collection_stats(terms)
+        shards = [shard for shard in range(len(self.pool)) if self.plan.may_match(shard, flt)]
+        replies = self.pool.scatter("bm25_search", terms, self.k, flt, collection, shards=shards)
+        return heapq.nlargest(self.k, (hit for hits in replies.values() for hit in hits), key=lambda x: x[1])
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Shard the research index and serve the shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="split the research flat export into shards")
+    export.add_argument("--shards", type=int, default=4, help="hash shards")
+    export.add_argument("--by", choices=["hash", "year"], default="hash")
+    export.add_argument("--years", default="", help="year boundaries, e.g. 2010,2016,2020")
+    serve = commands.add_parser("serve", help="run every shard server of the exported plan")
+    serve.add_argument("--host", default=SHARD_HOST)
+    serve.add_argument("--port", type=int, default=SHARD_PORT)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        years = tuple(int(y) for y in args.years.split(",") if y.strip())
+        plan = ShardPlan(args.shards, args.by, years)
+        sizes = export_shards(plan)
+        print(f"✅ Exported {plan.count} shards to {SHARD_DIR}: {sizes}")
+        return
+
+    if not SHARD_AUTHKEY:
+        raise SystemExit("❌ Set CYSTERHOOD_SHARD_AUTHKEY to a long random secret shared with the app")
+    plan = load_plan()
+    if plan is None:
+        raise SystemExit(f"❌ No shard plan in {SHARD_DIR}; run `python sharding.py export` first")
+    _, processes = start_shard_servers(
+        plan, SHARD_AUTHKEY, host=args.host, port=args.port, daemon=False
+    )
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Query-aware source snippets.
+
+When a document is indexed, its sentences are analyzed one at a time: the
+doc store keeps the sentence start offsets next to the text, and, for the
+document's token stream, where each sentence's terms begin. For an answer,
+each cited document's snippet is the sentence, plus the next one when it
+fits, whose stored terms carry the most query-term weight (BM25 IDF, from
+the retrievers). Only that span of the text is read. Snippets ride along in
+`metadata["snippet"]`, so rendering a source never touches its full text.
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+SNIPPET_CHARS = 260
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[A-Z0-9])|\n\s*")
+
+
+class SentenceIndex(NamedTuple):
+    """A document's analyzed terms, split into sentences at index time."""
+
+    offsets: List[int]  # character offset where each sentence starts
+    term_starts: List[int]  # position in `terms` where each sentence's terms start
+    terms: List[str]
+
+
+def sentence_offsets(text: str) -> List[int]:
+    """Start offset of every sentence in `text` (the first is always 0)."""
+    return [0] + [m.end() for m in _SENTENCE_BREAK.finditer(text) if m.end() < len(text)]
+
+
+def analyze_sentences(text: str, analyzer: Callable[[str], List[str]]) -> SentenceIndex:
+    """Analyze `text` sentence by sentence.
+
+    Sentences break on whitespace, which never falls inside a token, so
+    `terms` is exactly `analyzer(text)`.
+    """
+    offsets = sentence_offsets(text)
+    bounds = offsets + [len(text)]
+    terms: List[str] = []
+    term_starts = []
+    for sentence in range(len(offsets)):
+        term_starts.append(len(terms))
+        terms.extend(analyzer(text[bounds[sentence]:bounds[sentence + 1]]))
+    return SentenceIndex(offsets, term_starts, terms)
+
+
+def pack_offsets(offsets: Sequence[int]) -> bytes:
+    return array("I", offsets).tobytes()
+
+
+def unpack_offsets(blob: bytes) -> List[int]:
+    offsets = array("I")
+    offsets.frombytes(blob)
+    return offsets.tolist()
+
+
+def _clip(text: str, start: int, end: int, focus: int, max_chars: int) -> str:
+    """`text[start:end]` cut to `max_chars` around `focus`, marked with ellipses."""
+    if end - start > max_chars:
+        start = max(start, min(focus - max_chars // 4, end - max_chars))
+        end = start + max_chars
+    snippet = " ".join(text[start:end].split())
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet = snippet.rstrip(".") + "..."
+    return snippet
+
+
+def select_snippet(
+    text: str,
+    query_terms: Sequence[str],
+    index: Optional[SentenceIndex] = None,
+    weight: Optional[Callable[[str], float]] = None,
+    max_chars: int = SNIPPET_CHARS,
+) -> str:
+    """The best sentence window of `text` for the analyzed `query_terms`.
+
+    Falls back to the opening when nothing matches or `index` is missing.
+    """
+    if not text:
+        return ""
+    if index is None or not index.offsets:
+        return _clip(text, 0, min(len(text), max_chars), 0, max_chars)
+    bounds = index.offsets + [len(text)]
+    if not query_terms:
+        return _clip(text, 0, bounds[1], 0, max_chars)
+
+    wanted = set(query_terms)
+    weights = {term: weight(term) if weight else 1.0 for term in wanted}
+    hits: Dict[int, Dict[str, int]] = {}
+    for position, term in enumerate(index.terms):
+        if term in wanted:
+            sentence = bisect_right(index.term_starts, position) - 1
+            hits.setdefault(sentence, {}).setdefault(term, position)
+    if not hits:
+        return _clip(text, 0, bounds[1], 0, max_chars)
+
+    def score(sentences: Sequence[int]) -> float:
+        found = set()
+        for s in sentences:
+            found.update(hits.get(s, ()))
+        return sum(weights.get(term, 0.0) for term in found)
+
+    best, best_score = None, -1.0
+    for sentence in sorted(hits):
+        window = [sentence]
+        # Take the next sentence too when both fit in the snippet.
+        if sentence + 1 < len(index.offsets) and bounds[sentence + 2] - bounds[sentence] <= max_chars:
+            window.append(sentence + 1)
+        window_score = score(window)
+        if window_score > best_score:
+            best, best_score = window, window_score
+    start, end = bounds[best[0]], bounds[best[-1] + 1]
+    return _clip(text, start, end, _focus(index, best[0], min(hits[best[0]].values()), end), max_chars)
+
+
+def _focus(index: SentenceIndex, sentence: int, position: int, end: int) -> int:
+    """Estimated character offset of term `position`, by its place in the sentence."""
+    starts = index.term_starts + [len(index.terms)]
+    first, count = starts[sentence], starts[sentence + 1] - starts[sentence]
+    start = index.offsets[sentence]
+    sentence_end = index.offsets[sentence + 1] if sentence + 1 < len(index.offsets) else end
+    return start + (position - first) * (sentence_end - start) // max(count, 1)
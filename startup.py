@@ -0,0 +1,244 @@
+"""Startup instrumentation and background loading of the RAG chain.
+
+Heavy imports and model loads are wrapped in `timed(component)` so cold-start
+cost is reported per component. Independent components are initialized
+concurrently by an `InitGraph`, so cold start is bounded by its critical path
+rather than the sum of all loads. `BackgroundLoader` builds the chain on a
+worker thread while the UI renders; calls submitted before it is ready are
+queued and dispatched as soon as the chain exists.
+"""
+
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from scheduler import FairScheduler
+
+WARM_UP_QUERY = "What is PCOS?"
+STARTUP_TIMINGS: Dict[str, float] = {}
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def timed(component: str):
+    """Record wall time spent in the block under `component`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _timings_lock:
+            STARTUP_TIMINGS[component] = STARTUP_TIMINGS.get(component, 0.0) + elapsed
+
+
+def format_timings(timings: Optional[Dict[str, float]] = None) -> str:
+    timings = STARTUP_TIMINGS if timings is None else timings
+    return "\n".join(
+        f"   {name:<32} {seconds:6.2f}s"
+        for name, seconds in sorted(timings.items(), key=lambda x: x[1], reverse=True)
+    )
+
+
+class InitGraph:
+    """A small DAG of initialization steps run on a thread pool.
+
+    Each node is a callable whose required parameters are named after the
+    nodes it depends on; it runs as soon as all of them have finished.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, Tuple[Callable, List[str]]] = {}
+        self.spans: Dict[str, Tuple[float, float]] = {}
+        self.results: Dict[str, Any] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> "InitGraph":
+        if not deps:
+            deps = [
+                p.name
+                for p in inspect.signature(fn).parameters.values()
+                if p.default is inspect.Parameter.empty
+            ]
+        self.nodes[name] = (fn, list(deps))
+        return self
+
+    def _run_node(self, name: str) -> Any:
+        fn, deps = self.nodes[name]
+        started = time.perf_counter()
+        try:
+            with timed(name):
+                return fn(**{dep: self.results[dep] for dep in deps})
+        finally:
+            self.spans[name] = (started, time.perf_counter())
+
+    def run(self, max_workers: Optional[int] = None) -> Dict[str, Any]:
+        for name, (_, deps) in self.nodes.items():
+            missing = [d for d in deps if d not in self.nodes]
+            if missing:
+                raise ValueError(f"Init node '{name}' depends on unknown {missing}")
+
+        self.started_at = time.perf_counter()
+        remaining = dict(self.nodes)
+        running: Dict[Future, str] = {}
+        with ThreadPoolExecutor(
+            max_workers=max_workers or len(self.nodes) or 1, thread_name_prefix="init"
+        ) as pool:
+            while remaining or running:
+                for name in [n for n, (_, deps) in remaining.items() if all(d in self.results for d in deps)]:
+                    del remaining[name]
+                    running[pool.submit(self._run_node, name)] = name
+                if not running:
+                    raise ValueError(f"Init graph has a dependency cycle: {sorted(remaining)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # Re-raises the first failure; queued nodes are abandoned.
+                    self.results[name] = future.result()
+        self.finished_at = time.perf_counter()
+        return self.results
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """The chain of dependencies that determined when the graph finished."""
+        if not self.spans:
+            return [], 0.0
+        name = max(self.spans, key=lambda n: self.spans[n][1])
+        path = [name]
+        while self.nodes[name][1]:
+            name = max(self.nodes[name][1], key=lambda d: self.spans[d][1])
+            path.append(name)
+        path.reverse()
+        return path, self.spans[path[-1]][1] - self.started_at
+
+    def report(self) -> str:
+        path, seconds = self.critical_path()
+        serial = sum(end - start for start, end in self.spans.values())
+        lines = [
+            f"⏱️ Init graph: {self.finished_at - self.started_at:.2f}s wall, "
+            f"{serial:.2f}s serial"
+        ]
+        for name, (start, end) in sorted(self.spans.items(), key=lambda x: x[1][0]):
+            marker = "*" if name in path else " "
+            lines.append(
+                f"  {marker} {name:<20} {start - self.started_at:6.2f}s → "
+                f"{end - self.started_at:6.2f}s"
+            )
+        lines.append(f"   critical path ({seconds:.2f}s): {' → '.join(path)}")
+        return "\n".join(lines)
+
+
+def build_default_chain(warm_up: bool = False, **chain_kwargs):
+    """The chain configuration the app serves; `chain_kwargs` go to `create_rag_chain`.
+
+    `warm_up` runs one retrieval and rerank so lazily initialized model and
+    index state exists before the process forks workers.
+    """
+    from query_rag import build_rag_components, create_rag_chain, retrieve_combined
+
+    retrievers, reranker = build_rag_components(include_patient_data=True, use_rerank=True)
+    if warm_up:
+        with timed("warm up"):
+            docs = retrieve_combined(retrievers, WARM_UP_QUERY)
+            if reranker is not None and docs:
+                reranker.predict([(WARM_UP_QUERY, d.page_content) for d in docs])
+    return create_rag_chain(
+        retrievers,
+        use_multiquery=True,
+        use_rerank=True,
+        reranker=reranker,
+        use_router=os.getenv("CYSTERHOOD_ROUTER", "1") != "0",
+        **chain_kwargs,
+    )
+
+
+class BackgroundLoader:
+    """Builds a chain off the main thread and queues calls until it is ready.
+
+    Calls go through a `FairScheduler`, which stays paused while loading, so
+    early questions wait in the same bounded, per-session fair queue as
+    everything else and are released the moment the chain exists.
+    """
+
+    PENDING = "pending"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        build: Callable[[], Callable] = build_default_chain,
+        scheduler: Optional[FairScheduler] = None,
+    ):
+        self.build = build
+        self.state = self.PENDING
+        self.error: Optional[BaseException] = None
+        self.chain_call: Optional[Callable] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.scheduler = scheduler or FairScheduler(paused=True)
+        self.scheduler.pause()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    @property
+    def queued(self) -> int:
+        return self.scheduler.stats()["queue_depth"]
+
+    def start(self) -> "BackgroundLoader":
+        with self._lock:
+            if self.state != self.PENDING:
+                return self
+            self.state = self.LOADING
+        self.started_at = time.perf_counter()
+        threading.Thread(target=self._load, name="rag-loader", daemon=True).start()
+        return self
+
+    def _load(self) -> None:
+        try:
+            with timed("total"):
+                chain_call = self.build()
+        except BaseException as e:
+            print(f"❌ Background load failed: {e}")
+            with self._lock:
+                self.state = self.FAILED
+                self.error = e
+            self.scheduler.fail_pending(e)
+            # Anything admitted after the drain fails fast in `_call`.
+            self.scheduler.resume()
+            self._ready.set()
+            return
+
+        self.load_seconds = time.perf_counter() - self.started_at
+        print(f"⏱️ RAG chain loaded in {self.load_seconds:.1f}s\n{format_timings()}")
+        with self._lock:
+            self.chain_call = chain_call
+            self.state = self.READY
+        self.scheduler.resume()
+        self._ready.set()
+
+    def _call(self, *args, **kwargs):
+        if self.chain_call is None:
+            raise self.error or RuntimeError("RAG chain is not loaded")
+        return self.chain_call(*args, **kwargs)
+
+    def submit(self, *args, session_id: str = "default", **kwargs) -> Future:
+        """Call the chain with these arguments, queueing until it is loaded.
+
+        Raises `SchedulerBusy` when the request cannot be admitted.
+        """
+        if self.state == self.FAILED:
+            future: Future = Future()
+            future.set_exception(self.error)
+            return future
+        return self.scheduler.submit(session_id, self._call, *args, **kwargs)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
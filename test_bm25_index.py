@@ -0,0 +1,95 @@
+"""BM25Index: incremental statistics must match a from-scratch build."""
+
+import pytest
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index, CollectionStats
+
+DOCS = {
+    "a": "metformin insulin resistance pcos",
+    "b": "insulin sensitivity diet exercise",
+    "c": "hirsutism androgens pcos pcos",
+    "d": "inositol ovulation pcos insulin",
+}
+
+
+def doc(text: str, **metadata) -> Document:
+    return Document(page_content=text, metadata=metadata)
+
+
+def build(docs: dict) -> BM25Index:
+    return BM25Index.from_documents([doc(t) for t in docs.values()], ids=list(docs))
+
+
+def assert_same_index(index: BM25Index, reference: BM25Index, queries=("pcos insulin", "diet", "androgens")):
+    assert len(index) == len(reference)
+    assert index.avgdl == pytest.approx(reference.avgdl)
+    for term in ("pcos", "insulin", "diet", "metformin", "androgens"):
+        assert index.df(term) == reference.df(term)
+    for query in queries:
+        got, want = index.search(query, k=10), reference.search(query, k=10)
+        assert [d for d, _ in got] == [d for d, _ in want]
+        assert [s for _, s in got] == pytest.approx([s for _, s in want])
+
+
+def test_upsert_and_delete_match_rebuild():
+    index = build(DOCS)
+    index.upsert("b", doc("insulin diet"))
+    index.upsert("e", doc("diet androgens weight"))
+    assert index.delete("a")
+    assert not index.delete("missing")
+
+    expected = {**DOCS, "b": "insulin diet", "e": "diet androgens weight"}
+    del expected["a"]
+    assert_same_index(index, build(expected))
+
+
+def test_apply_batch_matches_rebuild_and_bumps_generation():
+    index = build(DOCS)
+    generation = index.generation
+    index.apply(upserts={"c": doc("hirsutism"), "f": doc("pcos sleep apnea")}, deletes=["d"])
+    assert index.generation > generation
+
+    expected = {"a": DOCS["a"], "b": DOCS["b"], "c": "hirsutism", "f": "pcos sleep apnea"}
+    assert_same_index(index, build(expected))
+
+
+def test_deleting_every_document_empties_postings():
+    index = build(DOCS)
+    for doc_id in DOCS:
+        index.delete(doc_id)
+    assert len(index) == 0
+    assert index.avgdl == 0.0
+    assert index.df("pcos") == 0
+    assert index.search("pcos") == []
+
+
+def test_shards_scored_with_collection_stats_match_single_index():
+    whole = build(DOCS)
+    shards = [build({k: DOCS[k] for k in ("a", "b")}), build({k: DOCS[k] for k in ("c", "d")})]
+    terms = ["pcos", "insulin"]
+    parts = [shard.stats(terms) for shard in shards]
+    collection = CollectionStats(
+        sum(p.docs for p in parts),
+        sum(p.total_len for p in parts),
+        {t: sum(p.df[t] for p in parts) for t in terms},
+    )
+    merged = sorted(
+        (hit for shard in shards for hit in shard.search_terms(terms, k=10, collection=collection)),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+    want = whole.search_terms(terms, k=10)
+    assert [d for d, _ in merged] == [d for d, _ in want]
+    assert [s for _, s in merged] == pytest.approx([s for _, s in want])
+
+
+def test_facets_follow_upserts_and_deletes():
+    index = BM25Index()
+    index.upsert("a", doc("pcos", year=2019, chunk_type="abstract"))
+    index.upsert("b", doc("pcos", year=2021, chunk_type="body"))
+    index.upsert("a", doc("pcos", year=2022, chunk_type="body"))
+    assert index._facets["year"] == {2021: {"b"}, 2022: {"a"}}
+    index.delete("b")
+    assert index._facets["chunk_type"] == {"body": {"a"}}
+    assert [d for d, _ in index.search("pcos", allowed={"a"})] == ["a"]
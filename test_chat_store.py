@@ -0,0 +1,92 @@
+"""ChatStore ordering, ownership, concurrent appends and retention."""
+
+import threading
+import time
+
+import pytest
+
+from chat_store import ChatStore
+
+
+def message(i: int, role: str = "user", content: str = "") -> dict:
+    return {"id": f"m{i}", "role": role, "content": content or f"message {i}"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatStore(str(tmp_path / "chats.sqlite"))
+
+
+def test_messages_load_in_append_order(store):
+    for i in range(5):
+        store.append_message("alice", "c1", message(i, "user" if i % 2 == 0 else "assistant"))
+    assert [m["id"] for m in store.load_messages("alice", "c1")] == [f"m{i}" for i in range(5)]
+    assert store.load_messages("bob", "c1") == []
+    summary = store.list_chats("alice")[0]
+    assert summary.title == "message 0" and summary.message_count == 5
+
+
+def test_chats_page_most_recently_updated_first(store):
+    for chat_id in ("c1", "c2", "c3"):
+        store.append_message("alice", chat_id, message(0))
+        time.sleep(0.01)
+    store.append_message("alice", "c1", message(1, "assistant"))
+    store.append_message("bob", "other", message(0))
+
+    assert [c.chat_id for c in store.list_chats("alice")] == ["c1", "c3", "c2"]
+    assert [c.chat_id for c in store.list_chats("alice", limit=1, offset=1)] == ["c3"]
+    assert store.count_chats("alice") == 3
+
+
+def test_other_owners_cannot_append(store):
+    store.append_message("alice", "c1", message(0))
+    with pytest.raises(PermissionError):
+        store.append_message("bob", "c1", message(1))
+    assert len(store.load_messages("alice", "c1")) == 1
+
+
+def test_concurrent_appends_keep_seq_contiguous(tmp_path):
+    path = str(tmp_path / "chats.sqlite")
+    stores = [ChatStore(path), ChatStore(path)]
+    errors = []
+
+    def append(store, tab):
+        try:
+            for i in range(50):
+                store.append_message("alice", "c1", message(f"{tab}-{i}"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=append, args=(s, tab)) for tab, s in enumerate(stores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    seqs = [row[0] for row in stores[0]._connect().execute("SELECT seq FROM messages ORDER BY seq")]
+    assert seqs == list(range(100))
+    assert stores[0].list_chats("alice")[0].message_count == 100
+
+
+def test_top_questions_count_only_opening_questions(store):
+    store.append_message("alice", "c1", message(0, content="What is PCOS?"))
+    store.append_message("alice", "c1", message(1, content="Is it genetic?"))
+    store.append_message("alice", "c2", message(0, content="what is pcos? "))
+    store.append_message("alice", "c2", message(1, content="Is it genetic?"))
+    store.append_message("alice", "c3", message(0, content="Is it genetic?"))
+    assert store.top_questions(2) == ["What is PCOS?", "Is it genetic?"]
+
+
+def test_retention_drops_expired_and_excess_chats(store):
+    for chat_id in ("c1", "c2", "c3"):
+        store.append_message("alice", chat_id, message(0))
+        time.sleep(0.01)
+    store.append_message("bob", "b1", message(0))
+
+    assert store.enforce_retention("alice", max_chats=2) == 1
+    assert [c.chat_id for c in store.list_chats("alice")] == ["c3", "c2"]
+    assert store.load_messages("alice", "c1") == []
+
+    assert store.enforce_retention(retention_days=0) == 3
+    assert store.count_chats("alice") == store.count_chats("bob") == 0
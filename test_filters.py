@@ -0,0 +1,79 @@
+"""RetrievalFilter parsing, validation and push-down into the BM25 facets."""
+
+import pytest
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from filters import RetrievalFilter
+
+
+@pytest.mark.parametrize("data", [None, {}, {"year_min": None, "corpora": None}])
+def test_empty_filters_parse_to_none(data):
+    assert RetrievalFilter.from_dict(data) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"year": 2020},
+        {"year_min": "2020"},
+        {"year_min": 2020.5},
+        {"year_max": True},
+        {"year_min": 2021, "year_max": 2019},
+        {"corpora": ["research", 3]},
+        {"corpora": {"research": 1}},
+        {"chunk_types": 7},
+    ],
+)
+def test_bad_filters_raise_value_error(data):
+    with pytest.raises(ValueError):
+        RetrievalFilter.from_dict(data)
+
+
+def test_values_are_normalized_so_equal_filters_hash_equally():
+    a = RetrievalFilter.from_dict({"corpora": ["patient", "research", "patient"]})
+    b = RetrievalFilter.from_dict({"corpora": ["research", "patient"]})
+    assert a == b and hash(a) == hash(b)
+    assert RetrievalFilter(corpora="research").corpora == ("research",)
+
+
+def test_matches_requires_the_constrained_fields():
+    flt = RetrievalFilter(year_min=2015, year_max=2020, chunk_types=("abstract",))
+    assert flt.matches({"year": 2018, "chunk_type": "abstract"})
+    assert not flt.matches({"year": 2021, "chunk_type": "abstract"})
+    assert not flt.matches({"year": 2018, "chunk_type": "body"})
+    # Patient articles have no year, so a year range never admits them.
+    assert not flt.matches({"chunk_type": "abstract"})
+    assert not flt.matches({"year": float("nan"), "chunk_type": "abstract"})
+    assert not RetrievalFilter(corpora=("research",)).matches({}, corpus="patient")
+
+
+def test_chroma_where():
+    assert RetrievalFilter(corpora=("research",)).chroma_where() is None
+    assert RetrievalFilter(year_min=2015).chroma_where() == {"year": {"$gte": 2015}}
+    assert RetrievalFilter(year_min=2015, chunk_types=("abstract",)).chroma_where() == {
+        "$and": [{"year": {"$gte": 2015}}, {"chunk_type": {"$in": ["abstract"]}}]
+    }
+
+
+def test_bm25_allowed_ids_agree_with_matches():
+    metadata = {
+        "a": {"year": 2012, "chunk_type": "abstract"},
+        "b": {"year": 2018, "chunk_type": "abstract"},
+        "c": {"year": 2018, "chunk_type": "body"},
+        "d": {"chunk_type": "abstract"},
+        "e": {"year": 2023},
+    }
+    index = BM25Index()
+    for doc_id, meta in metadata.items():
+        index.upsert(doc_id, Document(page_content="pcos", metadata=meta))
+
+    for flt in [
+        RetrievalFilter(year_min=2015),
+        RetrievalFilter(year_max=2018, chunk_types=("abstract",)),
+        RetrievalFilter(chunk_types=("body", "abstract")),
+    ]:
+        expected = {doc_id for doc_id, meta in metadata.items() if flt.matches(meta)}
+        assert index.allowed(flt) == expected
+        assert {d for d, _ in index.search("pcos", k=10, allowed=index.allowed(flt))} == expected
+    assert index.allowed(RetrievalFilter(corpora=("research",))) is None
@@ -0,0 +1,68 @@
+"""Weighted reciprocal rank fusion and the id-returning hybrid retriever."""
+
+import pytest
+from langchain_core.documents import Document
+
+from doc_store import DocHandle, DocStore
+from filters import RetrievalFilter
+from hybrid_search import RRF_C, HybridRetriever, reciprocal_rank_fusion
+
+
+def ranked(*doc_ids):
+    return [(doc_id, 1.0 / (i + 1)) for i, doc_id in enumerate(doc_ids)]
+
+
+def test_scores_are_weighted_reciprocal_ranks():
+    fused = dict(reciprocal_rank_fusion([ranked("a", "b"), ranked("b", "c")], [0.7, 0.3]))
+    assert fused["a"] == pytest.approx(0.7 / (1 + RRF_C))
+    assert fused["b"] == pytest.approx(0.7 / (2 + RRF_C) + 0.3 / (1 + RRF_C))
+    assert fused["c"] == pytest.approx(0.3 / (2 + RRF_C))
+
+
+def test_agreement_beats_a_single_top_hit():
+    fused = reciprocal_rank_fusion([ranked("a", "b"), ranked("b", "c")], [0.5, 0.5])
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "c"]
+
+
+def test_weights_decide_between_lists():
+    lists = [ranked("vector_top"), ranked("bm25_top")]
+    assert reciprocal_rank_fusion(lists, [0.7, 0.3])[0][0] == "vector_top"
+    assert reciprocal_rank_fusion(lists, [0.3, 0.7])[0][0] == "bm25_top"
+
+
+def test_ties_keep_first_appearance():
+    fused = reciprocal_rank_fusion([ranked("a", "b"), ranked("b", "a")], [0.5, 0.5])
+    assert [doc_id for doc_id, _ in fused] == ["a", "b"]
+    assert reciprocal_rank_fusion([[], []], [0.5, 0.5]) == []
+
+
+class FixedSearch:
+    def __init__(self, hits):
+        self.hits = hits
+        self.calls = 0
+
+    def __call__(self, query, flt=None):
+        self.calls += 1
+        return self.hits
+
+
+def test_hybrid_retriever_fuses_to_handles_and_materializes(tmp_path):
+    store = DocStore(str(tmp_path / "docs.sqlite"))
+    store.upsert(
+        "research",
+        {d: Document(page_content=f"text {d}", metadata={"doc_id": d}) for d in ("a", "b", "c")},
+    )
+    retriever = HybridRetriever(
+        "research", [FixedSearch(ranked("a", "b")), FixedSearch(ranked("b", "c"))], [0.5, 0.5], store
+    )
+    handles = retriever.search("pcos")
+    assert [h.doc_id for h in handles] == ["b", "a", "c"]
+    assert all(isinstance(h, DocHandle) and h.corpus == "research" for h in handles)
+    assert [d.page_content for d in retriever.invoke("pcos")] == ["text b", "text a", "text c"]
+
+
+def test_filters_for_other_corpora_skip_every_search(tmp_path):
+    searches = [FixedSearch(ranked("a")), FixedSearch(ranked("b"))]
+    retriever = HybridRetriever("research", searches, [0.5, 0.5], DocStore(str(tmp_path / "docs.sqlite")))
+    assert retriever.search("pcos", RetrievalFilter(corpora=("patient",))) == []
+    assert [s.calls for s in searches] == [0, 0]
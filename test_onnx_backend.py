@@ -0,0 +1,42 @@
+"""Parity of the int8 ONNX backend with the PyTorch models it was exported from.
+
+Skipped unless `python onnx_backend.py export` has written the models.
+"""
+
+import os
+
+import pytest
+
+import onnx_backend
+from onnx_backend import (
+    MAX_RERANK_SCORE_DELTA,
+    MIN_EMBEDDING_COSINE,
+    MIN_RERANK_SPEARMAN,
+    ONNX_DIR,
+)
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+pytest.importorskip("sentence_transformers")
+if not all(
+    os.path.exists(os.path.join(ONNX_DIR, name, "model.int8.onnx")) for name in ("embedder", "reranker")
+):
+    pytest.skip(f"no exported ONNX models in {ONNX_DIR}", allow_module_level=True)
+
+
+@pytest.fixture(scope="module")
+def report():
+    return onnx_backend.parity_report()
+
+
+def test_embeddings_match_torch(report):
+    assert report["min_cosine"] >= MIN_EMBEDDING_COSINE
+
+
+def test_rerank_order_matches_torch(report):
+    assert report["top_match"]
+    assert report["spearman"] >= MIN_RERANK_SPEARMAN
+
+
+def test_rerank_scores_within_tolerance(report):
+    assert report["max_score_delta"] <= MAX_RERANK_SCORE_DELTA
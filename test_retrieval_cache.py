@@ -0,0 +1,73 @@
+"""Retrieval cache keys, expiry, and invalidation when the corpus changes."""
+
+import time
+
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from doc_store import DocStore
+from hybrid_search import BM25Search, HybridRetriever
+from retrieval_cache import RetrievalCache, cache_key, normalize_query
+
+CONFIG = {"retrievers": ["research"], "multiquery": False, "rerank": True}
+
+
+def test_normalized_queries_share_a_key():
+    assert normalize_query("  What is  PCOS?? ") == normalize_query("what is pcos")
+    assert normalize_query("ＰＣＯＳ") == "pcos"
+    assert cache_key("What is PCOS?", CONFIG, (1,)) == cache_key("what is pcos", CONFIG, (1,))
+
+
+def test_config_and_corpus_version_change_the_key():
+    key = cache_key("pcos", CONFIG, (1, 0))
+    assert cache_key("pcos", {**CONFIG, "rerank": False}, (1, 0)) != key
+    assert cache_key("pcos", CONFIG, (2, 0)) != key
+    assert cache_key("pcos", CONFIG, (1, 1)) != key
+
+
+def test_put_get_and_expiry(tmp_path):
+    cache = RetrievalCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put("k", "PCOS?", ["a", "b"], 0.9, None)
+    hit = cache.get("k")
+    assert hit.doc_ids == ["a", "b"]
+    assert hit.top_rerank_score == 0.9 and hit.top_vector_score is None
+    assert cache.get("other") is None
+
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get("k") is None
+
+
+def test_prune_keeps_the_newest_entries(tmp_path):
+    cache = RetrievalCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in ("k1", "k2", "k3"):
+        cache.put(key, key, [key], None, None)
+        time.sleep(0.01)
+    cache.prune()
+    assert cache.get("k1") is None
+    assert cache.get("k2") is not None and cache.get("k3") is not None
+
+
+def test_corpus_writes_change_the_version_the_key_is_built_from(tmp_path):
+    store = DocStore(str(tmp_path / "docs.sqlite"))
+    index = BM25Index(store_documents=False)
+    retriever = HybridRetriever("research", [BM25Search(index)], [1.0], store)
+
+    def key():
+        return cache_key("pcos", CONFIG, [store.version(), retriever.version])
+
+    before = key()
+    assert key() == before
+
+    doc = Document(page_content="pcos insulin", metadata={"doc_id": "a"})
+    store.upsert("research", {"a": doc})
+    after_store = key()
+    assert after_store != before
+
+    index.upsert("a", doc)
+    after_index = key()
+    assert after_index != after_store
+
+    store.delete(["a"])
+    index.delete("a")
+    assert key() not in (before, after_store, after_index)
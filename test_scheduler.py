@@ -0,0 +1,42 @@
+"""FairScheduler: round-robin across sessions and admission limits."""
+
+import pytest
+
+from scheduler import FairScheduler, SchedulerBusy
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = FairScheduler(max_concurrency=1, max_queue=10, max_per_session=5, paused=True, name="test_rr")
+    order = []
+    futures = [scheduler.submit("chatty", order.append, f"chatty-{i}") for i in range(3)]
+    futures += [scheduler.submit("quiet", order.append, "quiet-0")]
+    futures += [scheduler.submit("late", order.append, "late-0")]
+    scheduler.resume()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["chatty-0", "quiet-0", "late-0", "chatty-1", "chatty-2"]
+
+
+def test_full_queues_are_rejected():
+    scheduler = FairScheduler(max_concurrency=1, max_queue=3, max_per_session=2, paused=True, name="test_busy")
+    scheduler.submit("a", int)
+    scheduler.submit("a", int)
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("a", int)
+    scheduler.submit("b", int)
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit("c", int)
+    assert scheduler.stats()["rejected"] == 2
+
+
+def test_errors_reach_the_caller_and_pending_work_can_be_failed():
+    scheduler = FairScheduler(max_concurrency=1, paused=True, name="test_errors")
+    pending = scheduler.submit("a", int)
+    scheduler.fail_pending(RuntimeError("shutting down"))
+    with pytest.raises(RuntimeError, match="shutting down"):
+        pending.result(timeout=5)
+
+    scheduler.resume()
+    with pytest.raises(ValueError):
+        scheduler.submit("a", int, "not a number").result(timeout=5)
+    assert scheduler.submit("a", int, "7").result(timeout=5) == 7
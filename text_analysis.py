@@ -0,0 +1,129 @@
+"""Text analysis for the BM25 indexes.
+
+`Analyzer` turns text into index terms: Unicode NFKC normalization and case
+folding, tokens split on punctuation (inner hyphens only survive in
+protected terms), stopwords (English function words plus boilerplate of
+medical abstracts) dropped, and a light suffix stemmer so "treated",
+"treating" and "treatment" meet. Medical abbreviations such as PCOS, HbA1c
+and HOMA-IR are protected: never stemmed, split or dropped.
+
+Documents are analyzed once, when they are written to the doc store, which
+keeps the token stream next to the text (tagged with `ANALYZER_VERSION`).
+Queries go through `Analyzer.query`, which memoizes recent queries so the
+research and patient indexes share one analysis per question.
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import FrozenSet, List, Tuple
+
+# Bump when analysis changes so stored token streams are rebuilt.
+ANALYZER_VERSION = 1
+
+STOPWORDS = frozenset(
+    # English function words
+    "a about above after again against all am an and any are as at be because been before "
+    "being below between both but by can could did do does doing down during each few for "
+    "from further had has have having he her here hers herself him himself his how i if in "
+    "into is it its itself just me more most my myself no nor not now of off on once only or "
+    "other our ours ourselves out over own same she should so some such than that the their "
+    "theirs them themselves then there these they this those through to too under until up "
+    "very was we were what when where which while who whom why will with would you your "
+    "yours yourself yourselves "
+    # Boilerplate of abstracts and patient articles
+    "al also although among background conclusion conclusions et however including method "
+    "methods objective objectives patient patients purpose respectively result results study "
+    "studies thus therefore using via whereas within".split()
+)
+
+PROTECTED = frozenset(
+    "pcos pcom hba1c homa-ir bmi whr lh fsh amh shbg dhea dhea-s dheas ivf icsi iui ogtt "
+    "t2dm gdm tsh ocp ocps coc cocs nafld cvd igf-1 e2 hrt crp ldl hdl".split()
+)
+
+_TOKEN = re.compile(r"[^\W_]+(?:[-'’][^\W_]+)*")
+_MIN_STEM = 3
+
+
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Light English suffix stripping (plurals, -ed/-ing/-ly/-ment/-ation, final e)."""
+    if len(word) <= _MIN_STEM + 1 or not word.isalpha():
+        return word
+    for suffix, replacement in (
+        ("ational", "ate"),
+        ("ization", "ize"),
+        ("ations", "ate"),
+        ("ation", "ate"),
+        ("ments", ""),
+        ("ment", ""),
+        ("ness", ""),
+        ("ingly", ""),
+        ("edly", ""),
+        ("sses", "ss"),
+        ("ies", "y"),
+        ("ing", ""),
+        ("ed", ""),
+        ("ly", ""),
+        ("es", "e"),
+        ("s", ""),
+    ):
+        if word.endswith(suffix) and len(word) - len(suffix) + len(replacement) >= _MIN_STEM:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                break
+            word = word[: len(word) - len(suffix)] + replacement
+            # "stopped" -> "stopp" -> "stop"
+            if suffix in ("ed", "ing") and len(word) > _MIN_STEM and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+    if word.endswith("e") and len(word) > _MIN_STEM + 1:
+        word = word[:-1]
+    return word
+
+
+class Analyzer:
+    """Callable text -> terms pipeline; pass as a `BM25Index` tokenizer."""
+
+    def __init__(
+        self,
+        stopwords: FrozenSet[str] = STOPWORDS,
+        protected: FrozenSet[str] = PROTECTED,
+        stemming: bool = True,
+        version: int = ANALYZER_VERSION,
+    ):
+        self.stopwords = stopwords
+        self.protected = protected
+        self.stemming = stemming
+        self.version = version
+        self._query = lru_cache(maxsize=1024)(self._analyze_query)
+
+    def _terms(self, token: str, out: List[str]) -> None:
+        if token in self.protected:
+            out.append(token)
+            return
+        for part in token.split("-"):
+            part = part.replace("’", "'")
+            if part.endswith("'s"):
+                part = part[:-2]
+            part = part.replace("'", "")
+            if part in self.protected:
+                out.append(part)
+            elif len(part) > 1 and part not in self.stopwords:
+                out.append(stem(part) if self.stemming else part)
+
+    def __call__(self, text: str) -> List[str]:
+        out: List[str] = []
+        for token in _TOKEN.findall(unicodedata.normalize("NFKC", text).casefold()):
+            self._terms(token, out)
+        return out
+
+    def _analyze_query(self, query: str) -> Tuple[str, ...]:
+        return tuple(self(query))
+
+    def query(self, query: str) -> List[str]:
+        """Terms of `query`, memoized: every index searched for it reuses them."""
+        return list(self._query(query))
+
+
+ANALYZER = Analyzer()
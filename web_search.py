@@ -0,0 +1,136 @@
+"""Cached, prefetchable web search fallback.
+
+`WebSearch.prefetch(query)` starts a Bing search on a small thread pool and
+returns a future, so the chain can launch it as soon as early vector scores
+look weak and only wait on it if the final retrieval confidence confirms low
+recall. Results are cached per normalized query for
+`CYSTERHOOD_WEB_CACHE_TTL` seconds; empty results (no API key, a failed
+request) only for `CYSTERHOOD_WEB_NEGATIVE_TTL`, so one transient failure
+does not switch the fallback off for that query. Web documents are marked with
+`metadata["web"] = True` and `source` "Web (Bing)", plus `cached` when served
+from the cache.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+from langchain_core.documents import Document
+
+from metrics import REGISTRY
+
+BING_URL = "https://api.bing.microsoft.com/v7.0/search"
+CACHE_TTL = float(os.getenv("CYSTERHOOD_WEB_CACHE_TTL", "86400"))
+NEGATIVE_TTL = float(os.getenv("CYSTERHOOD_WEB_NEGATIVE_TTL", "60"))
+CACHE_SIZE = 512
+REQUEST_TIMEOUT = 10
+WEB_SOURCE = "Web (Bing)"
+
+
+def bing_search(query: str, count: int = 5) -> List[dict]:
+    """Raw Bing web results (`name`, `url`, `snippet`); empty without an API key."""
+    api_key = os.getenv("BING_API_KEY")
+    if not api_key:
+        print("❌ BING_API_KEY not set.")
+        return []
+
+    headers = {"Ocp-Apim-Subscription-Key": api_key}
+    params = {
+        "q": query,
+        "count": count,
+        "textDecorations": True,
+        "textFormat": "HTML",
+    }
+    response = requests.get(BING_URL, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        print("❌ Web search failed:", response.text)
+        return []
+    return response.json().get("webPages", {}).get("value", [])
+
+
+def _normalize(query: str) -> str:
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+
+class WebSearch:
+    def __init__(
+        self,
+        search=bing_search,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_SIZE,
+        negative_ttl: float = NEGATIVE_TTL,
+    ):
+        self.search = search
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web")
+        self._requests = REGISTRY.counter("web.requests")
+        self._cache_hits = REGISTRY.counter("web.cache_hits")
+
+    def _cached(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, results = entry
+        if time.time() - stored_at > (self.ttl if results else self.negative_ttl):
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return results
+
+    def _fetch(self, key: str, query: str) -> List[Document]:
+        try:
+            results = self.search(query)
+            with self._lock:
+                self._cache[key] = (time.time(), results)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return web_documents(results, cached=False)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def prefetch(self, query: str) -> Future:
+        """Future of web `Document`s for `query`; concurrent calls share one request."""
+        key = _normalize(query)
+        with self._lock:
+            results = self._cached(key)
+            if results is not None:
+                self._cache_hits.inc()
+                future: Future = Future()
+                future.set_result(web_documents(results, cached=True))
+                return future
+            future = self._inflight.get(key)
+            if future is None:
+                self._requests.inc()
+                future = self._executor.submit(self._fetch, key, query)
+                self._inflight[key] = future
+            return future
+
+    def documents(self, query: str) -> List[Document]:
+        return self.prefetch(query).result()
+
+
+def web_documents(results: List[dict], cached: bool) -> List[Document]:
+    return [
+        Document(
+            page_content=f"{r.get('name', '')} ({r.get('url', '')}): {r.get('snippet', '')}",
+            metadata={
+                "title": r.get("name", "Web"),
+                "url": r.get("url"),
+                "source": WEB_SOURCE,
+                "web": True,
+                "cached": cached,
+            },
+        )
+        for r in results
+    ]